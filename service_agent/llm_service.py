@@ -1,65 +1,177 @@
-import requests
+import asyncio
+import email.utils
 import json
-import time
 import logging
-import os
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import httpx
 from fastapi import HTTPException
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Statuses worth retrying: rate limit, transient upstream failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
 
 class LLMService:
-    def __init__(self, api_key: str, api_url: str = "https://api.groq.com/openai/v1/chat/completions"):
+    def __init__(self, api_key: str, api_url: str = "https://api.groq.com/openai/v1/chat/completions",
+                 max_concurrency: int = 16, connect_timeout: float = 5.0, read_timeout: float = 60.0,
+                 max_retries: int = 3, backoff_base: float = 1.0, backoff_max: float = 30.0,
+                 max_retry_after: float = 60.0, http2: bool = True):
+        """
+        Async client for the Groq chat completions API.
+
+        Requests share one httpx.AsyncClient, so TLS connections are pooled and
+        reused (multiplexed over HTTP/2 when the server supports it). At most
+        max_concurrency requests are in flight; the rest wait on a semaphore
+        without blocking the event loop. Rate limits and transient errors are
+        retried with exponential backoff and full jitter, or after the delay
+        from Retry-After when the server sends one.
+
+        Args:
+            api_key (str): Groq API key.
+            api_url (str): Chat completions endpoint.
+            max_concurrency (int): Maximum number of concurrent API requests.
+            connect_timeout (float): Connection timeout, seconds.
+            read_timeout (float): Timeout between bytes of the response, seconds.
+            max_retries (int): Total attempts per request.
+            backoff_base (float): Backoff for the first retry, seconds (doubles each attempt).
+            backoff_max (float): Upper bound of the backoff, seconds.
+            max_retry_after (float): Longer Retry-After delays fail the request immediately.
+            http2 (bool): Negotiate HTTP/2.
+        """
         self.api_key = api_key
         self.api_url = api_url
         if not api_key:
             raise ValueError("GROQ_API_KEY must be provided.")
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.client = httpx.AsyncClient(
+            http2=http2, timeout=self.timeout,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+            headers={"Authorization": f"Bearer {self.api_key}"})
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.retries = 0
 
-    def _call_groq_api(self, prompt: str, max_retries: int = 3, retry_delay: float = 2.0) -> dict:
-        """Internal method to call Groq API with retries."""
-        for attempt in range(max_retries):
-            try:
-                headers = {
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json"
-                }
-                data = {
-                    "model": "llama3-70b-8192",
-                    "messages": [
-                        {"role": "system", "content": "You are a helpful assistant that generates structured JSON output."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    "response_format": {"type": "json_object"},
-                    "temperature": 0.8
-                }
-                response = requests.post(
-                    self.api_url, headers=headers, json=data)
-                response.raise_for_status()
+    async def aclose(self):
+        await self.client.aclose()
 
-                response_data = response.json()
-                logger.info("Groq API response: %s", response_data)
+    def _backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Delay before the next attempt: Retry-After if given, otherwise exponential with full jitter."""
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
 
-                if "choices" not in response_data or not response_data["choices"]:
-                    raise HTTPException(
-                        status_code=500, detail=f"Invalid response from Groq API: {response_data}")
+    async def _acquire(self):
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
 
-                content = response_data["choices"][0]["message"]["content"]
-                return json.loads(content)
+    def _release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    async def _retry(self, attempt: int, reason: str, retry_after: Optional[float] = None):
+        delay = self._backoff(attempt, retry_after)
+        logger.warning("Groq API %s, retrying in %.2f seconds...", reason, delay)
+        self.retries += 1
+        await asyncio.sleep(delay)
+
+    @staticmethod
+    def _request_data(prompt: str, stream: bool = False) -> dict:
+        data = {
+            "model": "llama3-70b-8192",
+            "messages": [
+                {"role": "system", "content": "You are a helpful assistant that generates structured JSON output."},
+                {"role": "user", "content": prompt}
+            ],
+            "response_format": {"type": "json_object"},
+            "temperature": 0.8
+        }
+        if stream:
+            data["stream"] = True
+        return data
+
+    @asynccontextmanager
+    async def _request(self, data: dict, stream: bool = False, max_retries: Optional[int] = None):
+        """
+        POST to Groq API with retries, yields a successful response.
+
+        Retries happen only before the response body is consumed, so a
+        streamed completion is never restarted midway. The concurrency slot
+        is held until the response is closed.
+        """
+        max_retries = max_retries or self.max_retries
+        for attempt in range(max_retries):
+            last_attempt = attempt == max_retries - 1
+            await self._acquire()
+            try:
+                response = await self.client.send(
+                    self.client.build_request("POST", self.api_url, json=data), stream=stream)
+            except httpx.TimeoutException as e:
+                self._release()
+                if last_attempt:
+                    raise HTTPException(status_code=504, detail=f"Groq API timeout: {type(e).__name__}")
+                await self._retry(attempt, f"timeout ({type(e).__name__})")
+                continue
+            except httpx.TransportError as e:
+                self._release()
+                if last_attempt:
+                    raise HTTPException(status_code=502, detail=f"Groq API connection error: {str(e)}")
+                await self._retry(attempt, f"connection error ({e})")
+                continue
+            except BaseException:
+                self._release()
+                raise
 
-            except requests.exceptions.HTTPError as e:
-                status_code = response.status_code
-                error_detail = response.json().get("error", {}).get("message", str(e))
+            status_code = response.status_code
+            if status_code >= 400:
+                try:
+                    await response.aread()
+                finally:
+                    await response.aclose()
+                    self._release()
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                if (status_code in RETRY_STATUSES and not last_attempt
+                        and (retry_after is None or retry_after <= self.max_retry_after)):
+                    await self._retry(attempt, f"returned {status_code}", retry_after)
+                    continue
+                try:
+                    error_detail = response.json().get("error", {}).get("message", response.text)
+                except (json.JSONDecodeError, AttributeError):
+                    error_detail = response.text
                 if status_code == 400:
                     raise HTTPException(
                         status_code=400, detail=f"Bad request to Groq API: {error_detail}")
                 if status_code == 429:
-                    if attempt < max_retries - 1:
-                        logger.warning(
-                            "Rate limit exceeded, retrying in %s seconds...", retry_delay)
-                        time.sleep(retry_delay)
-                        continue
                     raise HTTPException(
                         status_code=429, detail=f"Rate limit exceeded: {error_detail}")
                 elif status_code == 401:
@@ -68,22 +180,67 @@ class LLMService:
                 else:
                     raise HTTPException(
                         status_code=status_code, detail=f"Groq API error: {error_detail}")
+
+            try:
+                yield response
+            finally:
+                await response.aclose()
+                self._release()
+            return
+
+        raise HTTPException(
+            status_code=500, detail="Max retries exceeded for Groq API request.")
+
+    async def _call_groq_api(self, prompt: str, max_retries: Optional[int] = None) -> dict:
+        """Internal method to call Groq API with retries."""
+        async with self._request(self._request_data(prompt), max_retries=max_retries) as response:
+            try:
+                response_data = response.json()
+                logger.info("Groq API response: %s", response_data)
+
+                if "choices" not in response_data or not response_data["choices"]:
+                    raise HTTPException(
+                        status_code=500, detail=f"Invalid response from Groq API: {response_data}")
+
+                content = response_data["choices"][0]["message"]["content"]
+                return json.loads(content)
+
             except json.JSONDecodeError:
                 raise HTTPException(
                     status_code=500, detail="Failed to parse JSON response from Groq API.")
             except KeyError as e:
                 raise HTTPException(
                     status_code=500, detail=f"Unexpected response structure from Groq API: missing {str(e)}")
-            except Exception as e:
-                raise HTTPException(
-                    status_code=500, detail=f"Unexpected error: {str(e)}")
 
-        raise HTTPException(
-            status_code=500, detail="Max retries exceeded for Groq API request.")
+    async def _stream_groq_api(self, prompt: str) -> AsyncIterator[str]:
+        """Internal method to stream a completion from Groq API: yields content deltas."""
+        async with self._request(self._request_data(prompt, stream=True), stream=True) as response:
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    return
+                chunk = json.loads(payload)
+                if "error" in chunk:
+                    raise HTTPException(
+                        status_code=502, detail=f"Groq API stream error: {chunk['error'].get('message', chunk)}")
+                choices = chunk.get("choices") or []
+                content = choices[0].get("delta", {}).get("content") if choices else None
+                if content:
+                    yield content
 
-    def generate_roadmap(self, description: str) -> dict:
-        """Generate a new roadmap based on description."""
-        prompt = f"""
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "retries": self.retries,
+        }
+
+    @staticmethod
+    def _roadmap_prompt(description: str) -> str:
+        return f"""
         Сгенерируй дорожную карту в формате JSON на основе описания: '{description}'.
         Дорожная карта состоит из шагов - steps (от 5 до 15), каждый шаг состоит из составляющих - substeps (от 2 до 15).
         Дорожная карта должна содержать заголовок - 'title' (строка) и массив 'steps', где каждый шаг - 'step' имеет имя - 'name' (строка),
@@ -238,9 +395,16 @@ class LLMService:
             ]
         }}
         """
-        return self._call_groq_api(prompt)
 
-    def update_roadmap(self, current_roadmap: dict, command: str) -> dict:
+    async def generate_roadmap(self, description: str) -> dict:
+        """Generate a new roadmap based on description."""
+        return await self._call_groq_api(self._roadmap_prompt(description))
+
+    def stream_roadmap(self, description: str) -> AsyncIterator[str]:
+        """Generate a new roadmap as a stream of JSON text fragments (see roadmap_stream.py)."""
+        return self._stream_groq_api(self._roadmap_prompt(description))
+
+    async def update_roadmap(self, current_roadmap: dict, command: str) -> dict:
         """Update an existing roadmap based on a command."""
         logger.info("Updating roadmap with command: %s", command)
         prompt = f"""
@@ -249,4 +413,4 @@ class LLMService:
         Верните обновленную карту маршрутов в формате JSON с теми же структурами (заголовок и шаги).
         Убедитесь, что вывод является допустимым JSON и не содержит дополнительного текста, маркировок или кода.
         """
-        return self._call_groq_api(prompt)
+        return await self._call_groq_api(prompt)
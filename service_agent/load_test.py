@@ -0,0 +1,234 @@
+"""
+Load test of LLMService against a local stub of the Groq API.
+
+The stub answers every chat completion after --latency seconds, like a long
+LLM generation, and returns 429 with Retry-After for a --rate-limit fraction
+of requests. For each concurrency cap, --requests roadmap generations are
+started at once. The report shows throughput against the ideal
+cap / latency, latency percentiles, retries and the longest event-loop
+stall seen by a probe task. Because the client never blocks the loop, the
+stall stays in milliseconds instead of growing to the LLM latency.
+
+With --stream the stub sends the completion as server-sent events spread
+over --latency, and the report adds the median time until the first
+roadmap step is parsed (see roadmap_stream.py).
+
+The stub speaks plain HTTP/1.1, so HTTP/2 is off unless --http2 is given
+(httpx negotiates HTTP/2 only over TLS).
+
+Example:
+    python load_test.py --requests 64 --latency 1.0 --concurrency 1 4 16 64
+    python load_test.py --rate-limit 0.1 --retry-after 0.5 --output load_test.json
+    python load_test.py --stream --latency 10 --concurrency 16
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from llm_service import LLMService
+from roadmap_stream import RoadmapStreamParser, percentile
+
+ROADMAP = {"title": "Stub roadmap",
+           "steps": [{"name": f"Step {i}", "steps": [{"name": f"Substep {i}.{j}"} for j in range(5)]}
+                     for i in range(10)]}
+
+
+class StubServer:
+    def __init__(self, latency: float, rate_limit: float, retry_after: float):
+        """Minimal keep-alive HTTP/1.1 server imitating the chat completions endpoint."""
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.requests = 0
+        self.concurrent = 0
+        self.max_concurrent = 0
+        self.server = None
+
+    async def start(self, port: int = 0) -> str:
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", port)
+        return f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}/v1/chat/completions"
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.decode("latin-1").split("\r\n")[1:]:
+                    name, _, value = line.partition(":")
+                    if name.lower() == "content-length":
+                        length = int(value)
+                body = json.loads(await reader.readexactly(length) or b"{}")
+                if body.get("stream"):
+                    await self._respond_stream(writer)
+                else:
+                    await self._respond(writer)
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _write_json(writer: asyncio.StreamWriter, status: str, data: dict, headers: str = ""):
+        body = json.dumps(data).encode()
+        writer.write(f"HTTP/1.1 {status}\r\n{headers}Content-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        await writer.drain()
+
+    async def _rate_limited(self, writer: asyncio.StreamWriter) -> bool:
+        """429 with Retry-After for a rate_limit fraction of requests (before any streaming)."""
+        if random.random() >= self.rate_limit:
+            return False
+        await self._write_json(writer, "429 Too Many Requests", {"error": {"message": "Rate limit reached"}},
+                               f"Retry-After: {self.retry_after}\r\n")
+        return True
+
+    async def _respond(self, writer: asyncio.StreamWriter):
+        self.requests += 1
+        if await self._rate_limited(writer):
+            return
+        self.concurrent += 1
+        self.max_concurrent = max(self.max_concurrent, self.concurrent)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.concurrent -= 1
+        await self._write_json(writer, "200 OK", {"choices": [{"message": {"role": "assistant",
+                                                                          "content": json.dumps(ROADMAP)}}]})
+
+    async def _respond_stream(self, writer: asyncio.StreamWriter, fragments: int = 100):
+        """Chunked SSE completion: the roadmap JSON in equal fragments spread over the latency."""
+        self.requests += 1
+        if await self._rate_limited(writer):
+            return
+        self.concurrent += 1
+        self.max_concurrent = max(self.max_concurrent, self.concurrent)
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+            text = json.dumps(ROADMAP, ensure_ascii=False)
+            size = -(-len(text) // fragments)
+            for start in range(0, len(text), size):
+                await asyncio.sleep(self.latency / fragments)
+                delta = {"choices": [{"delta": {"content": text[start:start + size]}}]}
+                self._write_chunk(writer, f"data: {json.dumps(delta, ensure_ascii=False)}\n\n")
+                await writer.drain()
+            self._write_chunk(writer, "data: [DONE]\n\n")
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        finally:
+            self.concurrent -= 1
+
+    @staticmethod
+    def _write_chunk(writer: asyncio.StreamWriter, text: str):
+        data = text.encode()
+        writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+
+async def probe_loop_lag(stop: asyncio.Event, interval: float = 0.01) -> float:
+    """Longest delay of the event loop over the expected wake-up time, seconds."""
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - started - interval)
+    return worst
+
+
+async def run_level(url: str, stub: StubServer, concurrency: int, args) -> dict:
+    service = LLMService("stub-key", url, max_concurrency=concurrency, read_timeout=args.latency * 10 + 5,
+                         max_retries=args.max_retries, backoff_base=args.retry_after, http2=args.http2)
+    stub.max_concurrent = 0
+    stop = asyncio.Event()
+    probe = asyncio.create_task(probe_loop_lag(stop))
+
+    first_steps = []
+
+    async def one() -> float:
+        started = time.perf_counter()
+        if args.stream:
+            parser = RoadmapStreamParser()
+            async for fragment in service.stream_roadmap("Backend developer"):
+                if parser.feed(fragment) and parser.steps == 1:
+                    first_steps.append(time.perf_counter() - started)
+            parser.document()
+        else:
+            await service.generate_roadmap("Backend developer")
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*[one() for _ in range(args.requests)], return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    loop_lag = await probe
+    await service.aclose()
+
+    latencies = [result for result in results if isinstance(result, float)]
+    errors = sum(not isinstance(result, float) for result in results)
+    return {
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "requests_per_s": len(latencies) / elapsed,
+        "ideal_per_s": min(concurrency, args.requests) / args.latency,
+        "p50_s": percentile(latencies, 50),
+        "p95_s": percentile(latencies, 95),
+        "first_step_p50_s": percentile(first_steps, 50),
+        "server_max_concurrent": stub.max_concurrent,
+        "retries": service.retries,
+        "errors": errors,
+        "max_loop_lag_ms": loop_lag * 1000,
+    }
+
+
+async def main_async(args):
+    stub = StubServer(args.latency, args.rate_limit, args.retry_after)
+    url = await stub.start(args.port)
+    rows = []
+    try:
+        print(f"{'cap':>5} {'req/s':>8} {'ideal':>8} {'p50 s':>7} {'p95 s':>7} "
+              f"{'server':>6} {'retries':>7} {'errors':>6} {'loop lag ms':>11}"
+              + (f" {'1st step s':>10}" if args.stream else ""))
+        for concurrency in args.concurrency:
+            row = await run_level(url, stub, concurrency, args)
+            rows.append(row)
+            print(f"{concurrency:>5} {row['requests_per_s']:>8.2f} {row['ideal_per_s']:>8.2f} "
+                  f"{row['p50_s'] or 0:>7.2f} {row['p95_s'] or 0:>7.2f} {row['server_max_concurrent']:>6} "
+                  f"{row['retries']:>7} {row['errors']:>6} {row['max_loop_lag_ms']:>11.1f}"
+                  + (f" {row['first_step_p50_s'] or 0:>10.2f}" if args.stream else ""))
+    finally:
+        await stub.stop()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=64, help="concurrent generations per level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64],
+                        help="LLMService max_concurrency levels")
+    parser.add_argument("--latency", type=float, default=1.0, help="stub response time, seconds")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fraction of 429 responses")
+    parser.add_argument("--retry-after", type=float, default=0.5, help="Retry-After of 429 responses, seconds")
+    parser.add_argument("--max-retries", type=int, default=5)
+    parser.add_argument("--stream", action="store_true",
+                        help="stream completions and report time to the first roadmap step")
+    parser.add_argument("--http2", action="store_true")
+    parser.add_argument("--port", type=int, default=0, help="stub port (0 - any free port)")
+    parser.add_argument("--output", help="path for a JSON report")
+    args = parser.parse_args()
+
+    rows = asyncio.run(main_async(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"requests": args.requests, "latency": args.latency, "rate_limit": args.rate_limit,
+                       "stream": args.stream,
+                       "results": rows}, f, indent=2)
+        print(f"Report saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
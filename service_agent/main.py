@@ -1,20 +1,32 @@
 
 from llm_service import LLMService
-import redis
+from roadmap_stream import RoadmapStreamParser, StreamTimings
+import httpx
+from redis import asyncio as aioredis
 import json
 import uuid
 import os
 from pydantic import BaseModel
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 import logging
 import time
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await llm_service.aclose()
+    await redis_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 origins = [
@@ -42,10 +54,17 @@ REDIS_TTL = int(os.getenv("REDIS_TTL", 3600))
 API_URL = "https://api.groq.com/openai/v1/chat/completions"
 API_KEY = os.environ.get("GROQ_API_KEY")
 
-redis_client = redis.Redis(
+redis_client = aioredis.Redis(
     host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, decode_responses=True)
 
-llm_service = LLMService(api_key=os.getenv("GROQ_API_KEY"))
+llm_service = LLMService(
+    api_key=os.getenv("GROQ_API_KEY"),
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", 16)),
+    connect_timeout=float(os.getenv("LLM_CONNECT_TIMEOUT", 5)),
+    read_timeout=float(os.getenv("LLM_READ_TIMEOUT", 60)),
+    max_retries=int(os.getenv("LLM_MAX_RETRIES", 3)),
+    http2=os.getenv("LLM_HTTP2", "true").lower() == "true")
+stream_timings = StreamTimings()
 
 
 class RoadmapCreate(BaseModel):
@@ -66,28 +85,96 @@ class RoadmapResponse(BaseModel):
 @app.post("/generate", response_model=RoadmapResponse)
 async def generate_roadmap(roadmap: RoadmapCreate):
     logger.info(roadmap)
-    result = llm_service.generate_roadmap(roadmap.description)
-    print(result)
+    result = await llm_service.generate_roadmap(roadmap.description)
     logger.info(result)
     roadmap_id = str(uuid.uuid4())
 
-    redis_client.setex(roadmap_id, REDIS_TTL, json.dumps(result))
+    await redis_client.setex(roadmap_id, REDIS_TTL, json.dumps(result))
 
     return RoadmapResponse(id=roadmap_id, title=result["title"], structure=result)
 
 
+def sse(event: str, data: dict) -> str:
+    """Server-sent event frame."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/generate/stream")
+async def generate_roadmap_stream(roadmap: RoadmapCreate):
+    """
+    Generate a roadmap as server-sent events.
+
+    Events: start (roadmap id), title, step (each step of the roadmap as soon
+    as the model closes it, with its index and elapsed time), then done with
+    the full document after it is saved to Redis, or error.
+    """
+    logger.info(roadmap)
+    roadmap_id = str(uuid.uuid4())
+
+    async def events():
+        started = time.perf_counter()
+        first_step = None
+        parser = RoadmapStreamParser()
+        yield sse("start", {"id": roadmap_id})
+        try:
+            async for fragment in llm_service.stream_roadmap(roadmap.description):
+                for event, value in parser.feed(fragment):
+                    elapsed = time.perf_counter() - started
+                    if event == "title":
+                        yield sse("title", {"title": value, "elapsed_ms": elapsed * 1000})
+                        continue
+                    if first_step is None:
+                        first_step = elapsed
+                        logger.info("Roadmap %s: first step after %.0f ms", roadmap_id, elapsed * 1000)
+                    yield sse("step", {"index": parser.steps - 1, "step": value, "elapsed_ms": elapsed * 1000})
+            result = parser.document()
+            if "title" not in result or "steps" not in result:
+                raise ValueError(f"missing title or steps in {list(result)}")
+        except HTTPException as e:
+            stream_timings.errors += 1
+            yield sse("error", {"status_code": e.status_code, "detail": e.detail})
+            return
+        except (ValueError, httpx.HTTPError) as e:
+            stream_timings.errors += 1
+            logger.error("Roadmap %s: streamed generation failed: %s", roadmap_id, e)
+            yield sse("error", {"status_code": 502, "detail": f"Invalid streamed response from Groq API: {e}"})
+            return
+
+        await redis_client.setex(roadmap_id, REDIS_TTL, json.dumps(result))
+        total = time.perf_counter() - started
+        stream_timings.observe(first_step, total)
+        logger.info("Roadmap %s: %d steps streamed, first step after %.0f ms, total %.0f ms",
+                    roadmap_id, parser.steps, (first_step or total) * 1000, total * 1000)
+        yield sse("done", {
+            "id": roadmap_id,
+            "title": result["title"],
+            "structure": result,
+            "time_to_first_step_ms": first_step * 1000 if first_step is not None else None,
+            "total_ms": total * 1000,
+        })
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/stats")
+async def get_stats():
+    """Groq client load and time to the first streamed step."""
+    return {"llm": llm_service.stats(), "streaming": stream_timings.stats()}
+
+
 @app.put("/update", response_model=RoadmapResponse)
 async def update_roadmap(update: RoadmapUpdate):
     roadmap_id = update.roadmap_id
     logger.info("Update: %s", update)
-    roadmap_json = redis_client.get(roadmap_id)
+    roadmap_json = await redis_client.get(roadmap_id)
     if not roadmap_json:
         raise HTTPException(status_code=404, detail="Roadmap not found")
 
     current_roadmap = json.loads(roadmap_json)
 
-    result = llm_service.update_roadmap(current_roadmap, update.command)
+    result = await llm_service.update_roadmap(current_roadmap, update.command)
 
-    redis_client.setex(roadmap_id, REDIS_TTL, json.dumps(result))
+    await redis_client.setex(roadmap_id, REDIS_TTL, json.dumps(result))
 
     return RoadmapResponse(id=roadmap_id, title=result["title"], structure=result)
@@ -0,0 +1,140 @@
+import json
+from collections import deque
+from typing import List, Optional, Tuple
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+class _Frame:
+    __slots__ = ("kind", "key", "expect_key")
+
+    def __init__(self, kind: str, key: Optional[str]):
+        self.kind = kind
+        # Key of the parent object this container is the value of
+        self.key = key
+        self.expect_key = kind == "object"
+
+
+class RoadmapStreamParser:
+    def __init__(self):
+        """
+        Incremental parser of a streamed roadmap JSON document.
+
+        Fragments of the completion are fed as they arrive. The parser tracks
+        only the JSON structure (nesting, strings, escapes and object keys),
+        so each fragment is scanned once. An element of the top-level "steps"
+        array is decoded and returned as soon as its closing brace arrives;
+        the top-level "title" is returned as soon as its string is complete.
+        """
+        self._chunks: List[str] = []
+        self._stack: List[_Frame] = []
+        self._in_string = False
+        self._escape = False
+        # Text of the string being read, kept only for top-level keys and values
+        self._string: Optional[List[str]] = None
+        # Text of the step being read
+        self._step: Optional[List[str]] = None
+        self.steps = 0
+
+    def _in_steps_array(self) -> bool:
+        return (len(self._stack) == 2 and self._stack[0].kind == "object"
+                and self._stack[1].kind == "array" and self._stack[1].key == "steps")
+
+    def feed(self, text: str) -> List[Tuple[str, object]]:
+        """
+        Parse the next fragment.
+
+        Returns:
+            List[Tuple[str, object]]: Completed ("title", str) and ("step", dict) events in order.
+        """
+        events = []
+        self._chunks.append(text)
+        step_start = 0 if self._step is not None else None
+        string_start = 0 if self._string is not None else None
+        for i, char in enumerate(text):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._string is not None:
+                        self._string.append(text[string_start:i])
+                        self._end_string(json.loads('"' + "".join(self._string) + '"'), events)
+                        self._string = None
+                        string_start = None
+                continue
+            if char == '"':
+                self._in_string = True
+                if len(self._stack) == 1:
+                    self._string = []
+                    string_start = i + 1
+            elif char in "{[":
+                frame = self._stack[-1] if self._stack else None
+                if char == "{" and self._step is None and self._in_steps_array():
+                    self._step = []
+                    step_start = i
+                key = frame.key if frame is not None and frame.kind == "object" else None
+                self._stack.append(_Frame("object" if char == "{" else "array", key))
+            elif char in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if char == "}" and self._step is not None and self._in_steps_array():
+                    self._step.append(text[step_start:i + 1])
+                    events.append(("step", json.loads("".join(self._step))))
+                    self.steps += 1
+                    self._step = None
+                    step_start = None
+            elif char == ":" and self._stack:
+                self._stack[-1].expect_key = False
+            elif char == "," and self._stack and self._stack[-1].kind == "object":
+                self._stack[-1].expect_key = True
+        if self._step is not None:
+            self._step.append(text[step_start:])
+        if self._string is not None:
+            self._string.append(text[string_start:])
+        return events
+
+    def _end_string(self, value: str, events: list):
+        frame = self._stack[-1]
+        if frame.expect_key:
+            frame.key = value
+        elif frame.key == "title":
+            events.append(("title", value))
+
+    def document(self) -> dict:
+        """The complete document (text around the outermost object, such as code fences, is ignored)."""
+        text = "".join(self._chunks)
+        start, end = text.find("{"), text.rfind("}")
+        if start < 0 or end < start:
+            raise ValueError("Streamed completion contains no JSON object")
+        return json.loads(text[start:end + 1])
+
+
+class StreamTimings:
+    def __init__(self, maxlen: int = 1000):
+        """Time to the first step and total time of the latest streamed generations, seconds."""
+        self.first_step = deque(maxlen=maxlen)
+        self.total = deque(maxlen=maxlen)
+        self.streams = 0
+        self.errors = 0
+
+    def observe(self, first_step: Optional[float], total: float):
+        self.streams += 1
+        if first_step is not None:
+            self.first_step.append(first_step)
+        self.total.append(total)
+
+    def stats(self) -> dict:
+        result = {"streams": self.streams, "errors": self.errors}
+        for name, values in (("time_to_first_step", self.first_step), ("total", self.total)):
+            for q in (50, 95):
+                value = percentile(list(values), q)
+                result[f"{name}_p{q}_ms"] = value * 1000 if value is not None else None
+        return result
@@ -0,0 +1,236 @@
+import json
+import logging
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import faiss
+import numpy as np
+
+from lru_cache import TTLCache
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Файлы снапшота: ключи списков (атрибут, значение) с длинами и сами списки ID подряд
+POSTINGS_FILE = "attributes.npy"
+KEYS_FILE = "attributes.json"
+
+# Список всех статей, у которых известны атрибуты
+ALL = ("all", "")
+
+PostingKey = Tuple[str, Union[str, int]]
+
+
+def filter_key(filters: Optional[dict]) -> Optional[tuple]:
+    """
+    Каноническое представление фильтра для ключей кэшей (None — без фильтра).
+
+    Теги и уровни сложности сравниваются без учёта регистра и порядка.
+    """
+    if not filters:
+        return None
+    tags = tuple(sorted({tag.lower() for tag in filters.get("tags") or ()}))
+    complexity = tuple(sorted({value.lower() for value in filters.get("complexity") or ()}))
+    max_reading_time = filters.get("max_reading_time")
+    if not tags and not complexity and max_reading_time is None:
+        return None
+    return tags, complexity, max_reading_time
+
+
+def _postings_of(article) -> List[PostingKey]:
+    keys = [ALL, ("reading_time", int(article.reading_time))]
+    keys += [("tags", tag) for tag in {tag.lower() for tag in article.tags}]
+    if article.complexity:
+        keys.append(("complexity", article.complexity.lower()))
+    return keys
+
+
+def _contains(postings: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """Маска ids, присутствующих в отсортированном массиве postings."""
+    if not len(postings):
+        return np.zeros(len(ids), dtype=bool)
+    positions = np.minimum(np.searchsorted(postings, ids), len(postings) - 1)
+    return postings[positions] == ids
+
+
+class AttributeIndex:
+    def __init__(self, selector_cache_size: int = 256):
+        """
+        Инвертированные списки атрибутов статей для фильтрации поиска.
+
+        Для каждого значения атрибута (тег, уровень сложности, время чтения в
+        минутах) хранится отсортированный массив int64 ID статей. Фильтр
+        вычисляется пересечением и объединением этих массивов, а результат
+        передаётся FAISS как IDSelectorBatch и проверяется при обходе индекса.
+        Селекторы кэшируются по фильтру и сбрасываются при любом изменении
+        списков. Списки обновляются батчами при индексации и сохраняются в
+        снапшоте вместе с индексом.
+
+        Args:
+            selector_cache_size (int): Количество кэшируемых селекторов фильтров.
+        """
+        self.postings: Dict[PostingKey, np.ndarray] = {}
+        # Увеличивается при каждом изменении списков (входит в ключ кэша результатов)
+        self.version = 0
+        self.selector_cache = TTLCache(selector_cache_size, ttl=3600)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.postings.get(ALL, ()))
+
+    def update(self, articles: Iterable):
+        """Замена атрибутов статей батча (Article или ArticleSummary); побеждает последняя версия."""
+        latest = {article.id: article for article in articles}
+        if not latest:
+            return
+        added: Dict[PostingKey, List[int]] = {}
+        for article_id, article in latest.items():
+            for key in _postings_of(article):
+                added.setdefault(key, []).append(article_id)
+        with self._lock:
+            self._remove(np.fromiter(latest, dtype=np.int64, count=len(latest)))
+            for key, article_ids in added.items():
+                new_ids = np.unique(np.asarray(article_ids, dtype=np.int64))
+                current = self.postings.get(key)
+                self.postings[key] = new_ids if current is None else np.union1d(current, new_ids)
+            self._changed()
+
+    def delete(self, article_ids: Iterable[int]):
+        """Удаление статей из всех списков."""
+        ids = np.asarray(list(article_ids), dtype=np.int64)
+        if not len(ids):
+            return
+        with self._lock:
+            if self._remove(ids):
+                self._changed()
+
+    def _remove(self, article_ids: np.ndarray) -> bool:
+        article_ids = np.unique(article_ids)
+        # Новые статьи (обычный случай при индексации) не требуют прохода по всем спискам
+        present = article_ids[_contains(self.postings.get(ALL, np.zeros(0, dtype=np.int64)), article_ids)]
+        if not len(present):
+            return False
+        for key, postings in list(self.postings.items()):
+            mask = _contains(present, postings)
+            if mask.any():
+                postings = postings[~mask]
+                if len(postings):
+                    self.postings[key] = postings
+                else:
+                    del self.postings[key]
+        return True
+
+    def _changed(self):
+        self.version += 1
+        self.selector_cache.clear()
+
+    def missing(self, article_ids: Iterable[int]) -> List[int]:
+        """ID статей, атрибуты которых неизвестны (например, после воспроизведения журнала)."""
+        ids = np.unique(np.asarray(list(article_ids), dtype=np.int64))
+        return ids[~_contains(self.postings.get(ALL, np.zeros(0, dtype=np.int64)), ids)].tolist()
+
+    def article_ids(self) -> np.ndarray:
+        return self.postings.get(ALL, np.zeros(0, dtype=np.int64))
+
+    def _union(self, keys: List[PostingKey]) -> np.ndarray:
+        arrays = [self.postings[key] for key in keys if key in self.postings]
+        if not arrays:
+            return np.zeros(0, dtype=np.int64)
+        if len(arrays) == 1:
+            return arrays[0]
+        return np.unique(np.concatenate(arrays))
+
+    def matching_ids(self, filters: Optional[dict]) -> Optional[np.ndarray]:
+        """
+        Отсортированные ID статей, подходящих под фильтр.
+
+        Статья подходит, если у неё есть хотя бы один из тегов, один из уровней
+        сложности и время чтения не больше max_reading_time; незаданные условия
+        не проверяются.
+
+        Returns:
+            Optional[np.ndarray]: None, если фильтр пустой.
+        """
+        key = filter_key(filters)
+        if key is None:
+            return None
+        tags, complexity, max_reading_time = key
+        with self._lock:
+            parts = []
+            if tags:
+                parts.append(self._union([("tags", tag) for tag in tags]))
+            if complexity:
+                parts.append(self._union([("complexity", value) for value in complexity]))
+            if max_reading_time is not None:
+                parts.append(self._union([posting for posting in self.postings
+                                          if posting[0] == "reading_time" and posting[1] <= max_reading_time]))
+        parts.sort(key=len)
+        result = parts[0]
+        for part in parts[1:]:
+            if not len(result):
+                break
+            result = np.intersect1d(result, part, assume_unique=True)
+        return result
+
+    def selector(self, filters: Optional[dict]) -> Tuple[Optional[np.ndarray], Optional[faiss.IDSelector]]:
+        """
+        ID статей, подходящих под фильтр, и готовый селектор FAISS для них.
+
+        Returns:
+            Tuple[Optional[np.ndarray], Optional[faiss.IDSelector]]: (None, None) без фильтра.
+        """
+        key = filter_key(filters)
+        if key is None:
+            return None, None
+        version = self.version
+        cached = self.selector_cache.get((key, version))
+        if cached is not None:
+            return cached
+        article_ids = self.matching_ids(filters)
+        entry = (article_ids, faiss.IDSelectorBatch(article_ids) if len(article_ids) else None)
+        self.selector_cache.put((key, version), entry)
+        return entry
+
+    def save(self, directory: str):
+        """Сохранение списков в директорию снапшота."""
+        with self._lock:
+            keys = list(self.postings)
+            arrays = [self.postings[key] for key in keys]
+        np.save(os.path.join(directory, POSTINGS_FILE),
+                np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.int64))
+        with open(os.path.join(directory, KEYS_FILE), "w") as f:
+            json.dump({"keys": [list(key) for key in keys], "lengths": [len(array) for array in arrays]}, f)
+
+    def load(self, directory: str) -> bool:
+        """
+        Загрузка списков из снапшота.
+
+        Returns:
+            bool: False, если снапшот записан без атрибутов.
+        """
+        keys_path = os.path.join(directory, KEYS_FILE)
+        if not os.path.exists(keys_path):
+            return False
+        with open(keys_path, "r") as f:
+            data = json.load(f)
+        postings = np.load(os.path.join(directory, POSTINGS_FILE))
+        offsets = np.cumsum([0] + data["lengths"])
+        with self._lock:
+            self.postings = {(attribute, value): postings[start:end]
+                             for (attribute, value), start, end in zip(data["keys"], offsets[:-1], offsets[1:])}
+            self._changed()
+        logger.info(f"Loaded attributes of {len(self)} articles ({len(self.postings)} postings lists)")
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            attributes = {}
+            for attribute, _ in self.postings:
+                attributes[attribute] = attributes.get(attribute, 0) + 1
+            return {
+                "articles": len(self),
+                "values": attributes,
+                "postings_bytes": int(sum(array.nbytes for array in self.postings.values())),
+                "selector_cache": self.selector_cache.stats(),
+            }
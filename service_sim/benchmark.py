@@ -0,0 +1,475 @@
+"""
+Воспроизводимый бенчмарк индексации и поиска сервиса похожих статей.
+
+Для каждого масштаба (--scale, например 10000 100000 1000000) в отдельном
+процессе (чтобы пиковый RSS относился только к нему):
+
+1. генерируется синтетический корпус статей Markdown (synthetic_article из
+   preprocess_report.py, фиксированный seed) и записывается в SQLite,
+   который заменяет PostgreSQL (тот же интерфейс чтения, что у PostgresOperator);
+2. preprocess — скорость предобработки Markdown (статей в секунду);
+3. encode — скорость кодирования статей моделью (с предобработкой, без кэша);
+4. ingest — сквозная индексация: сообщения {"id": ...} из очереди в памяти
+   (замена confluent_kafka.Consumer) проходят через KafkaConsumer, чтение
+   статей из SQLite, кодирование, журнал и индекс VectorStore;
+5. add — добавление в VectorStore готовых векторов (журнал, индекс, точные
+   векторы и снапшоты по настройкам persistence) до полного размера корпуса;
+   векторы синтетические (смесь гауссовых кластеров), чтобы масштаб 1M не
+   упирался в кодирование;
+6. search — латентность поиска p50/p99 по одному запросу: cold — с
+   кодированием запроса моделью, затем для каждого k из --k с прогретым
+   кэшем эмбеддингов запросов (индекс и переранжирование);
+7. peak_rss_bytes — пиковая резидентная память процесса.
+
+Индекс, журнал и кэши создаются во временной директории с настройками из
+--config. Результаты пишутся в JSON (--output). С --baseline результаты
+сравниваются с сохранённым отчётом: скорость не должна упасть, а латентность
+вырасти больше чем на --max-regression, пиковая память — на
+--max-rss-regression; иначе скрипт завершается с кодом 1.
+
+Базовые отчёты зависят от машины (CPU, число ядер, версия FAISS), поэтому
+общего эталона в репозитории нет: отчёт машины хранится в
+service_sim/benchmarks/<имя хоста>.json. --save-baseline записывает туда
+текущий запуск, --baseline без пути сравнивает с ним; отчёт машины, на
+которой проверяются изменения (CI), коммитится в эту директорию. Если
+платформа базового отчёта отличается, выводится предупреждение.
+
+Пример:
+    python benchmark.py --scale 10000 --save-baseline
+    python benchmark.py --scale 10000 100000 --baseline --max-regression 0.15
+    python benchmark.py --scale 10000 --output bench.json --baseline other.json
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from typing import Iterator, List
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+
+import faiss
+import numpy as np
+import yaml
+from confluent_kafka import TopicPartition
+
+from exact_vectors import process_rss_bytes
+from kafka_consumer import KafkaConsumer
+from markdown_preprocessor import preprocess_markdown
+from models.article import Article, ArticleSummary
+from preprocess_report import WORDS, synthetic_article
+from vector_store import VectorStore
+
+
+class SQLiteArticles:
+    def __init__(self, path: str):
+        """Замена PostgresOperator для бенчмарка: статьи в файле SQLite."""
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS articles (id INTEGER PRIMARY KEY, name TEXT, text TEXT, "
+            "complexity TEXT, reading_time INTEGER, tags TEXT)")
+
+    def insert(self, articles: List[Article]):
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?, ?)",
+                [(article.id, article.name, article.text, article.complexity, article.reading_time,
+                  json.dumps(article.tags)) for article in articles])
+            self.conn.commit()
+
+    def _select(self, columns: str, model, article_ids: List[int]) -> list:
+        by_id = {}
+        # Ограничение SQLite на количество параметров запроса
+        for start in range(0, len(article_ids), 900):
+            chunk = list(article_ids[start:start + 900])
+            with self._lock:
+                rows = self.conn.execute(
+                    f"SELECT {columns} FROM articles WHERE id IN ({','.join('?' * len(chunk))})",
+                    chunk).fetchall()
+            for row in rows:
+                by_id[row[0]] = self._model(model, columns, row)
+        return [by_id[article_id] for article_id in article_ids if article_id in by_id]
+
+    @staticmethod
+    def _model(model, columns: str, row: tuple):
+        data = dict(zip([column.strip() for column in columns.split(",")], row))
+        data["tags"] = json.loads(data["tags"]) if data["tags"] else []
+        return model(**data)
+
+    def get_articles_by_ids(self, article_ids: List[int], raise_on_error: bool = False) -> List[Article]:
+        return self._select("id, name, text, complexity, reading_time, tags", Article, article_ids)
+
+    def get_article_summaries_by_ids(self, article_ids: List[int]) -> List[ArticleSummary]:
+        return self._select("id, name, complexity, reading_time, tags", ArticleSummary, article_ids)
+
+    def count_articles(self, after_id: int = 0) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT count(*) FROM articles WHERE id > ?", (after_id,)).fetchone()[0]
+
+    def iter_articles(self, after_id: int = 0, chunk_size: int = 1000) -> Iterator[List[Article]]:
+        columns = "id, name, text, complexity, reading_time, tags"
+        while True:
+            with self._lock:
+                rows = self.conn.execute(
+                    f"SELECT {columns} FROM articles WHERE id > ? ORDER BY id LIMIT ?",
+                    (after_id, chunk_size)).fetchall()
+            if not rows:
+                return
+            after_id = rows[-1][0]
+            yield [self._model(Article, columns, row) for row in rows]
+
+    def close(self):
+        self.conn.close()
+
+
+class InMemoryMessage:
+    """Сообщение с интерфейсом confluent_kafka.Message."""
+
+    def __init__(self, topic: str, offset: int, value: bytes):
+        self._topic = topic
+        self._offset = offset
+        self._value = value
+
+    def error(self):
+        return None
+
+    def topic(self) -> str:
+        return self._topic
+
+    def partition(self) -> int:
+        return 0
+
+    def offset(self) -> int:
+        return self._offset
+
+    def value(self) -> bytes:
+        return self._value
+
+
+class InMemorySource:
+    def __init__(self, topic: str, payloads: List[bytes]):
+        """
+        Замена confluent_kafka.Consumer: одна партиция с сообщениями из памяти.
+
+        Событие done устанавливается, когда зафиксировано смещение последнего сообщения.
+        """
+        self.topic = topic
+        self.messages = [InMemoryMessage(topic, offset, payload) for offset, payload in enumerate(payloads)]
+        self.next_offset = 0
+        self.committed_offset = -1001
+        self.done = threading.Event()
+
+    def consume(self, num_messages: int = 1, timeout: float = -1) -> List[InMemoryMessage]:
+        batch = self.messages[self.next_offset:self.next_offset + num_messages]
+        self.next_offset += len(batch)
+        if not batch and timeout > 0:
+            time.sleep(min(timeout, 0.05))
+        return batch
+
+    def assignment(self) -> List[TopicPartition]:
+        return [TopicPartition(self.topic, 0)]
+
+    def pause(self, partitions):
+        pass
+
+    def resume(self, partitions):
+        pass
+
+    def commit(self, offsets=None, asynchronous: bool = True):
+        for partition in offsets or []:
+            self.committed_offset = max(self.committed_offset, partition.offset)
+        if self.committed_offset >= len(self.messages):
+            self.done.set()
+
+    def committed(self, partitions, timeout: float = None) -> List[TopicPartition]:
+        return [TopicPartition(self.topic, 0, self.committed_offset)]
+
+    def position(self, partitions) -> List[TopicPartition]:
+        return [TopicPartition(self.topic, 0, self.next_offset)]
+
+    def get_watermark_offsets(self, partition, timeout: float = None) -> tuple:
+        return 0, len(self.messages)
+
+    def close(self):
+        pass
+
+
+def clustered_vectors(count: int, centers: np.ndarray, rng) -> np.ndarray:
+    """Нормированные векторы вокруг случайных центров (похожи на эмбеддинги по структуре)."""
+    vectors = centers[rng.integers(len(centers), size=count)] + \
+        rng.normal(scale=0.3, size=(count, centers.shape[1]))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+def percentiles(latencies: List[float]) -> dict:
+    return {"p50_ms": float(np.percentile(latencies, 50)), "p99_ms": float(np.percentile(latencies, 99))}
+
+
+def peak_rss_bytes() -> int:
+    # ru_maxrss в Linux — в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_scale(args, scale: int) -> dict:
+    """Все этапы бенчмарка для одного масштаба корпуса."""
+    with open(args.config, "r") as f:
+        config = yaml.safe_load(f) or {}
+    rng = np.random.default_rng(args.seed)
+    result = {"scale": scale}
+
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as tmp_dir:
+        # Настройки сервиса с путями во временной директории; брокер Kafka не используется
+        config.setdefault("embedding_cache", {})["path"] = os.path.join(tmp_dir, "embedding_cache")
+        config.setdefault("kafka", {})["brokers"] = "localhost:9"
+        config_path = os.path.join(tmp_dir, "config.yaml")
+        with open(config_path, "w") as f:
+            yaml.safe_dump(config, f)
+
+        started = time.perf_counter()
+        db = SQLiteArticles(os.path.join(tmp_dir, "articles.db"))
+        for start in range(0, scale, 10000):
+            db.insert([Article(id=article_id, name=f"Статья {article_id}", text=synthetic_article(rng),
+                               complexity=str(rng.choice(["Простой", "Средний", "Сложный"])),
+                               reading_time=int(rng.integers(1, 30)), tags=list(rng.choice(WORDS, 3)))
+                       for article_id in range(start + 1, min(start + 10000, scale) + 1)])
+        result["corpus_s"] = time.perf_counter() - started
+        print(f"[{scale}] corpus: {result['corpus_s']:.1f}s", flush=True)
+
+        texts = [article.text for article in next(db.iter_articles(0, min(scale, args.preprocess_sample)))]
+        started = time.perf_counter()
+        for text in texts:
+            preprocess_markdown(text)
+        result["preprocess_articles_per_s"] = len(texts) / (time.perf_counter() - started)
+        print(f"[{scale}] preprocess: {result['preprocess_articles_per_s']:.1f} articles/s", flush=True)
+
+        vector_store = VectorStore(
+            model_name=args.model, index_path=os.path.join(tmp_dir, "faiss_index.bin"),
+            metadata_path=os.path.join(tmp_dir, "metadata.json"), config_path=config_path, db=db)
+        encode_batch_size = config.get("ingest", {}).get("encode_batch_size", 32)
+        texts = texts[:args.encode_sample]
+        started = time.perf_counter()
+        vector_store.embedding_generator.generate_embeddings(
+            texts, batch_size=encode_batch_size, use_cache=False, use_workers=True)
+        result["encode_articles_per_s"] = len(texts) / (time.perf_counter() - started)
+        print(f"[{scale}] encode: {result['encode_articles_per_s']:.1f} articles/s", flush=True)
+
+        ingest_count = min(scale, args.ingest_sample)
+        kafka_consumer = KafkaConsumer(config_path=config_path, vector_store=vector_store, db=db)
+        kafka_consumer.consumer.close()
+        source = InMemorySource(kafka_consumer.topic,
+                                [json.dumps({"id": article_id}).encode() for article_id in range(1, ingest_count + 1)])
+        kafka_consumer.consumer = source
+
+        def stop_when_done():
+            source.done.wait()
+            kafka_consumer.stop()
+
+        threading.Thread(target=stop_when_done, daemon=True).start()
+        started = time.perf_counter()
+        asyncio.run(kafka_consumer.consume())
+        result["ingest_articles_per_s"] = ingest_count / (time.perf_counter() - started)
+        print(f"[{scale}] ingest: {result['ingest_articles_per_s']:.1f} articles/s", flush=True)
+
+        # Векторы остальной части корпуса добавляются батчами размера ingest.batch_size
+        add_batch = config.get("ingest", {}).get("batch_size", 256)
+        centers = rng.standard_normal((256, vector_store.dimension)).astype(np.float32)
+        started = time.perf_counter()
+        for start in range(ingest_count + 1, scale + 1, add_batch):
+            article_ids = list(range(start, min(start + add_batch, scale + 1)))
+            vector_store.add_embeddings(article_ids, article_ids,
+                                        clustered_vectors(len(article_ids), centers, rng))
+        added = scale - ingest_count
+        result["add_vectors_per_s"] = added / (time.perf_counter() - started) if added else 0.0
+        print(f"[{scale}] add: {result['add_vectors_per_s']:.1f} vectors/s", flush=True)
+        # Фоновая перестройка (IVF, сжатие) должна закончиться до замеров поиска
+        vector_store.wait_rebuild()
+        # Атрибуты фильтров и тексты для BM25 векторов, добавленных без статей, читаются из базы
+        vector_store.sync_article_indexes()
+
+        queries = list(dict.fromkeys(" ".join(rng.choice(WORDS, 4)) for _ in range(args.queries * 2)))
+        queries = queries[:args.queries]
+        search = {}
+        latencies = []
+        for query in queries:
+            started = time.perf_counter()
+            vector_store.find_neighbors([(query, max(args.k))])
+            latencies.append((time.perf_counter() - started) * 1000)
+        search["cold"] = percentiles(latencies)
+        for k in args.k:
+            latencies = []
+            for query in queries:
+                started = time.perf_counter()
+                vector_store.find_neighbors([(query, k)])
+                latencies.append((time.perf_counter() - started) * 1000)
+            search[f"k={k}"] = percentiles(latencies)
+        # Фильтры по атрибутам: один тег (несколько процентов корпуса) и избирательное сочетание
+        tag = str(WORDS[0])
+        for name, filters in (("filter=tag", {"tags": [tag]}),
+                              ("filter=tag+complexity+time", {"tags": [tag], "complexity": ["Сложный"],
+                                                              "max_reading_time": 5})):
+            latencies = []
+            for query in queries:
+                started = time.perf_counter()
+                vector_store.find_neighbors([(query, max(args.k))], filters=filters)
+                latencies.append((time.perf_counter() - started) * 1000)
+            search[name] = percentiles(latencies)
+        if vector_store.lexical is not None:
+            for mode in ("lexical", "hybrid", "prefilter"):
+                latencies = []
+                for query in queries:
+                    started = time.perf_counter()
+                    vector_store.find_neighbors([(query, max(args.k))], mode=mode)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                search[f"mode={mode}"] = percentiles(latencies)
+        result["search"] = search
+        print(f"[{scale}] search: " + ", ".join(
+            f"{name} p50 {values['p50_ms']:.2f} ms / p99 {values['p99_ms']:.2f} ms"
+            for name, values in search.items()), flush=True)
+
+        result["index_size"] = vector_store.index_size()
+        result["rss_bytes"] = process_rss_bytes()
+        result["peak_rss_bytes"] = max(peak_rss_bytes(), result["rss_bytes"])
+        vector_store.close()
+        db.close()
+    return result
+
+
+def _run_scale_process(args, scale: int, results):
+    results.put(run_scale(args, scale))
+
+
+def flatten(report: dict) -> dict:
+    """Метрики отчёта по ключам вида "10000.search.k=10.p99_ms"."""
+    metrics = {}
+
+    def walk(prefix: str, value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                walk(f"{prefix}.{key}", item)
+        elif isinstance(value, (int, float)) and prefix.endswith(("_per_s", "_ms", "_bytes")):
+            metrics[prefix] = value
+
+    for result in report["results"]:
+        walk(str(result["scale"]), result)
+    return metrics
+
+
+def baseline_path() -> str:
+    """Базовый отчёт этой машины."""
+    return os.path.join(BASELINE_DIR, f"{platform.node() or 'local'}.json")
+
+
+def compare(current: dict, baseline: dict, max_regression: float, max_rss_regression: float) -> List[str]:
+    """Сравнение с базовым отчётом; возвращает метрики, ухудшившиеся сильнее порога."""
+    for key in ("platform", "cpu_count", "faiss", "model"):
+        if current.get(key) != baseline.get(key):
+            print(f"Warning: baseline {key} {baseline.get(key)!r} differs from {current.get(key)!r}")
+    current, baseline = flatten(current), flatten(baseline)
+    regressions = []
+    print(f"{'metric':<40} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, value in current.items():
+        if name not in baseline or not baseline[name]:
+            continue
+        change = value / baseline[name] - 1
+        if name.endswith("_per_s"):
+            regressed = change < -max_regression
+        elif name.endswith("_bytes"):
+            regressed = change > max_rss_regression
+        else:
+            regressed = change > max_regression
+        print(f"{name:<40} {baseline[name]:>12.2f} {value:>12.2f} {change:>+7.1%}"
+              + ("  REGRESSION" if regressed else ""))
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default="config/config_sim.yaml",
+                        help="конфигурация сервиса (индекс, журнал, ingest)")
+    parser.add_argument("--model", default="distiluse-base-multilingual-cased-v1")
+    parser.add_argument("--scale", type=int, nargs="+", default=[10000],
+                        help="размеры корпуса, например 10000 100000 1000000")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--preprocess-sample", type=int, default=10000,
+                        help="статей для замера предобработки")
+    parser.add_argument("--encode-sample", type=int, default=1000,
+                        help="статей для замера кодирования")
+    parser.add_argument("--ingest-sample", type=int, default=2000,
+                        help="статей для сквозной индексации через KafkaConsumer")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--work-dir", help="директория для временных файлов (индекс, SQLite)")
+    parser.add_argument("--output", help="путь для JSON-отчёта")
+    parser.add_argument("--baseline", nargs="?", const="",
+                        help="JSON-отчёт для сравнения (без пути — базовый отчёт этой машины)")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="записать отчёт как базовый для этой машины")
+    parser.add_argument("--max-regression", type=float, default=0.15,
+                        help="допустимое падение скорости / рост латентности (доля)")
+    parser.add_argument("--max-rss-regression", type=float, default=0.1,
+                        help="допустимый рост пиковой памяти (доля)")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        index_config = (yaml.safe_load(f) or {}).get("vector_store", {}).get("index", {})
+    report = {"platform": platform.platform(), "python": platform.python_version(),
+              "cpu_count": os.cpu_count(), "faiss": faiss.__version__, "model": args.model,
+              "index": index_config, "seed": args.seed, "results": []}
+    # Каждый масштаб в отдельном процессе: пиковый RSS не наследуется от предыдущего
+    context = multiprocessing.get_context("spawn")
+    for scale in args.scale:
+        results = context.Queue()
+        process = context.Process(target=_run_scale_process, args=(args, scale, results))
+        process.start()
+        while True:
+            try:
+                result = results.get(timeout=1)
+                break
+            except queue.Empty:
+                if not process.is_alive():
+                    print(f"Benchmark for scale {scale} failed with exit code {process.exitcode}")
+                    sys.exit(1)
+        process.join()
+        report["results"].append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to {args.output}")
+
+    if args.baseline is not None:
+        path = args.baseline or baseline_path()
+        if not os.path.exists(path):
+            print(f"No baseline {path}, create it with --save-baseline")
+            sys.exit(1)
+        with open(path, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.max_regression, args.max_rss_regression)
+        if regressions:
+            print(f"Regressions above threshold: {', '.join(regressions)}")
+            sys.exit(1)
+        print("No regressions above threshold")
+
+    # После сравнения: новый базовый отчёт не сравнивается сам с собой
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_path(), "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {baseline_path()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Отчёт recall@k / латентность / память для сжатых индексов с переранжированием.
+
+Для каждого кодека (none, fp16, sq8, pq) строится индекс заданного типа,
+затем измеряется recall@k относительно точного flat-поиска: без
+переранжирования и с переранжированием k * factor кандидатов по точным
+векторам float32 из memory-mapped файла (как в VectorStore с секцией
+vector_store.rerank). Для памяти выводятся оценка estimate_index_bytes,
+фактический размер сериализованного индекса, прирост RSS процесса при
+построении и резидентная часть файла точных векторов после запросов.
+
+Пример:
+    python compression_report.py --data-dir /app/faiss_data --k 10
+    python compression_report.py --synthetic 200000 --type hnsw --factors 1 2 4 8 --output compression.json
+"""
+import argparse
+import gc
+import json
+import os
+import tempfile
+import time
+
+import faiss
+import numpy as np
+import yaml
+
+from exact_vectors import ExactVectors, process_rss_bytes
+from index_factory import TYPE_CODECS, build_index, estimate_index_bytes, search_params, train_index
+from index_report import load_vectors, recall_at_k
+
+
+def measure(index: faiss.Index, queries: np.ndarray, k: int, params, exact_vectors=None, factor: int = 1) -> tuple:
+    """Поиск по одному запросу с необязательным переранжированием; ID и латентности в мс."""
+    found = np.empty((len(queries), k), dtype=np.int64)
+    latencies = np.empty(len(queries))
+    for i, query in enumerate(queries):
+        query = query.reshape(1, -1)
+        start = time.perf_counter()
+        distances, indices = index.search(query, k * factor, params=params)
+        if exact_vectors is not None:
+            distances, indices = exact_vectors.rerank(query, distances, indices, k)
+        latencies[i] = (time.perf_counter() - start) * 1000
+        found[i] = indices[0][:k]
+    return found, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default="config/config_sim.yaml",
+                        help="конфигурация с секцией vector_store.index")
+    parser.add_argument("--data-dir", default="/app/faiss_data")
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="сгенерировать N случайных векторов вместо чтения снапшота")
+    parser.add_argument("--dimension", type=int, default=512)
+    parser.add_argument("--type", default="flat", choices=list(TYPE_CODECS),
+                        help="тип индекса для кандидатов")
+    parser.add_argument("--codecs", nargs="+", default=["none", "fp16", "sq8", "pq"])
+    parser.add_argument("--factors", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="множители числа кандидатов для переранжирования")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--output", help="путь для JSON-отчёта")
+    args = parser.parse_args()
+
+    index_config = {}
+    if os.path.exists(args.config):
+        with open(args.config, "r") as f:
+            index_config = (yaml.safe_load(f) or {}).get(
+                "vector_store", {}).get("index", {})
+
+    rng = np.random.default_rng(0)
+    if args.synthetic:
+        vectors = rng.standard_normal(
+            (args.synthetic, args.dimension)).astype(np.float32)
+    else:
+        vectors = load_vectors(args.data_dir, args.dimension)
+    dimension = vectors.shape[1]
+    ids = np.arange(len(vectors), dtype=np.int64)
+    queries = vectors[rng.choice(len(vectors), min(
+        args.queries, len(vectors)), replace=False)]
+    queries = queries + rng.normal(scale=0.01, size=queries.shape).astype(np.float32)
+    print(f"Vectors: {len(vectors)}, dimension: {dimension}, queries: {len(queries)}, "
+          f"k: {args.k}, type: {args.type}")
+
+    flat = faiss.IndexFlatL2(dimension)
+    flat.add(vectors)
+    exact, _ = measure(flat, queries, args.k, None)
+    del flat
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        exact_vectors = ExactVectors(tmp_dir, dimension)
+        exact_vectors.upsert(ids, vectors)
+        exact_file_bytes = exact_vectors.stats()["file_bytes"]
+
+        rows = []
+        for codec in args.codecs:
+            config = dict(index_config, type=args.type, codec=codec)
+            gc.collect()
+            rss_before = process_rss_bytes()
+            start = time.perf_counter()
+            try:
+                index = build_index(config, dimension, len(vectors))
+                train_index(index, vectors, config.get("train_sample_size", 50000))
+                index.add_with_ids(vectors, ids)
+            except Exception as e:
+                print(f"Skipping {args.type}/{codec}: {e}")
+                continue
+            build_time = time.perf_counter() - start
+            memory = {"estimated_bytes": estimate_index_bytes(config, dimension, len(vectors)),
+                      "serialized_bytes": int(faiss.serialize_index(index).nbytes),
+                      "rss_delta_bytes": process_rss_bytes() - rss_before}
+            params = search_params(index, config.get("nprobe"), config.get("ef_search"))
+            variants = [(None, 1)] + [(exact_vectors, factor) for factor in args.factors]
+            for reranker, factor in variants:
+                found, latencies = measure(index, queries, args.k, params, reranker, factor)
+                rows.append({"codec": codec, "rerank": None if reranker is None else factor,
+                             "recall": recall_at_k(found, exact),
+                             "p50_ms": float(np.percentile(latencies, 50)),
+                             "p99_ms": float(np.percentile(latencies, 99)),
+                             "build_s": build_time, **memory,
+                             "exact_resident_bytes": exact_vectors.stats()["resident_bytes"]})
+            del index
+
+        exact_vectors.close()
+
+    mb = 1024 * 1024
+    print(f"Exact vectors file: {exact_file_bytes / mb:.1f} MB (on disk, memory-mapped)")
+    print(f"{'codec':<6} {'rerank':>6} {'recall@' + str(args.k):>10} {'p50, ms':>9} {'p99, ms':>9} "
+          f"{'est, MB':>9} {'index, MB':>10} {'rss+, MB':>9} {'mmap rss, MB':>13}")
+    for row in rows:
+        rerank = f"x{row['rerank']}" if row["rerank"] else "-"
+        print(f"{row['codec']:<6} {rerank:>6} {row['recall']:>10.3f} {row['p50_ms']:>9.3f} "
+              f"{row['p99_ms']:>9.3f} {row['estimated_bytes'] / mb:>9.1f} "
+              f"{row['serialized_bytes'] / mb:>10.1f} {row['rss_delta_bytes'] / mb:>9.1f} "
+              f"{row['exact_resident_bytes'] / mb:>13.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"vectors": len(vectors), "dimension": dimension, "k": args.k,
+                       "type": args.type, "exact_file_bytes": exact_file_bytes,
+                       "results": rows}, f, indent=2)
+        print(f"Report saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,14 @@
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
 import logging
+import threading
+import time
 import yaml
-from typing import Optional
-from models.article import Article
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+from metrics import DB_FETCH_SECONDS
+from models.article import Article, ArticleSummary
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -23,15 +28,25 @@ class PostgresOperator:
         self.dbname = db_config.get("dbname", "scrapping")
         self.user = db_config.get("user", "articles")
         self.password = db_config.get("password", "articles")
+        self.pool_min = db_config.get("pool_min", 1)
+        self.pool_max = db_config.get("pool_max", 10)
+        self.health_check_interval = db_config.get(
+            "health_check_interval_s", 30)
 
-        # Инициализация соединения
-        self.conn = None
+        # Пул соединений, общий для всех потоков сервиса
+        self.pool = None
+        # ThreadedConnectionPool не ждёт свободного соединения, поэтому
+        # ограничиваем количество одновременно выданных соединений семафором
+        self._available = threading.BoundedSemaphore(self.pool_max)
+        self._last_used = {}
         self.connect()
 
     def connect(self):
-        """Установка соединения с PostgreSQL."""
+        """Создание пула соединений с PostgreSQL."""
         try:
-            self.conn = psycopg2.connect(
+            self.pool = ThreadedConnectionPool(
+                self.pool_min,
+                self.pool_max,
                 host=self.host,
                 port=self.port,
                 dbname=self.dbname,
@@ -39,16 +54,88 @@ class PostgresOperator:
                 password=self.password,
                 cursor_factory=RealDictCursor
             )
-            logger.info("Successfully connected to PostgreSQL")
+            logger.info(
+                f"Successfully connected to PostgreSQL (pool size {self.pool_min}..{self.pool_max})")
         except Exception as e:
             logger.error(f"Failed to connect to PostgreSQL: {e}")
             raise
 
     def close(self):
-        """Закрытие соединения с PostgreSQL."""
-        if self.conn and not self.conn.closed:
-            self.conn.close()
-            logger.info("PostgreSQL connection closed")
+        """Закрытие всех соединений пула."""
+        if self.pool and not self.pool.closed:
+            self.pool.closeall()
+            logger.info("PostgreSQL connection pool closed")
+
+    def _is_healthy(self, conn) -> bool:
+        """Проверка соединения: закрытые отбрасываются, давно простаивающие пингуются."""
+        if conn.closed:
+            return False
+        if time.monotonic() - self._last_used.get(id(conn), 0) < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    @contextmanager
+    def connection(self):
+        """
+        Выдача соединения из пула на время блока with.
+
+        Неработающее соединение закрывается и заменяется новым; соединение,
+        на котором произошла ошибка связи, в пул не возвращается.
+        """
+        self._available.acquire()
+        conn = None
+        try:
+            for _ in range(self.pool_max + 1):
+                conn = self.pool.getconn()
+                conn.autocommit = True
+                if self._is_healthy(conn):
+                    break
+                logger.warning("Discarding broken PostgreSQL connection")
+                self._last_used.pop(id(conn), None)
+                self.pool.putconn(conn, close=True)
+                conn = None
+            if conn is None:
+                raise psycopg2.OperationalError(
+                    "No healthy PostgreSQL connection available")
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            if conn is not None:
+                self._last_used.pop(id(conn), None)
+                self.pool.putconn(conn, close=True)
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                self._last_used[id(conn)] = time.monotonic()
+                self.pool.putconn(conn)
+            self._available.release()
+
+    def _fetch(self, query: str, params: tuple, name: str = "query") -> list:
+        """
+        Выполнение запроса с одной повторной попыткой при обрыве соединения.
+
+        Длительность (включая ожидание соединения) пишется в гистограмму
+        sim_db_fetch_seconds с меткой name.
+        """
+        started = time.perf_counter()
+        try:
+            for attempt in range(2):
+                try:
+                    with self.connection() as conn:
+                        with conn.cursor() as cursor:
+                            cursor.execute(query, params)
+                            return cursor.fetchall()
+                except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                    if attempt:
+                        raise
+                    logger.warning(f"PostgreSQL connection lost, reconnecting: {e}")
+        finally:
+            DB_FETCH_SECONDS.labels(name).observe(time.perf_counter() - started)
 
     def get_article_by_id(self, article_id: int) -> Optional[Article]:
         """
@@ -61,27 +148,127 @@ class PostgresOperator:
             Optional[Article]: Pydantic-модель статьи или None, если статья не найдена.
         """
         try:
-            with self.conn.cursor() as cursor:
-                cursor.execute(
-                    """
-                    SELECT id, name, text, complexity, reading_time, tags
-                    FROM scrapping.articles
-                    WHERE id = %s
-                    """,
-                    (article_id,)
-                )
-                article_data = cursor.fetchone()
-                if article_data:
-                    # Преобразуем tags из JSONB в Python-список
-                    article_data["tags"] = article_data["tags"] if article_data["tags"] else [
-                    ]
-                    # Создаём Pydantic-модель
-                    article = Article(**article_data)
-                    logger.info(f"Retrieved article with ID {article_id}")
-                    return article
-                logger.info(f"Article with ID {article_id} not found")
-                return None
+            rows = self._fetch(
+                """
+                SELECT id, name, text, complexity, reading_time, tags
+                FROM scrapping.articles
+                WHERE id = %s
+                """,
+                (article_id,),
+                "article_by_id"
+            )
+            if rows:
+                article_data = rows[0]
+                # Преобразуем tags из JSONB в Python-список
+                article_data["tags"] = article_data["tags"] if article_data["tags"] else [
+                ]
+                # Создаём Pydantic-модель
+                article = Article(**article_data)
+                logger.info(f"Retrieved article with ID {article_id}")
+                return article
+            logger.info(f"Article with ID {article_id} not found")
+            return None
         except Exception as e:
             logger.error(f"Error retrieving article with ID {article_id}: {e}")
-            self.conn.rollback()
             return None
+
+    def get_articles_by_ids(self, article_ids: List[int], raise_on_error: bool = False) -> List[Article]:
+        """
+        Получение нескольких статей из таблицы articles одним запросом.
+
+        Args:
+            article_ids (List[int]): Список ID статей (например, в порядке ранжирования).
+            raise_on_error (bool): Пробрасывать ошибку БД вместо возврата пустого списка.
+
+        Returns:
+            List[Article]: Найденные статьи в порядке article_ids (отсутствующие пропускаются).
+        """
+        return self._get_by_ids(article_ids, "id, name, text, complexity, reading_time, tags", Article,
+                                raise_on_error, "articles_by_ids")
+
+    def get_article_summaries_by_ids(self, article_ids: List[int]) -> List[ArticleSummary]:
+        """
+        Получение статей без колонки text (для выдачи поиска с fields=summary).
+
+        Returns:
+            List[ArticleSummary]: Найденные статьи в порядке article_ids.
+        """
+        return self._get_by_ids(article_ids, "id, name, complexity, reading_time, tags", ArticleSummary,
+                                name="summaries_by_ids")
+
+    def _get_by_ids(self, article_ids: List[int], columns: str, model, raise_on_error: bool = False,
+                    name: str = "query"):
+        if not article_ids:
+            return []
+        try:
+            rows = self._fetch(
+                f"""
+                SELECT {columns}
+                FROM scrapping.articles
+                WHERE id = ANY(%s)
+                """,
+                (list(article_ids),),
+                name
+            )
+            by_id = {}
+            for row in rows:
+                row["tags"] = row["tags"] if row["tags"] else []
+                by_id[row["id"]] = model(**row)
+            articles = [by_id[article_id]
+                        for article_id in article_ids if article_id in by_id]
+            logger.info(
+                f"Retrieved {len(articles)} of {len(article_ids)} requested articles")
+            return articles
+        except Exception as e:
+            logger.error(f"Error retrieving articles {article_ids}: {e}")
+            if raise_on_error:
+                raise
+            return []
+
+    def count_articles(self, after_id: int = 0) -> int:
+        """Количество статей с ID больше after_id (для оценки прогресса переиндексации)."""
+        rows = self._fetch(
+            "SELECT count(*) AS total FROM scrapping.articles WHERE id > %s", (after_id,), "count_articles")
+        return rows[0]["total"]
+
+    def iter_articles(self, after_id: int = 0, chunk_size: int = 1000) -> Iterator[List[Article]]:
+        """
+        Потоковое чтение статей в порядке ID через именованный (серверный) курсор.
+
+        В памяти одновременно находится не больше chunk_size строк. Курсор
+        живёт внутри транзакции на отдельном соединении пула, которое занято
+        до конца итерации.
+
+        Args:
+            after_id (int): Читать статьи с ID больше указанного (продолжение с контрольной точки).
+            chunk_size (int): Количество строк, получаемых с сервера за один раз.
+
+        Yields:
+            List[Article]: Очередная порция статей.
+        """
+        with self.connection() as conn:
+            # Именованный курсор работает только внутри транзакции
+            conn.autocommit = False
+            try:
+                with conn.cursor(name="reindex_articles") as cursor:
+                    cursor.itersize = chunk_size
+                    cursor.execute(
+                        """
+                        SELECT id, name, text, complexity, reading_time, tags
+                        FROM scrapping.articles
+                        WHERE id > %s
+                        ORDER BY id
+                        """,
+                        (after_id,)
+                    )
+                    while True:
+                        rows = cursor.fetchmany(chunk_size)
+                        if not rows:
+                            break
+                        for row in rows:
+                            row["tags"] = row["tags"] if row["tags"] else []
+                        yield [Article(**row) for row in rows]
+            finally:
+                if not conn.closed:
+                    conn.rollback()
+                    conn.autocommit = True
@@ -0,0 +1,92 @@
+"""
+Бенчмарк масштабирования кодирования статей по числу процессов EmbeddingWorkerPool.
+
+Для каждого количества воркеров создаётся пул, модель прогревается, затем
+кодируется один и тот же набор синтетических текстов. В конце для сравнения
+измеряется кодирование в основном процессе (как при embedding_workers: 0).
+
+Пример:
+    python embedding_benchmark.py --texts 2000 --workers 1 2 4 8 --torch-threads 1
+    python embedding_benchmark.py --workers 4 8 16 --torch-threads 2 --output scaling.json
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from embedding_pool import EmbeddingWorkerPool
+
+WORDS = ("python", "алгоритм", "данные", "модель", "сервис", "индекс", "запрос",
+         "обучение", "сеть", "функция", "класс", "поток", "память", "кэш", "база")
+
+
+def synthetic_texts(count: int, words: int, seed: int = 0) -> list:
+    """Предобработанные тексты статей заданной длины (в словах)."""
+    rng = np.random.default_rng(seed)
+    return [" ".join(rng.choice(WORDS, words)) for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="distiluse-base-multilingual-cased-v1")
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--words", type=int, default=200,
+                        help="длина текста в словах (модель обрезает вход до max_seq_length)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--torch-threads", type=int, default=1,
+                        help="потоки torch в каждом воркере")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--chunk-size", type=int, default=64)
+    parser.add_argument("--skip-in-process", action="store_true",
+                        help="не измерять кодирование в основном процессе")
+    parser.add_argument("--output", help="путь для JSON-отчёта")
+    args = parser.parse_args()
+
+    texts = synthetic_texts(args.texts, args.words)
+    print(f"Texts: {len(texts)}, words per text: {args.words}, cpu count: {os.cpu_count()}")
+
+    rows = []
+    # Пулы создаются до загрузки модели в основном процессе: воркеры запускаются через fork
+    for workers in args.workers:
+        pool = EmbeddingWorkerPool(args.model, workers, args.torch_threads, args.chunk_size)
+        try:
+            dimension = pool.dimension()
+            # Прогрев: модель загружена во всех воркерах
+            pool.encode(texts[:workers * 2], dimension, args.batch_size)
+            start = time.perf_counter()
+            pool.encode(texts, dimension, args.batch_size)
+            elapsed = time.perf_counter() - start
+        finally:
+            pool.shutdown()
+        rows.append({"mode": "pool", "workers": workers, "torch_threads": args.torch_threads,
+                     "seconds": elapsed, "texts_per_s": len(texts) / elapsed})
+
+    if not args.skip_in_process:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(args.model)
+        model.encode(texts[:args.batch_size], batch_size=args.batch_size)
+        start = time.perf_counter()
+        model.encode(texts, batch_size=args.batch_size, convert_to_numpy=True)
+        elapsed = time.perf_counter() - start
+        rows.append({"mode": "in_process", "workers": 0, "torch_threads": None,
+                     "seconds": elapsed, "texts_per_s": len(texts) / elapsed})
+
+    base = next((row["texts_per_s"] for row in rows if row["mode"] == "pool"), None)
+    print(f"{'mode':<11} {'workers':>7} {'threads':>7} {'seconds':>9} {'texts/s':>9} {'speedup':>8}")
+    for row in rows:
+        row["speedup"] = row["texts_per_s"] / base if base else None
+        print(f"{row['mode']:<11} {row['workers']:>7} {row['torch_threads'] or '-':>7} "
+              f"{row['seconds']:>9.2f} {row['texts_per_s']:>9.1f} {row['speedup']:>7.2f}x")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"texts": len(texts), "words": args.words, "cpu_count": os.cpu_count(),
+                       "batch_size": args.batch_size, "results": rows}, f, indent=2)
+        print(f"Report saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
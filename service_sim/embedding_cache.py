@@ -0,0 +1,134 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+KEY_SIZE = 16
+EMPTY_KEY = b"\0" * KEY_SIZE
+
+
+def cache_key(model_name: str, processed_text: str) -> bytes:
+    """Ключ кэша: хеш имени модели и предобработанного текста."""
+    digest = hashlib.blake2b(digest_size=KEY_SIZE)
+    digest.update(model_name.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(processed_text.encode("utf-8"))
+    return digest.digest()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str, dimension: int, max_entries: int = 200000):
+        """
+        Дисковый кэш эмбеддингов с адресацией по содержимому.
+
+        Векторы хранятся в memory-mapped матрице float32 (vectors.f32), ключи
+        слотов — в отдельном memory-mapped файле (keys.bin), по которому при
+        старте восстанавливается словарь ключ -> слот. При заполнении
+        вытесняются давно не использовавшиеся записи: словарь упорядочен по
+        последнему обращению, поэтому вытеснение стоит O(1), а не проход по
+        всем слотам.
+
+        Args:
+            path (str): Директория кэша.
+            dimension (int): Размерность эмбеддингов.
+            max_entries (int): Максимальное количество записей.
+        """
+        self.path = path
+        self.dimension = dimension
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.path, exist_ok=True)
+        meta_path = os.path.join(self.path, "meta.json")
+        meta = {"dimension": dimension, "max_entries": max_entries}
+        existing = None
+        if os.path.exists(meta_path):
+            with open(meta_path, "r") as f:
+                existing = json.load(f)
+        # При смене размерности или ёмкости кэш создаётся заново
+        mode = "r+" if existing == meta else "w+"
+        if mode == "w+":
+            with open(meta_path, "w") as f:
+                json.dump(meta, f)
+
+        self.vectors = np.memmap(os.path.join(self.path, "vectors.f32"), dtype=np.float32,
+                                 mode=mode, shape=(max_entries, dimension))
+        self.keys = np.memmap(os.path.join(self.path, "keys.bin"), dtype=f"S{KEY_SIZE}",
+                              mode=mode, shape=(max_entries,))
+        # Ключ -> слот от давно не использовавшихся к недавним (порядок только в памяти)
+        self.slots: "OrderedDict[bytes, int]" = OrderedDict()
+        self.free_slots: List[int] = []
+        for slot, key in enumerate(self.keys.tolist()):
+            # memmap-чтение S16 обрезает завершающие нули, поэтому дополняем
+            key = key.ljust(KEY_SIZE, b"\0")
+            if key == EMPTY_KEY:
+                self.free_slots.append(slot)
+            else:
+                self.slots[key] = slot
+        self.free_slots.reverse()
+        logger.info(
+            f"Opened embedding cache {self.path}: {len(self.slots)} of {max_entries} entries")
+
+    def get_many(self, keys: List[bytes]) -> List[Optional[np.ndarray]]:
+        """Поиск эмбеддингов по ключам; для отсутствующих возвращается None."""
+        results = []
+        with self._lock:
+            for key in keys:
+                slot = self.slots.get(key)
+                if slot is None:
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                self.hits += 1
+                self.slots.move_to_end(key)
+                results.append(np.array(self.vectors[slot]))
+        return results
+
+    def put_many(self, keys: List[bytes], vectors: np.ndarray):
+        """Сохранение эмбеддингов; при нехватке места вытесняются самые старые записи."""
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                if key in self.slots:
+                    continue
+                slot = self._allocate_slot()
+                # Сначала обнуляем ключ, затем пишем вектор и только потом ключ:
+                # при падении процесса слот окажется пустым, но не перепутанным
+                self.keys[slot] = EMPTY_KEY
+                self.vectors[slot] = vector
+                self.keys[slot] = key
+                self.slots[key] = slot
+
+    def _allocate_slot(self) -> int:
+        if self.free_slots:
+            return self.free_slots.pop()
+        _, slot = self.slots.popitem(last=False)
+        self.evictions += 1
+        return slot
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.slots),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def flush(self):
+        """Сброс memory-mapped файлов на диск."""
+        with self._lock:
+            self.vectors.flush()
+            self.keys.flush()
@@ -0,0 +1,137 @@
+import logging
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import resource_tracker, shared_memory
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Модель, загруженная в процессе-воркере (SentenceTransformer или граф ONNX Runtime)
+_model = None
+
+
+def _init_worker(model_name: str, torch_threads: int, backend_config: Optional[dict] = None):
+    """Инициализация воркера: ограничение потоков инференса и однократная загрузка модели."""
+    global _model
+    from inference_backend import backend_type, load_model
+    backend = backend_type(backend_config)
+    if backend == "torch":
+        import torch
+        torch.set_num_threads(torch_threads)
+    _model = load_model(model_name, backend_config, threads=torch_threads)
+    logger.info(
+        f"Embedding worker {os.getpid()} loaded {model_name} ({backend}, {torch_threads} threads)")
+
+
+def _worker_pid() -> int:
+    return os.getpid()
+
+
+def _worker_dimension() -> int:
+    return _model.get_sentence_embedding_dimension()
+
+
+def _encode_chunk(shm_name: str, shape: Tuple[int, int], start: int, texts: List[str], batch_size: int) -> int:
+    """Кодирование части текстов с записью векторов в общую память по смещению start."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        out = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        out[start:start + len(texts)] = _model.encode(
+            texts, batch_size=batch_size, convert_to_numpy=True)
+        del out
+    finally:
+        shm.close()
+    return len(texts)
+
+
+class EmbeddingWorkerPool:
+    def __init__(self, model_name: str, workers: int, torch_threads: int = 1, chunk_size: int = 64,
+                 backend_config: Optional[dict] = None):
+        """
+        Пул процессов для кодирования статей при индексации.
+
+        Каждый воркер один раз загружает модель и получает куски
+        предобработанных текстов; векторы float32 записываются в общую память
+        (multiprocessing.shared_memory), а не передаются через pickle. Индекс
+        FAISS остаётся только в основном процессе.
+
+        Воркеры создаются через fork сразу при создании пула: main.py собирает
+        сервис на уровне модуля, и spawn повторно импортировал бы его в каждом
+        воркере. Поэтому пул нужно создавать до первого использования torch и
+        до запуска потоков в основном процессе.
+
+        Args:
+            model_name (str): Название модели SentenceTransformer.
+            workers (int): Количество процессов.
+            torch_threads (int): Количество потоков torch (или ONNX Runtime) в каждом процессе.
+            chunk_size (int): Максимальное количество текстов в одной задаче воркера.
+            backend_config (Optional[dict]): Бэкенд инференса (см. inference_backend.py).
+        """
+        self.model_name = model_name
+        self.workers = workers
+        self.torch_threads = torch_threads
+        self.chunk_size = chunk_size
+        # Воркеры должны унаследовать трекер ресурсов основного процесса, иначе
+        # собственный трекер воркера удалит сегменты общей памяти при его выходе
+        resource_tracker.ensure_running()
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(model_name, torch_threads, backend_config))
+        # Первая задача запускает все процессы; модель загружается в них в фоне
+        self.executor.submit(_worker_pid)
+        logger.info(
+            f"Started embedding worker pool: {workers} processes x {torch_threads} torch threads")
+
+    def dimension(self) -> int:
+        """Размерность эмбеддингов (ждёт загрузки модели хотя бы в одном воркере)."""
+        return self.executor.submit(_worker_dimension).result()
+
+    def encode(self, texts: List[str], dimension: int, batch_size: int = 32) -> np.ndarray:
+        """
+        Кодирование предобработанных текстов воркерами пула.
+
+        Returns:
+            numpy.ndarray: Матрица float32 формы (len(texts), dimension) в порядке texts.
+        """
+        shape = (len(texts), dimension)
+        if not texts:
+            return np.zeros(shape, dtype=np.float32)
+        chunk = max(1, min(self.chunk_size, math.ceil(len(texts) / self.workers)))
+        shm = shared_memory.SharedMemory(
+            create=True, size=len(texts) * dimension * 4)
+        try:
+            futures = [self.executor.submit(_encode_chunk, shm.name, shape, start,
+                                            texts[start:start + chunk], batch_size)
+                       for start in range(0, len(texts), chunk)]
+            # Дожидаемся всех задач, даже если одна упала: воркеры пишут в общую память
+            wait(futures)
+            for future in futures:
+                future.result()
+            view = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+            embeddings = view.copy()
+            del view
+            return embeddings
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+def create_worker_pool(model_name: str, ingest_config: dict,
+                       backend_config: Optional[dict] = None) -> Optional[EmbeddingWorkerPool]:
+    """Пул воркеров по секции ingest конфигурации (None, если embedding_workers = 0)."""
+    workers = ingest_config.get("embedding_workers", 0)
+    if workers <= 0:
+        return None
+    return EmbeddingWorkerPool(model_name, workers,
+                               ingest_config.get("torch_threads_per_worker", 1),
+                               ingest_config.get("worker_chunk_size", 64), backend_config)
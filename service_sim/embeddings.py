@@ -1,70 +1,93 @@
-import re
-import markdown
-from sentence_transformers import SentenceTransformer
 import logging
+import time
 import numpy as np
+from typing import List, Optional
+from embedding_cache import EmbeddingCache, cache_key
+from embedding_pool import EmbeddingWorkerPool
+from inference_backend import backend_type, load_model, model_id
+from markdown_preprocessor import preprocess_markdown
+from metrics import ENCODE_SECONDS, PREPROCESS_SECONDS, batch_size_label
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
 class EmbeddingGenerator:
-    def __init__(self, model_name: str = "distiluse-base-multilingual-cased-v1"):
+    def __init__(self, model_name: str = "distiluse-base-multilingual-cased-v1", cache_dir: Optional[str] = None, cache_max_entries: int = 200000,
+                 worker_pool: Optional[EmbeddingWorkerPool] = None, lazy: bool = False,
+                 backend_config: Optional[dict] = None):
         """
         Инициализация генератора эмбеддингов.
 
         Args:
             model_name (str): Название модели SentenceTransformer.
+            cache_dir (Optional[str]): Директория дискового кэша эмбеддингов (None — без кэша).
+            cache_max_entries (int): Максимальное количество записей в кэше.
+            worker_pool (Optional[EmbeddingWorkerPool]): Пул процессов для кодирования при индексации.
+            lazy (bool): Не загружать модель сразу (загрузка вызовом load, например в фоне).
+            backend_config (Optional[dict]): Бэкенд инференса (секция embedding_backend,
+                см. inference_backend.py); по умолчанию torch.
         """
-        self.model = SentenceTransformer(model_name)
-        logger.info(f"Initialized SentenceTransformer model: {model_name}")
+        self.model_name = model_name
+        self.backend_config = backend_config or {}
+        self.backend = backend_type(self.backend_config)
+        # Векторы разных бэкендов кэшируются раздельно
+        self.cache_model_name = model_id(model_name, self.backend_config)
+        self.worker_pool = worker_pool
+        self.cache_dir = cache_dir
+        self.cache_max_entries = cache_max_entries
+        self.model = None
+        self.cache = None
+        if not lazy:
+            self.load()
+
+    def load(self, warmup: bool = False):
+        """
+        Загрузка модели и дискового кэша эмбеддингов.
+
+        Args:
+            warmup (bool): Выполнить пробное кодирование, чтобы первый запрос
+                не оплачивал ленивую инициализацию torch (или сессии ONNX Runtime).
+        """
+        model = load_model(self.model_name, self.backend_config)
+        logger.info(f"Initialized embedding model: {self.model_name} ({self.backend} backend)")
+        if self.cache_dir:
+            self.cache = EmbeddingCache(
+                self.cache_dir, model.get_sentence_embedding_dimension(), self.cache_max_entries)
+        if warmup:
+            model.encode(["прогрев модели", "model warm-up"], convert_to_numpy=True)
+            logger.info(f"Warmed up embedding model: {self.model_name}")
+        self.model = model
 
     def preprocess_markdown(self, text: str) -> str:
         """
         Предобработка текста Markdown для удаления форматирования и выделения информативного контента.
 
+        Разметка снимается одним проходом без рендеринга в HTML
+        (см. markdown_preprocessor.py), блоки кода и инлайн-код удаляются.
+
         Args:
             text (str): Входной текст в формате Markdown.
 
         Returns:
             str: Очищенный текст, готовый для генерации эмбеддинга.
         """
+        started = time.perf_counter()
         try:
-            # Конвертация Markdown в текст
-            html = markdown.markdown(text)
-
-            # Удаление HTML-тегов
-            clean_text = re.sub(r'<[^>]+>', '', html)
-
-            # Удаление остатков Markdown-форматирования
-            clean_text = re.sub(r'\[([^\]]*)\]\([^\)]*\)',
-                                r'\1', clean_text)  # Ссылки
-            clean_text = re.sub(r'```.*?```', '', clean_text,
-                                flags=re.DOTALL)  # Кодовые блоки
-            clean_text = re.sub(r'`.*?`', '', clean_text)  # Инлайн-код
-            clean_text = re.sub(r'#+ ', '', clean_text)  # Заголовки
-            clean_text = re.sub(r'[-*+]\s', '', clean_text)  # Списки
-
-            # Удаление специальных символов, оставляем буквы, цифры и пробелы
-            clean_text = re.sub(r'[^\w\s]', '', clean_text)
-
-            # Нормализация пробелов
-            clean_text = re.sub(r'\s+', ' ', clean_text).strip()
-
-            logger.debug(f"Processed Markdown text: {clean_text[:100]}...")
-
-            # Если текст пустой, возвращаем пробел
-            return clean_text if clean_text else " "
+            return preprocess_markdown(text)
         except Exception as e:
             logger.error(f"Error preprocessing Markdown: {e}")
             return " "
+        finally:
+            PREPROCESS_SECONDS.observe(time.perf_counter() - started)
 
-    def generate_embedding(self, text: str) -> np.ndarray:
+    def generate_embedding(self, text: str, use_cache: bool = True) -> np.ndarray:
         """
         Генерация эмбеддинга для текста с предобработкой.
 
         Args:
             text (str): Входной текст (Markdown).
+            use_cache (bool): Использовать ли дисковый кэш эмбеддингов.
 
         Returns:
             numpy.ndarray: Эмбеддинг текста.
@@ -72,12 +95,95 @@ class EmbeddingGenerator:
         try:
             # Предобработка текста
             processed_text = self.preprocess_markdown(text)
+            key = None
+            if use_cache and self.cache is not None:
+                key = cache_key(self.cache_model_name, processed_text)
+                cached = self.cache.get_many([key])[0]
+                if cached is not None:
+                    return cached
             # Генерация эмбеддинга
+            started = time.perf_counter()
             embedding = self.model.encode(
                 processed_text, convert_to_numpy=True)
+            ENCODE_SECONDS.labels("1", "model").observe(time.perf_counter() - started)
             logger.info(
                 f"Generated embedding for text, shape: {embedding.shape}")
+            if key is not None:
+                self.cache.put_many([key], embedding.reshape(1, -1))
             return embedding
         except Exception as e:
             logger.error(f"Error generating embedding: {e}")
-            return np.zeros(self.model.get_sentence_embedding_dimension())
+            raise
+
+    def generate_embeddings(self, texts: List[str], batch_size: int = 32, use_cache: bool = True,
+                            use_workers: bool = False, preprocessed: bool = False) -> np.ndarray:
+        """
+        Генерация эмбеддингов для списка текстов одним вызовом model.encode.
+
+        Тексты, эмбеддинги которых уже есть в кэше, повторно не кодируются.
+        Ошибка модели или пула воркеров пробрасывается: батч индексации
+        повторяется без фиксации смещений Kafka.
+
+        Args:
+            texts (List[str]): Входные тексты (Markdown).
+            batch_size (int): Размер батча для SentenceTransformer.encode.
+            use_cache (bool): Использовать ли дисковый кэш эмбеддингов.
+            use_workers (bool): Кодировать в пуле процессов (если он задан), а не в текущем процессе.
+            preprocessed (bool): Тексты уже прошли preprocess_markdown.
+
+        Returns:
+            numpy.ndarray: Матрица эмбеддингов формы (len(texts), dimension).
+        """
+        dimension = self.model.get_sentence_embedding_dimension()
+        if not texts:
+            return np.zeros((0, dimension), dtype=np.float32)
+        try:
+            processed_texts = texts if preprocessed else [self.preprocess_markdown(text) for text in texts]
+            if not use_cache or self.cache is None:
+                embeddings = self._encode(
+                    processed_texts, batch_size, use_workers)
+                logger.info(
+                    f"Generated embeddings for {len(texts)} texts, shape: {embeddings.shape}")
+                return embeddings
+
+            keys = [cache_key(self.cache_model_name, text)
+                    for text in processed_texts]
+            cached = self.cache.get_many(keys)
+            embeddings = np.zeros((len(texts), dimension), dtype=np.float32)
+            missing = [i for i, vector in enumerate(cached) if vector is None]
+            for i, vector in enumerate(cached):
+                if vector is not None:
+                    embeddings[i] = vector
+            if missing:
+                encoded = self._encode(
+                    [processed_texts[i] for i in missing], batch_size, use_workers)
+                embeddings[missing] = encoded
+                self.cache.put_many([keys[i] for i in missing], embeddings[missing])
+            logger.info(
+                f"Generated embeddings for {len(texts)} texts ({len(texts) - len(missing)} from cache), shape: {embeddings.shape}")
+            return embeddings
+        except Exception as e:
+            # Нулевой вектор вместо ошибки попал бы в журнал и индекс вместе с хешем
+            # текста, и статья больше никогда не была бы перекодирована
+            logger.error(f"Error generating embeddings for batch: {e}")
+            raise
+
+    def _encode(self, processed_texts: List[str], batch_size: int, use_workers: bool) -> np.ndarray:
+        started = time.perf_counter()
+        if use_workers and self.worker_pool is not None:
+            embeddings = self.worker_pool.encode(
+                processed_texts, self.model.get_sentence_embedding_dimension(), batch_size)
+            target = "workers"
+        else:
+            embeddings = np.asarray(self.model.encode(
+                processed_texts, batch_size=batch_size, convert_to_numpy=True), dtype=np.float32)
+            target = "model"
+        ENCODE_SECONDS.labels(batch_size_label(len(processed_texts)), target).observe(
+            time.perf_counter() - started)
+        return embeddings
+
+    def cache_stats(self) -> dict:
+        """Статистика кэша эмбеддингов (попадания, промахи, вытеснения)."""
+        if self.cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.cache.stats()}
@@ -0,0 +1,324 @@
+import json
+import logging
+import os
+import threading
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Файлы снапшота с сопоставлением ID статьи -> строка файла векторов
+MAPPING_FILE = "exact_vectors.npy"
+STATE_FILE = "exact_vectors.json"
+
+
+def process_rss_bytes() -> int:
+    """Резидентная память процесса (VmRSS) в байтах."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def mapped_rss_bytes(path: str) -> int:
+    """Резидентная часть отображений файла path в памяти процесса (по /proc/self/smaps)."""
+    total = 0
+    inside = False
+    try:
+        with open("/proc/self/smaps", "r") as f:
+            for line in f:
+                if line[0] in "0123456789abcdef" and "-" in line.split(" ", 1)[0]:
+                    inside = line.rstrip("\n").endswith(path)
+                elif inside and line.startswith("Rss:"):
+                    total += int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return total
+
+
+class ExactVectors:
+    def __init__(self, directory: str, dimension: int):
+        """
+        Точные векторы float32 статей в memory-mapped файле на диске.
+
+        Используются для переранжирования кандидатов сжатого индекса и для
+        перестройки индекса без потери точности. Файл только дописывается:
+        новая версия вектора статьи занимает новую строку, старая становится
+        мусором и вычищается перезаписью в файл следующего поколения
+        (compact). Сопоставление ID -> строка сохраняется в снапшоте вместе с
+        количеством строк, поэтому строки, дописанные после снапшота, при
+        загрузке отрезаются и восстанавливаются воспроизведением журнала.
+        Файл прежнего поколения удаляется только после публикации снапшота,
+        который на него больше не ссылается.
+
+        Args:
+            directory (str): Директория файлов векторов (<поколение>.f32).
+            dimension (int): Размерность векторов.
+        """
+        self.directory = directory
+        self.dimension = dimension
+        self.row_bytes = dimension * 4
+        self.rows: Dict[int, int] = {}
+        self.generation = None
+        self.row_count = 0
+        self._file = None
+        self._view = None
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"{generation:06d}.f32")
+
+    def _new_generation(self) -> int:
+        existing = [int(name[:-4]) for name in os.listdir(self.directory)
+                    if name.endswith(".f32") and name[:-4].isdigit()]
+        return max(existing, default=-1) + 1
+
+    def _ensure_open(self):
+        if self._file is None:
+            self.generation = self._new_generation()
+            self._file = open(self._path(self.generation), "w+b")
+            self.row_count = 0
+
+    def upsert(self, article_ids: np.ndarray, vectors: np.ndarray):
+        """Запись векторов статей в конец файла."""
+        if not len(article_ids):
+            return
+        data = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock:
+            self._ensure_open()
+            self._file.seek(self.row_count * self.row_bytes)
+            self._file.write(data.tobytes())
+            self._file.flush()
+            for row, article_id in enumerate(np.asarray(article_ids).tolist(), self.row_count):
+                self.rows[article_id] = row
+            self.row_count += len(data)
+
+    def delete(self, article_ids: np.ndarray):
+        with self._lock:
+            for article_id in np.asarray(article_ids).tolist():
+                self.rows.pop(article_id, None)
+
+    def _current_view(self) -> Optional[np.ndarray]:
+        """Отображение файла, покрывающее все записанные строки (переотображается при росте)."""
+        if self.row_count == 0:
+            return None
+        if self._view is None or len(self._view) < self.row_count:
+            # Прежнее отображение остаётся валидным у читателей, которые его уже взяли
+            self._view = np.memmap(self._path(self.generation), dtype=np.float32, mode="r",
+                                   shape=(self.row_count, self.dimension))
+        return self._view
+
+    def get(self, article_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Векторы статей по ID.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Матрица (len(article_ids), dimension)
+                и маска найденных ID (для отсутствующих строки нулевые).
+        """
+        with self._lock:
+            rows = np.fromiter((self.rows.get(article_id, -1) for article_id in np.asarray(article_ids).tolist()),
+                               dtype=np.int64, count=len(article_ids))
+            view = self._current_view()
+        found = rows >= 0
+        vectors = np.zeros((len(rows), self.dimension), dtype=np.float32)
+        if found.any():
+            vectors[found] = view[rows[found]]
+        return vectors, found
+
+    def rerank(self, queries: np.ndarray, distances: np.ndarray, indices: np.ndarray,
+               k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Переранжирование кандидатов индекса по точным расстояниям L2 (в квадрате, как IndexFlatL2).
+
+        Кандидаты без точного вектора сохраняют приближённое расстояние индекса.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Матрицы расстояний и ID формы (len(queries), k).
+        """
+        out_distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        out_indices = np.full((len(queries), k), -1, dtype=np.int64)
+        for i, (query, row_distances, row_ids) in enumerate(zip(queries, distances, indices)):
+            valid = row_ids >= 0
+            row_ids, row_distances = row_ids[valid], row_distances[valid].copy()
+            if not len(row_ids):
+                continue
+            vectors, found = self.get(row_ids)
+            diff = vectors[found] - query
+            row_distances[found] = np.einsum("ij,ij->i", diff, diff)
+            order = np.argsort(row_distances, kind="stable")[:k]
+            out_distances[i, :len(order)] = row_distances[order]
+            out_indices[i, :len(order)] = row_ids[order]
+        return out_distances, out_indices
+
+    def all(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Все живые векторы в порядке строк файла: ID (int64) и векторы (float32)."""
+        with self._lock:
+            items = sorted(self.rows.items(), key=lambda item: item[1])
+            view = self._current_view()
+        if not items:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, self.dimension), dtype=np.float32)
+        ids, rows = np.asarray(items, dtype=np.int64).T
+        return ids, np.asarray(view[rows])
+
+    def chunks(self, chunk_rows: int = 65536) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Живые векторы порциями по chunk_rows строк: ID (int64) и векторы (float32)."""
+        with self._lock:
+            items = sorted(self.rows.items(), key=lambda item: item[1])
+            view = self._current_view()
+        for start in range(0, len(items), chunk_rows):
+            ids, rows = np.asarray(items[start:start + chunk_rows], dtype=np.int64).T
+            yield ids, np.asarray(view[rows])
+
+    def sample(self, size: int, seed: int = 0) -> np.ndarray:
+        """Случайная выборка не более size живых векторов (для обучения индекса)."""
+        with self._lock:
+            rows = np.fromiter(self.rows.values(), dtype=np.int64, count=len(self.rows))
+            view = self._current_view()
+        if len(rows) > size:
+            rows = np.random.default_rng(seed).choice(rows, size, replace=False)
+        if not len(rows):
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        return np.asarray(view[np.sort(rows)])
+
+    def replace(self, chunks: Iterable[Tuple[np.ndarray, np.ndarray]]):
+        """
+        Замена всех векторов (переиндексация): файл нового поколения заполняется
+        из chunks и подменяет текущий; до подмены читатели видят прежние векторы.
+        """
+        generation = self._new_generation()
+        new_file = open(self._path(generation), "w+b")
+        rows = {}
+        for article_ids, vectors in chunks:
+            new_file.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            for row, article_id in enumerate(np.asarray(article_ids).tolist(), len(rows)):
+                rows[article_id] = row
+        new_file.flush()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            self._file = new_file
+            self.generation = generation
+            self.row_count = new_file.tell() // self.row_bytes
+            self.rows = rows
+            self._view = None
+        logger.info(f"Replaced exact vectors with generation {generation}: {len(rows)} rows")
+
+    def dead_ratio(self) -> float:
+        return 1 - len(self.rows) / self.row_count if self.row_count else 0.0
+
+    def compact(self, chunk_rows: int = 65536):
+        """Перезапись живых векторов в файл нового поколения (вызывается при снапшоте)."""
+        with self._lock:
+            items = sorted(self.rows.items(), key=lambda item: item[1])
+            view = self._current_view()
+            generation = self._new_generation()
+            new_file = open(self._path(generation), "w+b")
+            for start in range(0, len(items), chunk_rows):
+                rows = [row for _, row in items[start:start + chunk_rows]]
+                new_file.write(np.ascontiguousarray(view[rows]).tobytes())
+            new_file.flush()
+            dead = self.row_count - len(items)
+            if self._file is not None:
+                self._file.close()
+            self._file = new_file
+            self.generation = generation
+            self.row_count = len(items)
+            self.rows = {article_id: row for row, (article_id, _) in enumerate(items)}
+            self._view = None
+        logger.info(
+            f"Compacted exact vectors into generation {generation}: {len(items)} rows, {dead} dropped")
+
+    def save(self, snapshot_dir: str):
+        """fsync файла векторов и запись сопоставления ID -> строка в директорию снапшота."""
+        with self._lock:
+            self._ensure_open()
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            mapping = np.array(list(self.rows.items()), dtype=np.int64).reshape(-1, 2)
+            state = {"file": os.path.basename(self._path(self.generation)),
+                     "rows": self.row_count, "dimension": self.dimension}
+        np.save(os.path.join(snapshot_dir, MAPPING_FILE), mapping)
+        with open(os.path.join(snapshot_dir, STATE_FILE), "w") as f:
+            json.dump(state, f)
+
+    def load(self, snapshot_dir: str) -> bool:
+        """
+        Загрузка состояния из снапшота.
+
+        Returns:
+            bool: False, если снапшот записан без точных векторов.
+        """
+        state_path = os.path.join(snapshot_dir, STATE_FILE)
+        if not os.path.exists(state_path):
+            return False
+        with open(state_path, "r") as f:
+            state = json.load(f)
+        path = os.path.join(self.directory, state["file"])
+        if state["dimension"] != self.dimension or not os.path.exists(path):
+            logger.warning(f"Exact vectors {path} are missing or have another dimension")
+            return False
+        mapping = np.load(os.path.join(snapshot_dir, MAPPING_FILE))
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            self._file = open(path, "r+b")
+            # Строки, дописанные после снапшота, восстановит журнал
+            self._file.truncate(state["rows"] * self.row_bytes)
+            self.generation = int(state["file"][:-4])
+            self.row_count = state["rows"]
+            self.rows = dict(zip(mapping[:, 0].tolist(), mapping[:, 1].tolist()))
+            self._view = None
+        logger.info(
+            f"Loaded {len(self.rows)} exact vectors from {path}")
+        return True
+
+    def release_old(self):
+        """Удаление файлов прежних поколений (после публикации снапшота)."""
+        current = os.path.basename(self._path(self.generation)) if self.generation is not None else None
+        for name in os.listdir(self.directory):
+            if name.endswith(".f32") and name != current:
+                os.remove(os.path.join(self.directory, name))
+
+    def stats(self) -> dict:
+        path = self._path(self.generation) if self.generation is not None else None
+        return {
+            "vectors": len(self.rows),
+            "file_rows": self.row_count,
+            "dead_ratio": round(self.dead_ratio(), 4),
+            "file_bytes": self.row_count * self.row_bytes,
+            "resident_bytes": mapped_rss_bytes(path) if path else 0,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._view = None
+
+
+def load_exact_vectors(snapshot_dir: str, directory: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Точные векторы снапшота (ID и векторы) либо None, если снапшот записан без них."""
+    state_path = os.path.join(snapshot_dir, STATE_FILE)
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, "r") as f:
+        state = json.load(f)
+    path = os.path.join(directory, state["file"])
+    if not os.path.exists(path) or not state["rows"]:
+        return None
+    mapping = np.load(os.path.join(snapshot_dir, MAPPING_FILE))
+    view = np.memmap(path, dtype=np.float32, mode="r",
+                     shape=(state["rows"], state["dimension"]))
+    return mapping[:, 0], np.asarray(view[mapping[:, 1]])
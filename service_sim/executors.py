@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Очередь пула переполнена, запрос отклоняется без ожидания."""
+
+
+class BoundedExecutor:
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        """
+        Пул потоков с ограниченной очередью.
+
+        Если в пуле уже max_workers выполняющихся и max_queue ожидающих задач,
+        новая задача сразу отклоняется с QueueFullError, а не копится в очереди.
+
+        Args:
+            name (str): Имя пула (для логов и метрик).
+            max_workers (int): Количество рабочих потоков.
+            max_queue (int): Максимальное количество ожидающих задач.
+        """
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.rejected = 0
+        # Время ожидания в очереди для последних задач, мс
+        self._wait_times = deque(maxlen=1000)
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Выполнение fn в пуле с ожиданием результата в event loop."""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise QueueFullError(f"{self.name} queue is full")
+        submitted = time.perf_counter()
+        with self._lock:
+            self.queued += 1
+
+        def task():
+            with self._lock:
+                self.queued -= 1
+                self.active += 1
+                self._wait_times.append(
+                    (time.perf_counter() - submitted) * 1000)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.active -= 1
+                self._slots.release()
+
+        try:
+            future = self._executor.submit(task)
+        except Exception:
+            with self._lock:
+                self.queued -= 1
+            self._slots.release()
+            raise
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> dict:
+        with self._lock:
+            wait_times = list(self._wait_times)
+            return {
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "active": self.active,
+                "queue_depth": self.queued,
+                "rejected": self.rejected,
+                "wait_ms_avg": sum(wait_times) / len(wait_times) if wait_times else 0.0,
+                "wait_ms_max": max(wait_times) if wait_times else 0.0,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,197 @@
+"""
+Экспорт модели эмбеддингов в ONNX, динамическое квантование int8, проверка
+совпадения с torch и сравнение скорости кодирования на CPU.
+
+Граф включает весь пайплайн SentenceTransformer (трансформер, mean pooling,
+Dense-слой): на входе токены, на выходе sentence_embedding. Модель берётся из
+локального кэша (SENTENCE_TRANSFORMERS_HOME / HF_HOME) без обращения к сети.
+int8-вариант строится quantize_dynamic из onnxruntime: веса MatMul хранятся в
+int8, активации квантуются на лету, калибровочные данные не нужны.
+
+Проверка совпадения: косинусная близость эмбеддингов каждого бэкенда к torch
+на одних и тех же текстах (коротких запросах и длинных статьях, обрезаемых до
+max_seq_length); при минимуме ниже порога команда завершается с кодом 1.
+Затем для каждого размера батча измеряется скорость кодирования torch, onnx и
+onnx_int8 с одинаковым числом потоков.
+
+После экспорта бэкенд включается в секции embedding_backend конфигурации
+(type: onnx или onnx_int8). Эмбеддинги разных бэкендов кэшируются раздельно,
+но индекс, построенный одним бэкендом, стоит перестроить командой reindex.py
+после переключения на другой.
+
+Пример:
+    python export_onnx.py --output-dir /app/faiss_data/onnx/distiluse-base-multilingual-cased-v1
+    python export_onnx.py --skip-export --batch-sizes 1 8 32 64 --threads 4 --output onnx_report.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import yaml
+
+from embedding_benchmark import synthetic_texts
+from inference_backend import EXPORT_FILE, MODEL_FILES, OUTPUT_NAME, load_model
+
+INPUT_NAMES = ("input_ids", "attention_mask", "token_type_ids")
+
+SAMPLE_TEXTS = [
+    "как работает градиентный спуск",
+    "python асинхронное программирование",
+    "Introduction to transformers and attention",
+    "оптимизация запросов PostgreSQL с помощью индексов",
+    "Kubernetes: развёртывание сервиса с автоскейлингом",
+]
+
+
+def export(model, output_dir: str, opset: int):
+    """Экспорт графа fp32 и токенизатора; запись файлов атомарная."""
+    import torch
+
+    class SentenceEmbedding(torch.nn.Module):
+        def __init__(self, model, names):
+            super().__init__()
+            self.model = model
+            self.names = names
+
+        def forward(self, *inputs):
+            return self.model(dict(zip(self.names, inputs)))[OUTPUT_NAME]
+
+    sample = model.tokenize(SAMPLE_TEXTS[:2])
+    names = [name for name in INPUT_NAMES if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in names}
+    dynamic_axes[OUTPUT_NAME] = {0: "batch"}
+    path = os.path.join(output_dir, MODEL_FILES["onnx"])
+    model.eval()
+    with torch.no_grad():
+        torch.onnx.export(SentenceEmbedding(model, names), tuple(sample[name] for name in names),
+                          path + ".tmp", input_names=names, output_names=[OUTPUT_NAME],
+                          dynamic_axes=dynamic_axes, opset_version=opset, do_constant_folding=True)
+    os.replace(path + ".tmp", path)
+    model.tokenizer.save_pretrained(output_dir)
+    print(f"Exported {path} ({os.path.getsize(path) / 2**20:.1f} MB), inputs {names}")
+    return names
+
+
+def quantize(output_dir: str, per_channel: bool):
+    """Динамическое квантование весов графа fp32 в int8."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    source = os.path.join(output_dir, MODEL_FILES["onnx"])
+    path = os.path.join(output_dir, MODEL_FILES["onnx_int8"])
+    quantize_dynamic(source, path + ".tmp", weight_type=QuantType.QInt8, per_channel=per_channel)
+    os.replace(path + ".tmp", path)
+    print(f"Quantized {path} ({os.path.getsize(path) / 2**20:.1f} MB)")
+
+
+def cosine_rows(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+    b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    return np.sum(a * b, axis=1)
+
+
+def throughput(model, texts: list, batch_size: int) -> float:
+    """Тексты в секунду (после прогрева одним батчем)."""
+    model.encode(texts[:batch_size], batch_size=batch_size, convert_to_numpy=True)
+    start = time.perf_counter()
+    model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+    return len(texts) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default="config/config_sim.yaml",
+                        help="конфигурация с секцией embedding_backend (директория экспорта)")
+    parser.add_argument("--model", default="distiluse-base-multilingual-cased-v1")
+    parser.add_argument("--output-dir", help="директория графов (по умолчанию embedding_backend.onnx_dir)")
+    parser.add_argument("--opset", type=int, default=14)
+    parser.add_argument("--per-channel", action="store_true",
+                        help="квантование весов по каналам (точнее, но медленнее на части CPU)")
+    parser.add_argument("--skip-export", action="store_true",
+                        help="только проверка и замер уже экспортированных графов")
+    parser.add_argument("--texts", type=int, default=512)
+    parser.add_argument("--words", type=int, default=200,
+                        help="длина текста статьи в словах для замера скорости")
+    parser.add_argument("--min-cosine", type=float, default=0.999,
+                        help="минимальная косинусная близость onnx к torch")
+    parser.add_argument("--min-cosine-int8", type=float, default=0.97,
+                        help="минимальная косинусная близость onnx_int8 к torch")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--threads", type=int, default=0,
+                        help="потоки torch и ONNX Runtime (0 — по числу ядер)")
+    parser.add_argument("--skip-benchmark", action="store_true")
+    parser.add_argument("--output", help="путь для JSON-отчёта")
+    args = parser.parse_args()
+
+    backend_config = {}
+    if os.path.exists(args.config):
+        with open(args.config, "r") as f:
+            backend_config = (yaml.safe_load(f) or {}).get("embedding_backend", {})
+    output_dir = args.output_dir or backend_config.get("onnx_dir")
+    if not output_dir:
+        parser.error("--output-dir is required without embedding_backend.onnx_dir in the config")
+    os.makedirs(output_dir, exist_ok=True)
+
+    import torch
+    from sentence_transformers import SentenceTransformer
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model = SentenceTransformer(args.model, local_files_only=True)
+    dimension = model.get_sentence_embedding_dimension()
+
+    if not args.skip_export:
+        names = export(model, output_dir, args.opset)
+        quantize(output_dir, args.per_channel)
+        with open(os.path.join(output_dir, EXPORT_FILE), "w") as f:
+            json.dump({"model_name": args.model, "dimension": dimension,
+                       "max_seq_length": model.get_max_seq_length(), "inputs": names,
+                       "opset": args.opset, "per_channel": args.per_channel}, f, indent=2)
+
+    # Короткие запросы и длинные статьи: у квантованной модели ошибка зависит от длины входа
+    texts = SAMPLE_TEXTS + synthetic_texts(args.texts // 2, 5, seed=1) + synthetic_texts(args.texts // 2, args.words)
+    models = {"torch": model}
+    for backend in MODEL_FILES:
+        models[backend] = load_model(args.model, {"type": backend, "onnx_dir": output_dir},
+                                     threads=args.threads)
+
+    reference = model.encode(texts, batch_size=32, convert_to_numpy=True)
+    thresholds = {"onnx": args.min_cosine, "onnx_int8": args.min_cosine_int8}
+    parity = {}
+    failed = False
+    print(f"{'backend':<10} {'mean cos':>9} {'min cos':>9} {'p01 cos':>9} {'threshold':>9}")
+    for backend, threshold in thresholds.items():
+        similarity = cosine_rows(reference, models[backend].encode(texts, batch_size=32))
+        parity[backend] = {"mean": float(similarity.mean()), "min": float(similarity.min()),
+                           "p01": float(np.percentile(similarity, 1)), "threshold": threshold,
+                           "passed": bool(similarity.min() >= threshold)}
+        failed |= not parity[backend]["passed"]
+        print(f"{backend:<10} {similarity.mean():>9.5f} {similarity.min():>9.5f} "
+              f"{parity[backend]['p01']:>9.5f} {threshold:>9.3f}{'' if parity[backend]['passed'] else '  FAILED'}")
+
+    rows = []
+    if not args.skip_benchmark:
+        bench_texts = synthetic_texts(args.texts, args.words, seed=2)
+        print(f"\n{'batch':>5} {'backend':<10} {'texts/s':>9} {'speedup':>8}")
+        for batch_size in args.batch_sizes:
+            base = None
+            for backend, encoder in models.items():
+                texts_per_s = throughput(encoder, bench_texts, batch_size)
+                base = base or texts_per_s
+                rows.append({"batch_size": batch_size, "backend": backend,
+                             "texts_per_s": texts_per_s, "speedup": texts_per_s / base})
+                print(f"{batch_size:>5} {backend:<10} {texts_per_s:>9.1f} {texts_per_s / base:>7.2f}x")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"model": args.model, "output_dir": output_dir, "threads": args.threads,
+                       "cpu_count": os.cpu_count(), "texts": len(texts), "words": args.words,
+                       "parity": parity, "throughput": rows}, f, indent=2)
+        print(f"Report saved to {args.output}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
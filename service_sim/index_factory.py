@@ -0,0 +1,395 @@
+import faiss
+import os
+import logging
+import numpy as np
+from typing import Optional, Tuple
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# Хранение векторов в индексе: без сжатия, float16, int8 (скалярное
+# квантование) или PQ; auto выбирает наименее сжатый кодек в рамках бюджета памяти
+CODECS = ("none", "fp16", "sq8", "pq")
+
+# Кодеки, допустимые для каждого типа индекса (ivf_pq всегда хранит коды PQ)
+TYPE_CODECS = {
+    "flat": CODECS,
+    "hnsw": CODECS,
+    "ivf_flat": ("none", "fp16", "sq8"),
+    "ivf_pq": ("pq",),
+}
+
+_SQ_TYPES = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "sq8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+# Оценка накладных расходов на вектор в байтах: ID и хеш-таблица ID -> позиция
+ID_OVERHEAD_BYTES = 40
+
+# Минимальное количество обучающих векторов на один кластер IVF
+MIN_POINTS_PER_CENTROID = 39
+
+# Метка удалённого вектора в HNSW: граф не поддерживает удаление,
+# поэтому запись в id_map помечается и исключается из поиска до перестройки
+TOMBSTONE_ID = -1
+
+
+def index_type(index: faiss.Index) -> str:
+    """Определение типа индекса FAISS (с учётом обёрток)."""
+    base = _base_index(index)
+    if isinstance(base, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(base, (faiss.IndexIVFFlat, faiss.IndexIVFScalarQuantizer)):
+        return "ivf_flat"
+    if isinstance(base, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def index_codec(index: faiss.Index) -> str:
+    """Кодек, которым индекс хранит векторы (none — исходные float32)."""
+    base = _base_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        base = faiss.downcast_index(base.storage)
+    if isinstance(base, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return "pq"
+    if isinstance(base, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return "fp16" if base.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return "none"
+
+
+def config_codec(index_config: dict) -> str:
+    """Кодек из конфигурации (для ivf_pq — всегда pq)."""
+    if index_config.get("type", "flat") == "ivf_pq":
+        return "pq"
+    return index_config.get("codec", "none")
+
+
+def estimate_index_bytes(index_config: dict, dimension: int, ntotal: int) -> int:
+    """
+    Оценка объёма памяти индекса: коды векторов, ID, граф HNSW,
+    центроиды IVF и кодовые книги PQ.
+    """
+    kind = index_config.get("type", "flat")
+    codec = config_codec(index_config)
+    pq_m = index_config.get("pq_m", 64)
+    pq_nbits = index_config.get("pq_nbits", 8)
+    per_vector = {"none": dimension * 4, "fp16": dimension * 2,
+                  "sq8": dimension, "pq": pq_m * pq_nbits / 8}[codec] + ID_OVERHEAD_BYTES
+    fixed = 0
+    if kind == "hnsw":
+        # Соседи нулевого уровня (2 * M) и в среднем небольшая доля верхних уровней
+        per_vector += index_config.get("hnsw_m", 32) * 2 * 4 * 1.1
+    if kind in ("ivf_flat", "ivf_pq"):
+        nlist = index_config.get("nlist", 1024)
+        if ntotal:
+            nlist = max(1, min(nlist, ntotal // MIN_POINTS_PER_CENTROID))
+        fixed += nlist * dimension * 4
+    if codec == "pq":
+        fixed += (1 << pq_nbits) * dimension * 4
+    return int(per_vector * ntotal + fixed)
+
+
+def effective_config(index_config: dict, dimension: int, ntotal: int) -> dict:
+    """
+    Конфигурация индекса с конкретным кодеком для ntotal векторов.
+
+    Для codec: auto выбирается наименее сжатый допустимый кодек, при котором
+    оценка памяти индекса укладывается в memory_budget_mb (0 — без ограничения).
+    """
+    if index_config.get("codec", "none") != "auto":
+        return index_config
+    kind = index_config.get("type", "flat")
+    budget = index_config.get("memory_budget_mb", 0) * 1024 * 1024
+    codecs = TYPE_CODECS.get(kind, CODECS)
+    codec = codecs[0]
+    if budget:
+        fitting = [candidate for candidate in codecs
+                   if estimate_index_bytes(dict(index_config, codec=candidate), dimension, ntotal) <= budget]
+        codec = fitting[0] if fitting else codecs[-1]
+    return dict(index_config, codec=codec)
+
+
+def requires_training(index_config: dict) -> bool:
+    """Нужно ли обучение для индекса заданного типа (IVF, а также кодеков sq8 и pq)."""
+    return index_config.get("type", "flat") in ("ivf_flat", "ivf_pq") or \
+        config_codec(index_config) in ("sq8", "pq")
+
+
+def build_index(index_config: dict, dimension: int, ntotal: int = 0) -> faiss.Index:
+    """
+    Создание пустого индекса FAISS по секции vector_store.index конфигурации.
+
+    Индекс адресуется ID статей: flat и HNSW оборачиваются в IndexIDMap2,
+    IVF хранит ID в инвертированных списках и использует хеш-таблицу
+    прямого отображения для reconstruct и remove_ids. Параметр codec задаёт
+    сжатие векторов (fp16/sq8 — скалярное квантование, pq — коды PQ);
+    codec: auto нужно предварительно разрешить через effective_config.
+
+    Args:
+        index_config (dict): Параметры индекса (type, codec, nlist, pq_m, hnsw_m, ...).
+        dimension (int): Размерность векторов.
+        ntotal (int): Ожидаемое количество векторов; ограничивает nlist,
+            чтобы на каждый кластер приходилось достаточно обучающих точек.
+
+    Returns:
+        faiss.Index: Необученный (для IVF) индекс, принимающий add_with_ids.
+    """
+    kind = index_config.get("type", "flat")
+    if kind not in INDEX_TYPES:
+        raise ValueError(
+            f"Unknown index type '{kind}', expected one of {INDEX_TYPES}")
+    codec = config_codec(index_config)
+    if codec not in TYPE_CODECS[kind]:
+        raise ValueError(
+            f"Codec '{codec}' is not supported by index type '{kind}', expected one of {TYPE_CODECS[kind]}")
+    pq_m = index_config.get("pq_m", 64)
+    pq_nbits = index_config.get("pq_nbits", 8)
+
+    if kind == "flat":
+        if codec in _SQ_TYPES:
+            return faiss.IndexIDMap2(faiss.IndexScalarQuantizer(dimension, _SQ_TYPES[codec]))
+        if codec == "pq":
+            return faiss.IndexIDMap2(faiss.IndexPQ(dimension, pq_m, pq_nbits))
+        return faiss.IndexIDMap2(faiss.IndexFlatL2(dimension))
+
+    if kind == "hnsw":
+        hnsw_m = index_config.get("hnsw_m", 32)
+        if codec in _SQ_TYPES:
+            index = faiss.IndexHNSWSQ(dimension, _SQ_TYPES[codec], hnsw_m)
+        elif codec == "pq":
+            index = faiss.IndexHNSWPQ(dimension, pq_m, hnsw_m, pq_nbits)
+        else:
+            index = faiss.IndexHNSWFlat(dimension, hnsw_m)
+        index.hnsw.efConstruction = index_config.get("ef_construction", 200)
+        index.hnsw.efSearch = index_config.get("ef_search", 64)
+        return faiss.IndexIDMap2(index)
+
+    nlist = index_config.get("nlist", 1024)
+    if ntotal:
+        nlist = max(1, min(nlist, ntotal // MIN_POINTS_PER_CENTROID))
+    quantizer = faiss.IndexFlatL2(dimension)
+    if kind == "ivf_flat" and codec in _SQ_TYPES:
+        index = faiss.IndexIVFScalarQuantizer(
+            quantizer, dimension, nlist, _SQ_TYPES[codec])
+    elif kind == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+    else:
+        index = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, pq_nbits)
+    index.nprobe = index_config.get("nprobe", 16)
+    # Прямое отображение ID нужно для reconstruct при перестройке и для remove_ids
+    index.set_direct_map_type(faiss.DirectMap.Hashtable)
+    return index
+
+
+def train_index(index: faiss.Index, vectors: np.ndarray, sample_size: int, seed: int = 0):
+    """Обучение индекса на случайной выборке сохранённых векторов."""
+    if index.is_trained:
+        return
+    if len(vectors) > sample_size:
+        rng = np.random.default_rng(seed)
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    logger.info(
+        f"Training {index_type(index)} index on {len(vectors)} sampled vectors")
+    index.train(np.ascontiguousarray(vectors, dtype=np.float32))
+
+
+def _base_index(index: faiss.Index) -> faiss.Index:
+    """
+    Индекс под обёрткой IDMap. Результат не владеет объектом FAISS: вызывающий
+    должен держать ссылку на index, пока пользуется им (параллельная замена
+    self.index иначе освободит память под ним).
+    """
+    wrapper = faiss.downcast_index(index)
+    if isinstance(wrapper, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(wrapper.index)
+    return wrapper
+
+
+def search_params(index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                  sel: Optional[faiss.IDSelector] = None) -> Optional[faiss.SearchParameters]:
+    """
+    Параметры поиска для конкретного запроса.
+
+    Args:
+        index (faiss.Index): Индекс, по которому выполняется поиск.
+        nprobe (Optional[int]): Количество просматриваемых кластеров IVF.
+        ef_search (Optional[int]): Размер очереди поиска HNSW.
+        sel (Optional[faiss.IDSelector]): Ограничение на ID статей.
+    """
+    kind = index_type(index)
+    base = _base_index(index)
+    if kind in ("ivf_flat", "ivf_pq") and (nprobe or sel is not None):
+        return faiss.SearchParametersIVF(nprobe=nprobe or base.nprobe, sel=sel)
+    if kind == "hnsw" and (ef_search or sel is not None):
+        return faiss.SearchParametersHNSW(efSearch=ef_search or base.hnsw.efSearch, sel=sel)
+    if sel is not None and isinstance(base, faiss.IndexPQ):
+        raise ValueError("Flat PQ index does not support ID selectors, use ivf_pq or hnsw")
+    if sel is not None:
+        return faiss.SearchParameters(sel=sel)
+    return None
+
+
+def live_selector() -> faiss.IDSelector:
+    """Селектор, исключающий помеченные TOMBSTONE_ID записи."""
+    return faiss.IDSelectorRange(0, np.iinfo(np.int64).max)
+
+
+def search_index(index: faiss.Index, queries: np.ndarray, k: int, nprobe: Optional[int] = None,
+                 ef_search: Optional[int] = None, tombstones: bool = False,
+                 allowed_ids: Optional[np.ndarray] = None, sel: Optional[faiss.IDSelector] = None,
+                 exact_max_ids: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Поиск k ближайших с параметрами запроса и необязательным ограничением на ID статей.
+
+    Допустимые ID (отсортированный массив allowed_ids) передаются FAISS как
+    IDSelectorBatch (sel, если уже построен) и проверяются при обходе
+    индекса; записи TOMBSTONE_ID в набор не входят. Если допустимых ID не
+    больше exact_max_ids, их векторы восстанавливаются и перебираются
+    напрямую: обход HNSW и IVF с очень избирательным фильтром отбрасывает
+    почти всех кандидатов и возвращает меньше k результатов. Flat PQ
+    селекторы не поддерживает: кандидатов берётся больше пропорционально
+    доле допустимых ID, лишние отбрасываются.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Расстояния и ID (-1 — пустые позиции).
+    """
+    if allowed_ids is None:
+        params = search_params(index, nprobe, ef_search, live_selector() if tombstones else None)
+        return index.search(queries, k, params=params)
+    if not len(allowed_ids):
+        return (np.full((len(queries), k), np.inf, dtype=np.float32),
+                np.full((len(queries), k), -1, dtype=np.int64))
+    if len(allowed_ids) <= exact_max_ids:
+        try:
+            vectors = index.reconstruct_batch(allowed_ids)
+        except RuntimeError:
+            # ID ещё нет в индексе (атрибуты обновлены раньше векторов): проверка селектором
+            pass
+        else:
+            distances, positions = faiss.knn(queries, vectors, min(k, len(allowed_ids)))
+            ids = np.where(positions >= 0, allowed_ids[np.maximum(positions, 0)], -1)
+            pad = k - ids.shape[1]
+            return (np.pad(distances, ((0, 0), (0, pad)), constant_values=np.inf),
+                    np.pad(ids, ((0, 0), (0, pad)), constant_values=-1))
+    if isinstance(_base_index(index), faiss.IndexPQ):
+        fetch_k = min(index.ntotal, max(k, int(np.ceil(k * index.ntotal / max(1, len(allowed_ids))))))
+        distances, ids = index.search(queries, fetch_k, params=search_params(index, nprobe, ef_search))
+        keep = np.isin(ids, allowed_ids)
+        # Допустимые результаты каждой строки сдвигаются в начало с сохранением порядка
+        order = np.argsort(~keep, axis=1, kind="stable")[:, :k]
+        distances = np.where(keep, distances, np.inf)
+        ids = np.where(keep, ids, -1)
+        distances, ids = np.take_along_axis(distances, order, axis=1), np.take_along_axis(ids, order, axis=1)
+        pad = k - ids.shape[1]
+        return (np.pad(distances, ((0, 0), (0, pad)), constant_values=np.inf),
+                np.pad(ids, ((0, 0), (0, pad)), constant_values=-1))
+    if sel is None:
+        sel = faiss.IDSelectorBatch(allowed_ids)
+    return index.search(queries, k, params=search_params(index, nprobe, ef_search, sel))
+
+
+def supports_remove(index: faiss.Index) -> bool:
+    """Поддерживает ли индекс физическое удаление векторов."""
+    return index_type(index) != "hnsw"
+
+
+def index_ids(index: faiss.Index) -> np.ndarray:
+    """ID статей в индексе (для HNSW включая TOMBSTONE_ID удалённых записей)."""
+    wrapper = faiss.downcast_index(index)
+    if isinstance(wrapper, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.vector_to_array(wrapper.id_map)
+    if isinstance(wrapper, faiss.IndexIVF):
+        invlists = wrapper.invlists
+        ids = [faiss.rev_swig_ptr(invlists.get_ids(list_no), invlists.list_size(list_no)).copy()
+               for list_no in range(wrapper.nlist) if invlists.list_size(list_no)]
+        return np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64)
+    # Позиционный индекс старого формата: ID совпадает с позицией
+    return np.arange(index.ntotal, dtype=np.int64)
+
+
+def reconstruct_all(index: faiss.Index) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Извлечение всех живых векторов индекса вместе с их ID.
+
+    Для сжатых индексов (IVF-PQ, codec fp16/sq8/pq) векторы восстанавливаются
+    из кодов и поэтому приближённые.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: ID (int64) и векторы (float32).
+    """
+    if index.ntotal == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, index.d), dtype=np.float32)
+    wrapper = faiss.downcast_index(index)
+    ids = index_ids(index)
+    if isinstance(wrapper, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        vectors = _base_index(index).reconstruct_n(0, index.ntotal)
+    elif isinstance(wrapper, faiss.IndexIVF):
+        vectors = wrapper.reconstruct_batch(ids)
+    else:
+        vectors = index.reconstruct_n(0, index.ntotal)
+    live = ids != TOMBSTONE_ID
+    return ids[live], vectors[live]
+
+
+def remove_ids(index: faiss.Index, ids: np.ndarray) -> int:
+    """
+    Удаление векторов с заданными ID.
+
+    Для HNSW записи помечаются TOMBSTONE_ID и остаются в графе до перестройки.
+
+    Returns:
+        int: Количество удалённых (помеченных) векторов.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    if len(ids) == 0 or index.ntotal == 0:
+        return 0
+    if index_type(index) in ("ivf_flat", "ivf_pq"):
+        # Хеш-таблица прямого отображения IVF поддерживает только IDSelectorArray
+        return index.remove_ids(faiss.IDSelectorArray(len(ids), faiss.swig_ptr(ids)))
+    if supports_remove(index):
+        return index.remove_ids(faiss.IDSelectorBatch(ids))
+    wrapper = faiss.downcast_index(index)
+    id_map = faiss.rev_swig_ptr(wrapper.id_map.data(), index.ntotal)
+    mask = np.isin(id_map, ids)
+    id_map[mask] = TOMBSTONE_ID
+    return int(mask.sum())
+
+
+def read_index_mmap(path: str) -> faiss.Index:
+    """
+    Открытие индекса с отображением векторов в память вместо чтения файла целиком.
+
+    Такой индекс пригоден только для поиска: добавление и удаление векторов
+    в отображённые массивы FAISS не поддерживает (процесс аварийно завершится),
+    поэтому перед изменениями индекс нужно прочитать обычным faiss.read_index.
+    """
+    with open(path, "rb") as f:
+        fourcc = f.read(4)
+    # Инвертированные списки IVF (fourcc Iw..) отображаются флагом IO_FLAG_MMAP,
+    # коды flat/SQ/PQ и хранилище HNSW — флагом IO_FLAG_MMAP_IFC
+    flags = faiss.IO_FLAG_MMAP if fourcc.startswith(b"Iw") else faiss.IO_FLAG_MMAP_IFC
+    return faiss.read_index(path, flags)
+
+
+def snapshot_vectors(directory: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Все векторы снапшота VectorStore: index.bin либо индексы шардов shard_<i>.bin.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: ID (int64) и векторы (float32).
+    """
+    all_ids, all_vectors = [], []
+    for file_name in sorted(os.listdir(directory)):
+        if file_name == "index.bin" or (file_name.startswith("shard_") and file_name.endswith(".bin")):
+            # Ссылка на прочитанный индекс должна жить, пока используется downcast_index
+            index = faiss.read_index(os.path.join(directory, file_name))
+            ids, vectors = reconstruct_all(index)
+            all_ids.append(ids)
+            all_vectors.append(vectors)
+    if not all_ids:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32)
+    return np.concatenate(all_ids), np.vstack(all_vectors)
@@ -0,0 +1,144 @@
+"""
+Отчёт recall@k / латентность для индексов FAISS относительно точного flat-поиска.
+
+Векторы берутся из снапшота VectorStore (с учётом журнала) либо генерируются
+синтетически. Запросы — случайная выборка сохранённых векторов с шумом.
+
+Пример:
+    python index_report.py --data-dir /app/faiss_data --k 10 --output report.json
+    python index_report.py --synthetic 100000 --dimension 512
+"""
+import argparse
+import json
+import os
+import time
+
+import faiss
+import numpy as np
+import yaml
+
+from exact_vectors import load_exact_vectors
+from index_factory import build_index, search_params, snapshot_vectors, train_index
+from wal import WriteAheadLog, OP_ADD, OP_DELETE
+
+
+def load_vectors(data_dir: str, dimension: int) -> np.ndarray:
+    """Чтение векторов из актуального снапшота (в том числе шардированного) и журнала VectorStore."""
+    with open(os.path.join(data_dir, "CURRENT"), "r") as f:
+        name = f.read().strip()
+    snapshot_dir = os.path.join(data_dir, "snapshots", name)
+    # Для сжатых индексов точные векторы хранятся отдельно (vector_store.rerank)
+    exact = load_exact_vectors(snapshot_dir, os.path.join(data_dir, "exact_vectors"))
+    ids, stored = exact if exact is not None else snapshot_vectors(snapshot_dir)
+    vectors = dict(zip(ids.tolist(), stored))
+    wal = WriteAheadLog(os.path.join(data_dir, "wal.log"),
+                        stored.shape[1] if len(stored) else dimension)
+    for _, op, article_id, _, vector in wal.replay():
+        if op == OP_ADD:
+            vectors[article_id] = vector
+        elif op == OP_DELETE:
+            vectors.pop(article_id, None)
+    wal.close()
+    return np.vstack(list(vectors.values())).astype(np.float32)
+
+
+def measure(index: faiss.Index, queries: np.ndarray, k: int, params) -> tuple:
+    """Поиск по одному запросу (как в /search), возвращает найденные ID и латентности в мс."""
+    found = np.empty((len(queries), k), dtype=np.int64)
+    latencies = np.empty(len(queries))
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, indices = index.search(query.reshape(1, -1), k, params=params)
+        latencies[i] = (time.perf_counter() - start) * 1000
+        found[i] = indices[0]
+    return found, latencies
+
+
+def recall_at_k(found: np.ndarray, exact: np.ndarray) -> float:
+    hits = sum(len(np.intersect1d(f[f >= 0], e)) for f, e in zip(found, exact))
+    return hits / exact.size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default="config/config_sim.yaml",
+                        help="конфигурация с секцией vector_store.index")
+    parser.add_argument("--data-dir", default="/app/faiss_data")
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="сгенерировать N случайных векторов вместо чтения снапшота")
+    parser.add_argument("--dimension", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+",
+                        default=[1, 4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+",
+                        default=[16, 64, 256])
+    parser.add_argument("--output", help="путь для JSON-отчёта")
+    args = parser.parse_args()
+
+    index_config = {}
+    if os.path.exists(args.config):
+        with open(args.config, "r") as f:
+            index_config = (yaml.safe_load(f) or {}).get(
+                "vector_store", {}).get("index", {})
+
+    rng = np.random.default_rng(0)
+    if args.synthetic:
+        vectors = rng.standard_normal(
+            (args.synthetic, args.dimension)).astype(np.float32)
+    else:
+        vectors = load_vectors(args.data_dir, args.dimension)
+    dimension = vectors.shape[1]
+    queries = vectors[rng.choice(len(vectors), min(
+        args.queries, len(vectors)), replace=False)]
+    queries = queries + rng.normal(scale=0.01, size=queries.shape).astype(np.float32)
+    print(f"Vectors: {len(vectors)}, dimension: {dimension}, queries: {len(queries)}, k: {args.k}")
+
+    flat = faiss.IndexFlatL2(dimension)
+    flat.add(vectors)
+    exact, flat_latencies = measure(flat, queries, args.k, None)
+
+    rows = [{"type": "flat", "param": None, "recall": 1.0,
+             "p50_ms": float(np.percentile(flat_latencies, 50)),
+             "p99_ms": float(np.percentile(flat_latencies, 99)),
+             "build_s": 0.0}]
+
+    for kind, param_name, values in (("ivf_flat", "nprobe", args.nprobe),
+                                     ("ivf_pq", "nprobe", args.nprobe),
+                                     ("hnsw", "ef_search", args.ef_search)):
+        config = dict(index_config, type=kind)
+        start = time.perf_counter()
+        try:
+            index = build_index(config, dimension, len(vectors))
+            train_index(index, vectors, config.get(
+                "train_sample_size", 50000))
+            index.add_with_ids(vectors, np.arange(len(vectors), dtype=np.int64))
+        except Exception as e:
+            print(f"Skipping {kind}: {e}")
+            continue
+        build_time = time.perf_counter() - start
+        for value in values:
+            params = search_params(index, **{param_name: value})
+            found, latencies = measure(index, queries, args.k, params)
+            rows.append({"type": kind, "param": f"{param_name}={value}",
+                         "recall": recall_at_k(found, exact),
+                         "p50_ms": float(np.percentile(latencies, 50)),
+                         "p99_ms": float(np.percentile(latencies, 99)),
+                         "build_s": build_time})
+
+    print(f"{'index':<10} {'param':<14} {'recall@' + str(args.k):>10} "
+          f"{'p50, ms':>9} {'p99, ms':>9} {'build, s':>9}")
+    for row in rows:
+        print(f"{row['type']:<10} {row['param'] or '-':<14} {row['recall']:>10.3f} "
+              f"{row['p50_ms']:>9.3f} {row['p99_ms']:>9.3f} {row['build_s']:>9.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"vectors": len(vectors), "dimension": dimension,
+                       "k": args.k, "results": rows}, f, indent=2)
+        print(f"Report saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
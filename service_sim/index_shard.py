@@ -0,0 +1,590 @@
+"""
+Шардирование векторного индекса по хешу ID статьи.
+
+Каждый шард — отдельный локальный процесс с собственным индексом FAISS,
+принимающий команды через multiprocessing.connection (unix-сокет или TCP).
+ShardedIndex в процессе сервиса маршрутизирует записи в шарды, рассылает
+поисковые запросы всем шардам параллельно и объединяет частичные top-k по
+расстоянию. Журнал и снапшоты по-прежнему ведёт VectorStore: шарды передают
+сериализованные индексы координатору частями, а файлы снапшота пишет и читает
+сам координатор, поэтому шардам на других машинах (TCP) общая файловая
+система не нужна.
+
+Соединения аутентифицируются ключом (multiprocessing.connection принимает
+от пира pickle, поэтому без ключа TCP-адрес шарда позволяет выполнить код в
+его процессе). Запускаемым шардам сервис генерирует случайный ключ сам; для
+TCP-адресов ключ обязателен и задаётся в vector_store.shards.authkey или в
+переменной окружения SIM_SHARD_AUTHKEY у сервиса и у шардов.
+
+Запуск шарда вручную:
+    python index_shard.py --shard 0 --address /tmp/sim_shard_0.sock --dimension 512
+    SIM_SHARD_AUTHKEY=... python index_shard.py --shard 0 --address 10.0.0.5:7000 --dimension 512
+"""
+import argparse
+import json
+import logging
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Client, Listener
+from queue import Empty, Queue
+from typing import Dict, List, Optional, Tuple, Union
+
+import faiss
+import numpy as np
+
+from index_factory import (TOMBSTONE_ID, build_index, config_codec, effective_config, index_codec,
+                           index_ids, index_type, reconstruct_all, remove_ids, requires_training,
+                           search_index, train_index)
+from rwlock import ReadWriteLock
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Переменная окружения с ключом аутентификации соединений с шардами
+AUTHKEY_ENV = "SIM_SHARD_AUTHKEY"
+
+# Размер части сериализованного индекса в одном сообщении при сохранении и загрузке
+TRANSFER_CHUNK = 64 * 2**20
+
+
+def shard_of(article_ids: np.ndarray, num_shards: int) -> np.ndarray:
+    """Номер шарда для каждого ID статьи (перемешивание splitmix64, затем остаток)."""
+    x = np.asarray(article_ids, dtype=np.int64).view(np.uint64)
+    with np.errstate(over="ignore"):
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        x = x ^ (x >> np.uint64(31))
+    return (x % np.uint64(num_shards)).astype(np.int64)
+
+
+def parse_address(address: str) -> Union[str, Tuple[str, int]]:
+    """'host:port' -> TCP-адрес, иначе путь к unix-сокету."""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return host, int(port)
+    return address
+
+
+class IndexShard:
+    def __init__(self, index_config: dict, dimension: int):
+        """
+        Индекс одного шарда: добавление, удаление, поиск и перестройка.
+
+        Правила перестройки те же, что у VectorStore: flat до min_train_size,
+        переобучение IVF при росте корпуса, чистка удалённых из HNSW.
+        """
+        self.index_config = index_config
+        self.dimension = dimension
+        self.min_train_size = index_config.get("min_train_size", 10000)
+        self.train_sample_size = index_config.get("train_sample_size", 50000)
+        self.rebuild_growth_factor = index_config.get(
+            "rebuild_growth_factor", 2.0)
+        self.max_tombstone_ratio = index_config.get("max_tombstone_ratio", 0.2)
+        self.index = self._empty_index()
+        self.tombstones = 0
+        self.trained_ntotal = 0
+        # _lock упорядочивает изменения, _index_lock защищает поиск от изменений
+        self._lock = threading.RLock()
+        self._index_lock = ReadWriteLock()
+        self._rebuild_thread = None
+        self._rebuild_log = None
+        # Сериализованный индекс, который координатор забирает частями (dump_read),
+        # и принимаемый от координатора (restore)
+        self._dump: Optional[np.ndarray] = None
+        self._restore: Optional[np.ndarray] = None
+
+    def _apply(self, index: faiss.Index, removed_ids: np.ndarray, added_ids: np.ndarray,
+               embeddings: Optional[np.ndarray]) -> int:
+        removed = remove_ids(index, removed_ids)
+        if len(added_ids):
+            index.add_with_ids(embeddings, added_ids)
+        return removed
+
+    def _change(self, removed_ids: np.ndarray, added_ids: np.ndarray, embeddings: Optional[np.ndarray]) -> int:
+        with self._lock:
+            with self._index_lock.write():
+                removed = self._apply(
+                    self.index, removed_ids, added_ids, embeddings)
+            if self._rebuild_log is not None:
+                self._rebuild_log.append((removed_ids, added_ids, embeddings))
+            if index_type(self.index) == "hnsw":
+                self.tombstones += removed
+        self.maybe_rebuild()
+        return removed
+
+    def upsert(self, article_ids: np.ndarray, embeddings: np.ndarray) -> int:
+        """Замена векторов существующих статей и добавление новых."""
+        article_ids = np.asarray(article_ids, dtype=np.int64)
+        return self._change(article_ids, article_ids, np.ascontiguousarray(embeddings, dtype=np.float32))
+
+    def delete(self, article_ids: np.ndarray) -> int:
+        """Удаление векторов статей."""
+        return self._change(np.asarray(article_ids, dtype=np.int64), np.zeros(0, dtype=np.int64), None)
+
+    def search(self, queries: np.ndarray, k: int, nprobe: Optional[int], ef_search: Optional[int],
+               allowed_ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Поиск k ближайших векторов шарда (среди allowed_ids, если заданы): матрицы расстояний и ID."""
+        with self._index_lock.read():
+            return search_index(self.index, queries, k,
+                                nprobe or self.index_config.get("nprobe"),
+                                ef_search or self.index_config.get("ef_search"),
+                                self.tombstones > 0, allowed_ids,
+                                exact_max_ids=self.index_config.get("filter_exact_max_ids", 0))
+
+    def dump(self) -> int:
+        """Сериализация индекса для передачи координатору. Возвращает размер в байтах."""
+        with self._index_lock.read():
+            self._dump = faiss.serialize_index(self.index)
+        return len(self._dump)
+
+    def dump_read(self, offset: int, size: int) -> bytes:
+        """Часть сериализованного индекса; после последней части буфер освобождается."""
+        if self._dump is None:
+            raise RuntimeError("No serialized index, call dump first")
+        data = self._dump[offset:offset + size].tobytes()
+        if offset + size >= len(self._dump):
+            self._dump = None
+        return data
+
+    def restore(self, data: bytes, offset: int, total: int) -> Optional[int]:
+        """
+        Приём части сериализованного индекса от координатора; по последней
+        части индекс заменяется.
+
+        Returns:
+            Optional[int]: Количество векторов загруженного индекса после последней части.
+        """
+        if offset == 0:
+            self._restore = np.empty(total, dtype=np.uint8)
+        if self._restore is None or len(self._restore) != total:
+            raise RuntimeError("Index restore must start from offset 0")
+        self._restore[offset:offset + len(data)] = np.frombuffer(data, dtype=np.uint8)
+        if offset + len(data) < total:
+            return None
+        index = faiss.deserialize_index(self._restore)
+        self._restore = None
+        with self._lock:
+            with self._index_lock.write():
+                self.index = index
+            self.tombstones = int(np.count_nonzero(
+                index_ids(index) == TOMBSTONE_ID))
+            self.trained_ntotal = index.ntotal
+        logger.info(f"Restored shard index with {index.ntotal} vectors")
+        return index.ntotal
+
+    def _empty_index(self) -> faiss.Index:
+        config = effective_config(self.index_config, self.dimension, 0)
+        return build_index({"type": "flat"} if requires_training(config) else config, self.dimension)
+
+    def clear(self):
+        """Сброс к пустому индексу (перед загрузкой состояния координатора)."""
+        with self._lock:
+            with self._index_lock.write():
+                self.index = self._empty_index()
+            self.tombstones = 0
+            self.trained_ntotal = 0
+
+    def stats(self) -> dict:
+        return {"ntotal": int(self.index.ntotal), "type": index_type(self.index),
+                "codec": index_codec(self.index), "tombstones": self.tombstones,
+                "rebuilding": self._rebuild_log is not None}
+
+    def maybe_rebuild(self):
+        ntotal = self.index.ntotal
+        if ntotal == 0:
+            return
+        grown = False
+        config = effective_config(self.index_config, self.dimension, ntotal)
+        if requires_training(config):
+            if ntotal < self.min_train_size:
+                return
+            grown = ntotal >= self.trained_ntotal * self.rebuild_growth_factor
+        compact = self.tombstones > ntotal * self.max_tombstone_ratio
+        changed = index_type(self.index) != config.get("type", "flat") or \
+            index_codec(self.index) != config_codec(config)
+        if changed or grown or compact:
+            self.rebuild()
+
+    def rebuild(self) -> bool:
+        """Запуск фоновой перестройки индекса шарда (False, если уже выполняется)."""
+        with self._lock:
+            if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+                return False
+            self._rebuild_thread = threading.Thread(
+                target=self._rebuild, name="shard-rebuild", daemon=True)
+            self._rebuild_thread.start()
+            return True
+
+    def _rebuild(self):
+        try:
+            started = time.perf_counter()
+            with self._lock:
+                article_ids, vectors = reconstruct_all(self.index)
+                self._rebuild_log = []
+            # Векторы сжатого индекса восстановлены из кодов: точные хранит координатор
+            config = effective_config(self.index_config, self.dimension, len(vectors))
+            if requires_training(config) and len(vectors) < self.min_train_size:
+                config = {"type": "flat"}
+            new_index = build_index(config, self.dimension, len(vectors))
+            train_index(new_index, vectors, self.train_sample_size)
+            new_index.add_with_ids(vectors, article_ids)
+            with self._lock:
+                for removed_ids, added_ids, embeddings in self._rebuild_log:
+                    self._apply(new_index, removed_ids, added_ids, embeddings)
+                with self._index_lock.write():
+                    self.index = new_index
+                self.tombstones = int(np.count_nonzero(
+                    index_ids(new_index) == TOMBSTONE_ID))
+                self.trained_ntotal = new_index.ntotal
+                self._rebuild_log = None
+            logger.info(
+                f"Rebuilt shard {index_type(new_index)} index with {new_index.ntotal} vectors "
+                f"in {time.perf_counter() - started:.1f}s")
+        except Exception as e:
+            self._rebuild_log = None
+            logger.error(f"Error rebuilding shard index: {e}")
+
+
+# Методы IndexShard, доступные координатору
+SHARD_METHODS = ("upsert", "delete", "search", "dump", "dump_read", "restore", "clear", "stats", "rebuild")
+
+
+def _handle(shard: IndexShard, conn):
+    try:
+        while True:
+            method, args = conn.recv()
+            if method not in SHARD_METHODS:
+                conn.send(("error", f"Unknown method {method}"))
+                continue
+            try:
+                conn.send(("ok", getattr(shard, method)(*args)))
+            except Exception as e:
+                logger.error(f"Shard {method} failed: {e}")
+                conn.send(("error", str(e)))
+    except (EOFError, OSError):
+        pass
+    finally:
+        conn.close()
+
+
+def serve(shard: IndexShard, address: str, authkey: Optional[bytes], parent_pid: Optional[int] = None):
+    """Приём соединений координатора; каждое соединение обслуживается своим потоком."""
+    address = parse_address(address)
+    if not isinstance(address, str) and not authkey:
+        raise ValueError(f"Shard TCP address {address} requires {AUTHKEY_ENV}")
+    if isinstance(address, str) and os.path.exists(address):
+        os.unlink(address)
+    listener = Listener(address, authkey=authkey)
+    if parent_pid:
+        # Шард, запущенный сервисом, завершается вместе с ним
+        def watch_parent():
+            while os.getppid() == parent_pid:
+                time.sleep(1)
+            logger.info("Parent process exited, stopping shard")
+            os._exit(0)
+        threading.Thread(target=watch_parent, daemon=True).start()
+    logger.info(f"Shard listening on {address}")
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception as e:
+            logger.warning(f"Rejected shard connection: {e}")
+            continue
+        threading.Thread(target=_handle, args=(shard, conn), daemon=True).start()
+
+
+class ShardClient:
+    def __init__(self, address: str, authkey: Optional[bytes], pool_size: int = 4):
+        """Клиент шарда с небольшим пулом соединений (создаются по требованию)."""
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self._idle: "Queue" = Queue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def call(self, method: str, *args, timeout: Optional[float] = None):
+        """
+        Вызов метода шарда.
+
+        Соединение, не ответившее за timeout, закрывается, чтобы поздний ответ
+        не достался следующему запросу. Ожидание свободного соединения тоже
+        ограничено timeout: занятые долгими записями соединения не задерживают
+        поиск дольше search_timeout_ms.
+        """
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError(f"No free connection to shard {self.address} for {method} in {timeout}s")
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except Empty:
+                conn = Client(self.address, authkey=self.authkey)
+            try:
+                conn.send((method, args))
+                if not conn.poll(timeout):
+                    raise TimeoutError(
+                        f"Shard {self.address} did not answer {method} in {timeout}s")
+                status, result = conn.recv()
+            except BaseException:
+                conn.close()
+                raise
+            self._idle.put(conn)
+        finally:
+            self._slots.release()
+        if status != "ok":
+            raise RuntimeError(f"Shard {self.address} {method} failed: {result}")
+        return result
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                return
+
+
+class ShardedIndex:
+    def __init__(self, shards_config: dict, index_config: dict, dimension: int, data_dir: str):
+        """
+        Координатор шардов: маршрутизация записей и scatter-gather поиск.
+
+        Args:
+            shards_config (dict): Секция vector_store.shards (count, addresses,
+                spawn, search_timeout_ms, write_timeout_s, ...).
+            index_config (dict): Секция vector_store.index, общая для всех шардов.
+            dimension (int): Размерность векторов.
+            data_dir (str): Директория данных (для сокетов запускаемых шардов).
+        """
+        self.count = shards_config.get("count", 1)
+        self.search_timeout = shards_config.get("search_timeout_ms", 200) / 1000
+        self.write_timeout = shards_config.get("write_timeout_s", 60)
+        self.processes: List[subprocess.Popen] = []
+
+        addresses = shards_config.get("addresses") or [
+            os.path.join(data_dir, "shards", f"shard_{i}.sock") for i in range(self.count)]
+        if len(addresses) != self.count:
+            raise ValueError(
+                f"Expected {self.count} shard addresses, got {len(addresses)}")
+        authkey = shards_config.get("authkey") or os.environ.get(AUTHKEY_ENV)
+        if not authkey and shards_config.get("spawn", True):
+            # Ключ знают только сервис и запущенные им шарды
+            authkey = secrets.token_hex(32)
+        if not authkey and any(not isinstance(parse_address(address), str) for address in addresses):
+            raise ValueError(
+                f"Shard TCP addresses require vector_store.shards.authkey or {AUTHKEY_ENV}")
+        self.authkey = authkey.encode("utf-8") if authkey else None
+        if shards_config.get("spawn", True):
+            os.makedirs(os.path.join(data_dir, "shards"), exist_ok=True)
+            for i, address in enumerate(addresses):
+                self.processes.append(self._spawn(
+                    i, address, index_config, dimension))
+        self.clients = [ShardClient(address, self.authkey, shards_config.get("connections_per_shard", 4))
+                        for address in addresses]
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.count * 4, thread_name_prefix="shard-scatter")
+        self._wait_ready(shards_config.get("startup_timeout_s", 30))
+        logger.info(f"Connected to {self.count} index shards")
+
+    def _spawn(self, shard: int, address: str, index_config: dict, dimension: int) -> subprocess.Popen:
+        """Запуск шарда локальным подпроцессом."""
+        env = dict(os.environ)
+        if self.authkey:
+            env[AUTHKEY_ENV] = self.authkey.decode("utf-8")
+        return subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--shard", str(shard), "--address", address,
+             "--dimension", str(dimension), "--index-config", json.dumps(index_config),
+             "--parent-pid", str(os.getpid())],
+            env=env)
+
+    def _wait_ready(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        for i, client in enumerate(self.clients):
+            while True:
+                try:
+                    client.call("stats", timeout=timeout)
+                    break
+                except (ConnectionError, FileNotFoundError, OSError):
+                    if time.monotonic() > deadline:
+                        raise RuntimeError(f"Shard {i} did not start in {timeout}s")
+                    time.sleep(0.1)
+
+    def _scatter(self, calls: Dict[int, tuple], timeout: float) -> Dict[int, object]:
+        """Параллельный вызов шардов; для упавших или не ответивших — исключение вместо результата."""
+        futures = {shard: self.executor.submit(self.clients[shard].call, method, *args, timeout=timeout)
+                   for shard, (method, args) in calls.items()}
+        results = {}
+        for shard, future in futures.items():
+            try:
+                results[shard] = future.result()
+            except Exception as e:
+                results[shard] = e
+        return results
+
+    def _scatter_all(self, method: str, *args, timeout: Optional[float] = None) -> list:
+        """Вызов метода на всех шардах; ошибка любого шарда пробрасывается."""
+        results = self._scatter({shard: (method, args) for shard in range(self.count)},
+                                timeout or self.write_timeout)
+        for shard, result in results.items():
+            if isinstance(result, Exception):
+                raise RuntimeError(f"Shard {shard} {method} failed: {result}")
+        return [results[shard] for shard in range(self.count)]
+
+    def _route(self, method: str, article_ids: np.ndarray, embeddings: Optional[np.ndarray] = None) -> int:
+        article_ids = np.asarray(article_ids, dtype=np.int64)
+        if not len(article_ids):
+            return 0
+        owners = shard_of(article_ids, self.count)
+        calls = {}
+        for shard in np.unique(owners).tolist():
+            mask = owners == shard
+            args = (article_ids[mask],) if embeddings is None else (
+                article_ids[mask], embeddings[mask])
+            calls[shard] = (method, args)
+        results = self._scatter(calls, self.write_timeout)
+        failed = {shard: result for shard, result in results.items()
+                  if isinstance(result, Exception)}
+        if failed:
+            # Запись уже в журнале VectorStore и будет повторена
+            raise RuntimeError(f"Shard {method} failed: {failed}")
+        return sum(results.values())
+
+    def upsert(self, article_ids: np.ndarray, embeddings: np.ndarray) -> int:
+        """Замена/добавление векторов в шардах-владельцах. Возвращает количество заменённых."""
+        return self._route("upsert", article_ids, np.ascontiguousarray(embeddings, dtype=np.float32))
+
+    def delete(self, article_ids: np.ndarray) -> int:
+        return self._route("delete", article_ids)
+
+    def search(self, queries: np.ndarray, k: int, nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None,
+               allowed_ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, bool]:
+        """
+        Поиск во всех шардах с объединением частичных top-k по расстоянию.
+
+        Шарды, не ответившие за search_timeout_ms или недоступные, пропускаются.
+        Допустимые ID фильтра (allowed_ids) делятся по шардам-владельцам:
+        каждый шард получает только свои, шарды без них не опрашиваются.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, bool]: Расстояния, ID и признак неполного ответа.
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        if allowed_ids is None:
+            calls = {shard: ("search", (queries, k, nprobe, ef_search)) for shard in range(self.count)}
+        else:
+            owners = shard_of(allowed_ids, self.count)
+            calls = {shard: ("search", (queries, k, nprobe, ef_search, allowed_ids[owners == shard]))
+                     for shard in np.unique(owners).tolist()}
+        results = self._scatter(calls, self.search_timeout)
+        parts = []
+        for shard, result in results.items():
+            if isinstance(result, Exception):
+                logger.warning(f"Shard {shard} missing from search: {result}")
+            else:
+                parts.append(result)
+        partial = len(parts) < len(calls)
+        if not parts:
+            return (np.full((len(queries), k), np.inf, dtype=np.float32),
+                    np.full((len(queries), k), -1, dtype=np.int64), partial)
+        distances = np.hstack([d for d, _ in parts])
+        ids = np.hstack([i for _, i in parts])
+        # Пустые позиции FAISS (ID -1) уходят в конец
+        distances = np.where(ids < 0, np.inf, distances)
+        order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        return (np.take_along_axis(distances, order, axis=1),
+                np.take_along_axis(ids, order, axis=1), partial)
+
+    def ntotal(self) -> int:
+        return sum(stats["ntotal"] for stats in self.stats() if "ntotal" in stats)
+
+    def stats(self) -> List[dict]:
+        results = self._scatter({shard: ("stats", ()) for shard in range(self.count)},
+                                self.search_timeout)
+        return [{"shard": shard, "error": str(results[shard])} if isinstance(results[shard], Exception)
+                else {"shard": shard, **results[shard]} for shard in range(self.count)]
+
+    def save(self, directory: str):
+        """
+        Сохранение индексов всех шардов в directory/shard_<i>.bin: шард
+        передаёт сериализованный индекс частями, файл пишет координатор.
+        """
+        self._for_each_shard(self._save_shard, directory)
+
+    def load(self, directory: str):
+        """Загрузка индексов шардов из directory/shard_<i>.bin (файл передаётся шарду частями)."""
+        self._for_each_shard(self._load_shard, directory)
+
+    def _for_each_shard(self, func, directory: str):
+        futures = {shard: self.executor.submit(func, shard, os.path.join(directory, f"shard_{shard}.bin"))
+                   for shard in range(self.count)}
+        for shard, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                raise RuntimeError(f"Shard {shard} {func.__name__.strip('_')} failed: {e}")
+
+    def _save_shard(self, shard: int, path: str):
+        client = self.clients[shard]
+        size = client.call("dump", timeout=self.write_timeout)
+        with open(path, "wb") as f:
+            for offset in range(0, size, TRANSFER_CHUNK):
+                f.write(client.call("dump_read", offset, TRANSFER_CHUNK, timeout=self.write_timeout))
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.getsize(path) != size:
+            raise RuntimeError(f"Shard {shard} index file {path} has {os.path.getsize(path)} of {size} bytes")
+
+    def _load_shard(self, shard: int, path: str):
+        client = self.clients[shard]
+        total = os.path.getsize(path)
+        with open(path, "rb") as f:
+            offset = 0
+            while offset < total:
+                data = f.read(TRANSFER_CHUNK)
+                client.call("restore", data, offset, total, timeout=self.write_timeout)
+                offset += len(data)
+
+    def clear(self):
+        self._scatter_all("clear")
+
+    def rebuild(self) -> bool:
+        return any(self._scatter_all("rebuild"))
+
+    def close(self):
+        for client in self.clients:
+            client.close()
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.executor.shutdown(wait=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shard", type=int, required=True)
+    parser.add_argument("--address", required=True,
+                        help="путь к unix-сокету или host:port")
+    parser.add_argument("--dimension", type=int, required=True)
+    parser.add_argument("--index-config", default='{"type": "flat"}',
+                        help="секция vector_store.index в JSON")
+    parser.add_argument("--parent-pid", type=int,
+                        help="завершиться вместе с процессом сервиса")
+    args = parser.parse_args()
+
+    authkey = os.environ.get(AUTHKEY_ENV)
+    shard = IndexShard(json.loads(args.index_config), args.dimension)
+    logger.info(f"Starting index shard {args.shard}")
+    serve(shard, args.address, authkey.encode("utf-8") if authkey else None, args.parent_pid)
+
+
+if __name__ == "__main__":
+    main()
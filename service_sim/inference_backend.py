@@ -0,0 +1,120 @@
+"""
+Бэкенды инференса модели эмбеддингов.
+
+torch — SentenceTransformer как есть. onnx и onnx_int8 — граф ONNX Runtime,
+экспортированный командой export_onnx.py из локально закэшированной модели
+(трансформер, mean pooling и Dense-слой в одном графе); во втором случае веса
+динамически квантованы в int8. Все бэкенды предоставляют ту часть интерфейса
+SentenceTransformer, которую использует сервис: encode и
+get_sentence_embedding_dimension.
+"""
+import json
+import logging
+import os
+from typing import List, Optional, Union
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "onnx", "onnx_int8")
+
+# Файлы директории экспорта (рядом с ними сохраняется токенизатор)
+MODEL_FILES = {"onnx": "model.onnx", "onnx_int8": "model_int8.onnx"}
+EXPORT_FILE = "export.json"
+OUTPUT_NAME = "sentence_embedding"
+
+
+def backend_type(backend_config: Optional[dict]) -> str:
+    backend = (backend_config or {}).get("type", "torch")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {BACKENDS}")
+    return backend
+
+
+def model_id(model_name: str, backend_config: Optional[dict]) -> str:
+    """
+    Имя модели для ключей кэша эмбеддингов.
+
+    Векторы ONNX-графов немного отличаются от torch (int8 — заметно), поэтому
+    кэшируются отдельно от них.
+    """
+    backend = backend_type(backend_config)
+    return model_name if backend == "torch" else f"{model_name}@{backend}"
+
+
+class OnnxSentenceEncoder:
+    def __init__(self, onnx_dir: str, backend: str = "onnx", threads: int = 0):
+        """
+        Кодирование текстов графом ONNX Runtime на CPU.
+
+        Args:
+            onnx_dir (str): Директория, подготовленная export_onnx.py.
+            backend (str): onnx или onnx_int8.
+            threads (int): Потоки intra-op ONNX Runtime (0 — по числу ядер).
+        """
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(onnx_dir, EXPORT_FILE), "r") as f:
+            self.export = json.load(f)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.path = os.path.join(onnx_dir, MODEL_FILES[backend])
+        self.session = ort.InferenceSession(self.path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [node.name for node in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(onnx_dir)
+        self.max_seq_length = self.export["max_seq_length"]
+        self.dimension = self.export["dimension"]
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32,
+               convert_to_numpy: bool = True, **kwargs) -> np.ndarray:
+        """Эмбеддинги текстов (одномерный массив для одной строки, как в SentenceTransformer)."""
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        embeddings = np.zeros((len(sentences), self.dimension), dtype=np.float32)
+        # Как в SentenceTransformer: тексты близкой длины в одном батче — меньше паддинга
+        order = np.argsort([-len(text) for text in sentences], kind="stable")
+        for start in range(0, len(sentences), batch_size):
+            rows = order[start:start + batch_size]
+            tokens = self.tokenizer([sentences[i] for i in rows], padding=True, truncation=True,
+                                    max_length=self.max_seq_length, return_tensors="np")
+            feeds = {name: tokens[name].astype(np.int64) for name in self.input_names}
+            embeddings[rows] = self.session.run([OUTPUT_NAME], feeds)[0]
+        return embeddings[0] if single else embeddings
+
+
+def load_model(model_name: str, backend_config: Optional[dict] = None, threads: Optional[int] = None):
+    """
+    Загрузка модели эмбеддингов выбранным бэкендом (секция embedding_backend конфигурации).
+
+    Args:
+        model_name (str): Название модели SentenceTransformer.
+        backend_config (Optional[dict]): type (torch, onnx, onnx_int8), onnx_dir и threads.
+        threads (Optional[int]): Потоки ONNX Runtime вместо backend_config.threads
+            (воркеры пула индексации получают torch_threads_per_worker).
+    """
+    backend_config = backend_config or {}
+    backend = backend_type(backend_config)
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name)
+
+    onnx_dir = backend_config.get("onnx_dir")
+    path = os.path.join(onnx_dir or "", MODEL_FILES[backend])
+    if not onnx_dir or not os.path.exists(path):
+        raise RuntimeError(f"ONNX model {path} not found, run export_onnx.py --output-dir {onnx_dir}")
+    encoder = OnnxSentenceEncoder(onnx_dir, backend,
+                                  backend_config.get("threads", 0) if threads is None else threads)
+    if encoder.export.get("model_name") != model_name:
+        raise RuntimeError(f"ONNX model in {onnx_dir} was exported from {encoder.export.get('model_name')}, "
+                           f"not {model_name}")
+    logger.info(f"Loaded {backend} model {path} (dimension {encoder.dimension})")
+    return encoder
@@ -1,8 +1,12 @@
-from confluent_kafka import Consumer, KafkaError
+from confluent_kafka import Consumer, KafkaError, KafkaException, TopicPartition
 import logging
+import queue
+import threading
 import yaml
 import asyncio
 import json
+import time
+from typing import Dict, List, Optional, Tuple
 from db_operator import PostgresOperator
 from models.article import Article
 from vector_store import VectorStore
@@ -12,7 +16,7 @@ logger = logging.getLogger(__name__)
 
 
 class KafkaConsumer:
-    def __init__(self, config_path: str, vector_store: VectorStore):
+    def __init__(self, config_path: str, vector_store: VectorStore, db: Optional[PostgresOperator] = None):
         # Загрузка конфигурации
         with open(config_path, "r") as f:
             config = yaml.safe_load(f)
@@ -21,61 +25,271 @@ class KafkaConsumer:
         self.brokers = config["kafka"]["brokers"]
         self.group_id = config["kafka"]["group_id"]
 
-        # Настройки Kafka Consumer
+        # Настройки пакетной обработки
+        ingest_config = config.get("ingest", {})
+        self.batch_size = ingest_config.get("batch_size", 256)
+        self.batch_timeout = ingest_config.get("batch_timeout_ms", 500) / 1000
+        self.encode_batch_size = ingest_config.get("encode_batch_size", 32)
+        self.retry_backoff = ingest_config.get("retry_backoff_s", 1.0)
+        self.retry_backoff_max = ingest_config.get("retry_backoff_max_s", 30.0)
+        self.lag_report_interval = ingest_config.get("lag_report_interval_s", 10)
+
+        # Настройки Kafka Consumer: смещения фиксируются вручную,
+        # только после того как батч записан в журнал VectorStore
         self.consumer_config = {
             "bootstrap.servers": self.brokers,
             "group.id": self.group_id,
             "auto.offset.reset": "earliest",
-            "enable.auto.commit": True,
+            "enable.auto.commit": False,
         }
         self.consumer = Consumer(self.consumer_config)
-        self.consumer.subscribe([self.topic])
+        self.consumer.subscribe([self.topic], on_revoke=self._on_revoke)
+
+        # Поток опроса Kafka передаёт батчи сообщений на обработку через
+        # ограниченную очередь; при её заполнении партиции ставятся на паузу
+        self.queue: "queue.Queue[list]" = queue.Queue(
+            maxsize=ingest_config.get("queue_max_batches", 4))
+        # Смещения обработанных батчей, которые поток опроса должен зафиксировать
+        self._commits: "queue.SimpleQueue[Dict[Tuple[str, int], int]]" = queue.SimpleQueue()
+        self._committed: Dict[Tuple[str, int], int] = {}
+        self._stop = threading.Event()
+        self._poll_thread: Optional[threading.Thread] = None
+        self.paused = False
+        self.partition_lag: Dict[str, dict] = {}
+        self._last_lag_report = 0.0
 
-        # Инициализация оператора PostgreSQL
-        self.db = PostgresOperator(config_path)
+        # Оператор PostgreSQL: общий пул сервиса либо собственный
+        self.owns_db = db is None
+        self.db = db if db is not None else PostgresOperator(config_path)
 
         # Инициализация VectorStore
         self.vector_store = vector_store
         logger.info("Initialized KafkaConsumer with VectorStore")
 
     async def consume(self):
+        """Запуск потока опроса и стадии обработки батчей (в event loop, работа — вне его)."""
+        self._poll_thread = threading.Thread(
+            target=self._poll_loop, name="kafka-poll", daemon=True)
+        self._poll_thread.start()
         try:
-            while True:
-                msg = self.consumer.poll(timeout=1.0)
-                if msg is None:
-                    await asyncio.sleep(0.1)
-                    continue
-                if msg.error():
-                    if msg.error().code() == KafkaError._PARTITION_EOF:
-                        logger.info(
-                            f"Reached end of partition: {msg.partition()}")
-                    else:
-                        logger.error(f"Kafka error: {msg.error()}")
-                    continue
-
-                value = msg.value().decode("utf-8") if msg.value() else None
-                logger.info(f"Received message: value={value}")
-
-                try:
-                    data = json.loads(value)  # {"id": 123}
-                    article_id = data["id"]
-                    # Получаем статью из PostgreSQL
-                    article = self.db.get_article_by_id(article_id)
-                    if article:
-                        logger.info(
-                            f"Processing article: id={article_id}, title={article.name}")
-                        self.process_article(article)
-                    else:
-                        logger.warning(
-                            f"Article {article_id} not found in database")
-                except Exception as e:
-                    logger.error(f"Error processing message {value}: {e}")
-
+            while not self._stop.is_set():
+                messages = await asyncio.to_thread(self._next_batch)
+                if messages is not None:
+                    await asyncio.to_thread(self.process_messages, messages)
         except Exception as e:
             logger.error(f"Error in consumer: {e}")
         finally:
-            self.db.close()
+            self._stop.set()
+            await asyncio.to_thread(self._poll_thread.join)
+            if self.owns_db:
+                self.db.close()
+
+    def stop(self):
+        """Остановка: текущий батч дообрабатывается, поток опроса фиксирует смещения и закрывает consumer."""
+        self._stop.set()
+
+    def _next_batch(self) -> Optional[list]:
+        try:
+            return self.queue.get(timeout=self.batch_timeout)
+        except queue.Empty:
+            return None
+
+    def _poll_loop(self):
+        """Поток опроса: единственный поток, обращающийся к confluent_kafka.Consumer."""
+        try:
+            while not self._stop.is_set():
+                self._commit_pending()
+                self._maybe_report_lag()
+                # Забираем до batch_size сообщений или ждём не дольше batch_timeout
+                messages = self.consumer.consume(
+                    num_messages=self.batch_size, timeout=self.batch_timeout)
+                if messages:
+                    self._enqueue(messages)
+        except Exception as e:
+            logger.error(f"Error in Kafka polling thread: {e}")
+            self._stop.set()
+        finally:
+            self._commit_pending()
             self.consumer.close()
+            logger.info("Kafka polling thread stopped")
+
+    def _enqueue(self, messages: list):
+        """Передача батча на обработку; пока очередь полна, партиции стоят на паузе."""
+        while not self._stop.is_set():
+            try:
+                self.queue.put(messages, timeout=self.batch_timeout)
+                break
+            except queue.Full:
+                if not self.paused:
+                    self.consumer.pause(self.consumer.assignment())
+                    self.paused = True
+                    logger.info("Processing queue is full, pausing Kafka partitions")
+                # Опрос на паузе поддерживает членство в группе; сообщения могут прийти
+                # только из партиций, назначенных после паузы, — добавляем их к батчу
+                messages.extend(self.consumer.consume(
+                    num_messages=self.batch_size, timeout=0))
+                self._commit_pending()
+                self._maybe_report_lag()
+        if self.paused:
+            self.consumer.resume(self.consumer.assignment())
+            self.paused = False
+            logger.info("Resumed Kafka partitions")
+
+    def _commit_pending(self):
+        """Синхронная фиксация смещений батчей, уже сохранённых в VectorStore."""
+        offsets = {}
+        while True:
+            try:
+                batch_offsets = self._commits.get_nowait()
+            except queue.Empty:
+                break
+            for key, offset in batch_offsets.items():
+                offsets[key] = max(offset, offsets.get(key, -1))
+        if not offsets:
+            return
+        try:
+            self.consumer.commit(offsets=[TopicPartition(topic, partition, offset)
+                                          for (topic, partition), offset in offsets.items()],
+                                 asynchronous=False)
+            self._committed.update(offsets)
+        except KafkaException as e:
+            # Незафиксированные сообщения будут прочитаны повторно; индексация идемпотентна
+            logger.error(f"Failed to commit offsets {offsets}: {e}")
+
+    def _on_revoke(self, consumer, partitions):
+        """Перед передачей партиций другому участнику группы фиксируем обработанное."""
+        self._commit_pending()
+        for partition in partitions:
+            self._committed.pop((partition.topic, partition.partition), None)
+
+    def _maybe_report_lag(self):
+        if time.monotonic() - self._last_lag_report < self.lag_report_interval:
+            return
+        self._last_lag_report = time.monotonic()
+        try:
+            assignment = self.consumer.assignment()
+            if not assignment:
+                return
+            unknown = [tp for tp in assignment
+                       if (tp.topic, tp.partition) not in self._committed]
+            if unknown:
+                for tp in self.consumer.committed(unknown, timeout=1.0):
+                    if tp.offset >= 0:
+                        self._committed[(tp.topic, tp.partition)] = tp.offset
+            positions = {(tp.topic, tp.partition): tp.offset
+                         for tp in self.consumer.position(assignment)}
+            lag = {}
+            for tp in assignment:
+                key = (tp.topic, tp.partition)
+                low, high = self.consumer.get_watermark_offsets(tp, timeout=1.0)
+                committed = self._committed.get(key, low)
+                lag[f"{tp.topic}[{tp.partition}]"] = {
+                    "high_watermark": high,
+                    "position": positions.get(key),
+                    "committed": committed,
+                    # Сообщения, ещё не сохранённые в VectorStore
+                    "lag": max(0, high - committed),
+                }
+            self.partition_lag = lag
+            logger.info("Kafka consumer lag: " + ", ".join(
+                f"{name}={info['lag']}" for name, info in lag.items()))
+        except KafkaException as e:
+            logger.warning(f"Failed to compute consumer lag: {e}")
+
+    def stats(self) -> dict:
+        """Состояние потребителя: очередь обработки и отставание по партициям."""
+        partitions = self.partition_lag
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_max_batches": self.queue.maxsize,
+            "paused": self.paused,
+            "total_lag": sum(info["lag"] for info in partitions.values()),
+            "partitions": partitions,
+        }
+
+    def process_messages(self, messages: list):
+        """
+        Обработка батча сообщений Kafka и фиксация их смещений.
+
+        Смещения передаются на фиксацию только после того, как удаления и
+        векторы батча записаны в журнал VectorStore; при ошибке батч
+        повторяется с экспоненциальной задержкой. Для каждой статьи
+        применяется только последняя по смещению операция батча, поэтому
+        удаления и обновления независимо от порядка применения дают тот же
+        результат, что и последовательная обработка.
+        """
+        # ID статьи -> последняя операция (delete или upsert) в порядке смещений
+        operations: Dict[int, str] = {}
+        offsets: Dict[Tuple[str, int], int] = {}
+        for msg in messages:
+            if msg.error():
+                if msg.error().code() == KafkaError._PARTITION_EOF:
+                    logger.info(
+                        f"Reached end of partition: {msg.partition()}")
+                else:
+                    logger.error(f"Kafka error: {msg.error()}")
+                continue
+
+            key = (msg.topic(), msg.partition())
+            offsets[key] = max(msg.offset() + 1, offsets.get(key, 0))
+            value = msg.value().decode("utf-8") if msg.value() else None
+            logger.info(f"Received message: value={value}")
+            try:
+                data = json.loads(value)  # {"id": 123} или {"id": 123, "op": "delete"}
+                operations.pop(data["id"], None)
+                operations[data["id"]] = "delete" if data.get("op") == "delete" else "upsert"
+            except Exception as e:
+                logger.error(f"Error processing message {value}: {e}")
+        deleted_ids = [article_id for article_id, op in operations.items() if op == "delete"]
+        article_ids = [article_id for article_id, op in operations.items() if op == "upsert"]
+
+        backoff = self.retry_backoff
+        while True:
+            try:
+                if deleted_ids:
+                    self.vector_store.delete_articles(
+                        deleted_ids, raise_on_error=True)
+                self.process_batch(article_ids)
+                break
+            except Exception as e:
+                if self._stop.is_set():
+                    logger.warning(
+                        f"Stopping with unprocessed batch, offsets {offsets} are not committed")
+                    return
+                logger.error(
+                    f"Batch failed ({e}), retrying in {backoff:.1f}s")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, self.retry_backoff_max)
+
+        if offsets:
+            self._commits.put(offsets)
+
+    def process_batch(self, article_ids: List[int]):
+        """Обработка батча: одна выборка из PostgreSQL, один encode и одно добавление в VectorStore."""
+        # Убираем повторы, сохраняя порядок поступления
+        article_ids = list(dict.fromkeys(article_ids))
+        if not article_ids:
+            return
+        start = time.perf_counter()
+        try:
+            articles = self.db.get_articles_by_ids(
+                article_ids, raise_on_error=True)
+            found = {article.id for article in articles}
+            for article_id in article_ids:
+                if article_id not in found:
+                    logger.warning(
+                        f"Article {article_id} not found in database")
+
+            added = self.vector_store.add_articles(
+                articles, batch_size=self.encode_batch_size, raise_on_error=True)
+            elapsed = time.perf_counter() - start
+            throughput = added / elapsed if elapsed > 0 else 0.0
+            logger.info(
+                f"Ingested batch: {len(article_ids)} messages, {added} articles "
+                f"in {elapsed:.3f}s ({throughput:.1f} articles/s)")
+        except Exception as e:
+            logger.error(f"Error processing batch {article_ids}: {e}")
+            raise
 
     def process_article(self, article: Article):
         """Обработка статьи: генерация эмбеддинга и добавление в VectorStore."""
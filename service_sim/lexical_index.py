@@ -0,0 +1,310 @@
+"""
+Лексический индекс BM25 по предобработанным текстам статей.
+
+Постинги хранятся в компактных массивах: основной сегмент в формате CSR
+(смещения по ID термина, строки документов int32 и частоты uint16) и
+небольшой дописываемый сегмент array.array для статей, проиндексированных
+после последнего слияния. Когда дописываемый сегмент вырастает до доли
+основного, сегменты сливаются, а постинги удалённых и заменённых статей
+отбрасываются; суммарная стоимость слияний линейна по количеству постингов.
+Документ — строка во внутренних массивах (ID статьи, длина, признак живой),
+новая версия статьи занимает новую строку.
+"""
+import logging
+import math
+import os
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from rwlock import ReadWriteLock
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Файлы снапшота: массивы постингов и документов, словарь терминов по строке на термин
+ARRAYS_FILE = "lexical.npz"
+TERMS_FILE = "lexical_terms.txt"
+
+MAX_TF = np.iinfo(np.uint16).max
+
+
+def tokenize(processed_text: str) -> List[str]:
+    """Термины текста после preprocess_markdown (markdown_preprocessor.py): слова в нижнем регистре."""
+    return processed_text.lower().split()
+
+
+class LexicalIndex:
+    def __init__(self, k1: float = 1.2, b: float = 0.75, merge_ratio: float = 0.1,
+                 min_merge_postings: int = 200000):
+        """
+        Инвертированный индекс BM25 с инкрементальным обновлением.
+
+        Args:
+            k1 (float): Насыщение частоты термина BM25.
+            b (float): Нормализация по длине документа BM25.
+            merge_ratio (float): Слияние, когда дописываемый сегмент больше
+                этой доли основного.
+            min_merge_postings (int): Минимальный размер дописываемого сегмента для слияния.
+        """
+        self.k1 = k1
+        self.b = b
+        self.merge_ratio = merge_ratio
+        self.min_merge_postings = min_merge_postings
+
+        self.terms: Dict[str, int] = {}
+        # Основной сегмент: постинги термина t — rows[offsets[t]:offsets[t + 1]]
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.rows = np.zeros(0, dtype=np.int32)
+        self.tfs = np.zeros(0, dtype=np.uint16)
+        # Дописываемый сегмент: ID термина -> (строки, частоты)
+        self.delta: Dict[int, Tuple[array, array]] = {}
+        self.delta_postings = 0
+
+        # Документы по строкам; строки удалённых и заменённых статей помечаются неживыми
+        self.doc_ids = np.zeros(1024, dtype=np.int64)
+        self.doc_lens = np.zeros(1024, dtype=np.int32)
+        self.live = np.zeros(1024, dtype=bool)
+        self.row_count = 0
+        self.article_rows: Dict[int, int] = {}
+        self.total_len = 0
+        self._lock = ReadWriteLock()
+
+    def __len__(self) -> int:
+        return len(self.article_rows)
+
+    def _append_doc(self, article_id: int, length: int) -> int:
+        if self.row_count == len(self.doc_ids):
+            capacity = 2 * len(self.doc_ids)
+            self.doc_ids = np.resize(self.doc_ids, capacity)
+            self.doc_lens = np.resize(self.doc_lens, capacity)
+            live = np.zeros(capacity, dtype=bool)
+            live[:self.row_count] = self.live[:self.row_count]
+            self.live = live
+        row = self.row_count
+        self.doc_ids[row] = article_id
+        self.doc_lens[row] = length
+        self.live[row] = True
+        self.row_count += 1
+        self.article_rows[article_id] = row
+        self.total_len += length
+        return row
+
+    def _remove(self, article_id: int):
+        row = self.article_rows.pop(article_id, None)
+        if row is not None:
+            self.live[row] = False
+            self.total_len -= int(self.doc_lens[row])
+
+    def update(self, documents: Iterable[Tuple[int, str]]):
+        """
+        Индексация статей: пары (ID статьи, текст после preprocess_markdown).
+
+        Прежняя версия статьи с тем же ID заменяется.
+        """
+        documents = [(article_id, Counter(tokenize(text))) for article_id, text in documents]
+        if not documents:
+            return
+        with self._lock.write():
+            for article_id, counts in documents:
+                self._remove(article_id)
+                row = self._append_doc(article_id, sum(counts.values()))
+                for term, tf in counts.items():
+                    term_id = self.terms.setdefault(term, len(self.terms))
+                    postings = self.delta.get(term_id)
+                    if postings is None:
+                        postings = self.delta[term_id] = (array("i"), array("H"))
+                    postings[0].append(row)
+                    postings[1].append(min(tf, MAX_TF))
+                self.delta_postings += len(counts)
+            if self.delta_postings > max(self.min_merge_postings, self.merge_ratio * len(self.rows)):
+                self._merge()
+
+    def delete(self, article_ids: Iterable[int]):
+        """Удаление статей (постинги отбрасываются при следующем слиянии)."""
+        with self._lock.write():
+            for article_id in article_ids:
+                self._remove(int(article_id))
+
+    def missing(self, article_ids: Iterable[int]) -> List[int]:
+        """ID статей, которых нет в лексическом индексе."""
+        return [article_id for article_id in article_ids if article_id not in self.article_rows]
+
+    def article_ids(self) -> List[int]:
+        with self._lock.read():
+            return list(self.article_rows)
+
+    def _merge(self):
+        """Слияние сегментов с удалением постингов неживых строк и перенумерацией строк."""
+        term_count = len(self.terms)
+        sealed_terms = np.repeat(np.arange(len(self.offsets) - 1, dtype=np.int64), np.diff(self.offsets))
+        delta_terms = np.repeat(np.fromiter(self.delta, dtype=np.int64, count=len(self.delta)),
+                                [len(rows) for rows, _ in self.delta.values()])
+        delta_rows = np.frombuffer(b"".join(rows.tobytes() for rows, _ in self.delta.values()), dtype=np.int32)
+        delta_tfs = np.frombuffer(b"".join(tfs.tobytes() for _, tfs in self.delta.values()), dtype=np.uint16)
+        terms = np.concatenate([sealed_terms, delta_terms])
+        rows = np.concatenate([self.rows, delta_rows])
+        tfs = np.concatenate([self.tfs, delta_tfs])
+
+        live = self.live[:self.row_count]
+        keep = live[rows]
+        new_rows = (np.cumsum(live) - 1).astype(np.int32)
+        terms, rows, tfs = terms[keep], new_rows[rows[keep]], tfs[keep]
+        order = np.argsort(terms, kind="stable")
+        self.rows = rows[order]
+        self.tfs = tfs[order]
+        self.offsets = np.zeros(term_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=term_count), out=self.offsets[1:])
+        self.delta = {}
+        self.delta_postings = 0
+
+        live_rows = np.flatnonzero(live)
+        self.row_count = len(live_rows)
+        capacity = max(1024, 2 * self.row_count)
+        doc_ids = np.zeros(capacity, dtype=np.int64)
+        doc_lens = np.zeros(capacity, dtype=np.int32)
+        doc_ids[:self.row_count] = self.doc_ids[live_rows]
+        doc_lens[:self.row_count] = self.doc_lens[live_rows]
+        self.doc_ids, self.doc_lens = doc_ids, doc_lens
+        self.live = np.zeros(capacity, dtype=bool)
+        self.live[:self.row_count] = True
+        self.article_rows = dict(zip(doc_ids[:self.row_count].tolist(), range(self.row_count)))
+        logger.info(f"Merged lexical index: {len(self.rows)} postings, {self.row_count} documents")
+
+    def _postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = self.offsets[term_id:term_id + 2] if term_id + 1 < len(self.offsets) else (0, 0)
+        rows, tfs = self.rows[start:end], self.tfs[start:end]
+        delta = self.delta.get(term_id)
+        if delta is not None:
+            rows = np.concatenate([rows, np.frombuffer(delta[0], dtype=np.int32)])
+            tfs = np.concatenate([tfs, np.frombuffer(delta[1], dtype=np.uint16)])
+        return rows, tfs
+
+    def search(self, processed_query: str, k: int,
+               allowed_ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k статей по BM25 для текста запроса после preprocess_markdown.
+
+        Args:
+            processed_query (str): Запрос после preprocess_markdown.
+            k (int): Количество статей.
+            allowed_ids (Optional[np.ndarray]): Отсортированные ID статей, среди
+                которых выполняется поиск (фильтр по атрибутам).
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: ID статей и оценки BM25 по убыванию
+                (только статьи, содержащие хотя бы один термин запроса).
+        """
+        with self._lock.read():
+            term_ids = {self.terms[term] for term in tokenize(processed_query) if term in self.terms}
+            documents = len(self.article_rows)
+            if not term_ids or not documents:
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+            avg_len = max(self.total_len / documents, 1.0)
+            live = self.live[:self.row_count]
+            # Оценки копятся только по строкам из постингов терминов запроса,
+            # а не по массиву размером с корпус
+            term_rows, term_scores = [], []
+            for term_id in term_ids:
+                rows, tfs = self._postings(term_id)
+                mask = live[rows]
+                rows, tfs = rows[mask], tfs[mask].astype(np.float32)
+                if not len(rows):
+                    continue
+                idf = math.log(1 + (documents - len(rows) + 0.5) / (len(rows) + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lens[rows] / avg_len)
+                term_rows.append(rows)
+                term_scores.append(idf * tfs * (self.k1 + 1) / (tfs + norm))
+            if not term_rows:
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+            candidates, positions = np.unique(np.concatenate(term_rows), return_inverse=True)
+            scores = np.zeros(len(candidates), dtype=np.float32)
+            np.add.at(scores, positions, np.concatenate(term_scores).astype(np.float32))
+            article_ids = self.doc_ids[candidates]
+        if allowed_ids is not None:
+            if not len(allowed_ids):
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+            positions = np.minimum(np.searchsorted(allowed_ids, article_ids), len(allowed_ids) - 1)
+            mask = allowed_ids[positions] == article_ids
+            scores, article_ids = scores[mask], article_ids[mask]
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            scores, article_ids = scores[top], article_ids[top]
+        order = np.argsort(-scores, kind="stable")
+        return article_ids[order], scores[order]
+
+    def save(self, directory: str):
+        """Сохранение в директорию снапшота (после слияния — только живые статьи)."""
+        with self._lock.write():
+            if self.delta_postings or self.row_count != len(self.article_rows):
+                self._merge()
+        with self._lock.read():
+            np.savez(os.path.join(directory, ARRAYS_FILE), offsets=self.offsets, rows=self.rows, tfs=self.tfs,
+                     doc_ids=self.doc_ids[:self.row_count], doc_lens=self.doc_lens[:self.row_count])
+            terms = sorted(self.terms, key=self.terms.get)
+        with open(os.path.join(directory, TERMS_FILE), "w", encoding="utf-8") as f:
+            f.write("\n".join(terms))
+
+    def load(self, directory: str) -> bool:
+        """
+        Загрузка из снапшота.
+
+        Returns:
+            bool: False, если снапшот записан без лексического индекса.
+        """
+        arrays_path = os.path.join(directory, ARRAYS_FILE)
+        if not os.path.exists(arrays_path):
+            return False
+        with open(os.path.join(directory, TERMS_FILE), "r", encoding="utf-8") as f:
+            content = f.read()
+        terms = content.split("\n") if content else []
+        with np.load(arrays_path) as data:
+            offsets, rows, tfs = data["offsets"], data["rows"], data["tfs"]
+            doc_ids, doc_lens = data["doc_ids"], data["doc_lens"]
+        with self._lock.write():
+            self.terms = {term: term_id for term_id, term in enumerate(terms)}
+            self.offsets, self.rows, self.tfs = offsets, rows, tfs
+            self.delta = {}
+            self.delta_postings = 0
+            self.row_count = len(doc_ids)
+            capacity = max(1024, 2 * self.row_count)
+            self.doc_ids = np.zeros(capacity, dtype=np.int64)
+            self.doc_lens = np.zeros(capacity, dtype=np.int32)
+            self.live = np.zeros(capacity, dtype=bool)
+            self.doc_ids[:self.row_count] = doc_ids
+            self.doc_lens[:self.row_count] = doc_lens
+            self.live[:self.row_count] = True
+            self.article_rows = dict(zip(doc_ids.tolist(), range(self.row_count)))
+            self.total_len = int(doc_lens.sum())
+        logger.info(f"Loaded lexical index: {len(self.terms)} terms, {len(rows)} postings, {self.row_count} documents")
+        return True
+
+    def stats(self) -> dict:
+        with self._lock.read():
+            return {
+                "documents": len(self.article_rows),
+                "terms": len(self.terms),
+                "postings": int(len(self.rows) + self.delta_postings),
+                "delta_postings": self.delta_postings,
+                "postings_bytes": int(self.rows.nbytes + self.tfs.nbytes + self.offsets.nbytes
+                                      + 6 * self.delta_postings),
+            }
+
+
+def fuse_rankings(rankings: List[List[int]], k: int, rrf_k: int = 60) -> List[Tuple[int, float]]:
+    """
+    Объединение ранжирований методом Reciprocal Rank Fusion.
+
+    Оценка статьи — сумма 1 / (rrf_k + позиция) по спискам, в которых она есть;
+    шкалы расстояний и BM25 несопоставимы, поэтому используются только позиции.
+
+    Returns:
+        List[Tuple[int, float]]: Top-k пар (ID статьи, оценка RRF) по убыванию оценки.
+    """
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, article_id in enumerate(ranking, start=1):
+            scores[article_id] = scores.get(article_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
@@ -1,53 +1,177 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 
 from contextlib import asynccontextmanager
 import yaml
 import asyncio
+import os
 from kafka_consumer import KafkaConsumer
 from db_operator import PostgresOperator
-from vector_store import VectorStore
-from models.article import Article
+from vector_store import REINDEX_DIR, VectorStore
+from models.article import Article, ArticleSummary
+from executors import BoundedExecutor, QueueFullError
+from query_batcher import QueryBatcher
+from startup import StartupPhases
+from metrics import ServiceCollector
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
 import logging
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Literal, Optional, Tuple, Union
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+SearchMode = Literal["vector", "lexical", "hybrid", "prefilter"]
+
+
+class SearchFilters(BaseModel):
+    """Фильтр по атрибутам статей: любой из тегов, любой из уровней сложности, время чтения не больше."""
+    tags: Optional[List[str]] = None
+    complexity: Optional[List[str]] = None
+    max_reading_time: Optional[int] = None  # В минутах
+
+
 class SearchRequest(BaseModel):
     query: str
     k: Optional[int] = 5  # Количество возвращаемых статей
+    nprobe: Optional[int] = None  # Количество просматриваемых кластеров IVF
+    ef_search: Optional[int] = None  # Размер очереди поиска HNSW
+    # summary — статьи без текста (заголовок, теги, сложность, время чтения)
+    fields: Literal["full", "summary"] = "full"
+    filters: Optional[SearchFilters] = None
+    # vector — ближайшие векторы; lexical — BM25; hybrid — объединение обоих (RRF);
+    # prefilter — векторный поиск среди лучших по BM25 статей
+    mode: SearchMode = "vector"
 
 
 class SearchResponse(BaseModel):
-    article: Article
-    distance: float
+    article: Union[Article, ArticleSummary]
+    distance: Optional[float] = None  # Режимы vector и prefilter: меньше — ближе
+    score: Optional[float] = None  # Режимы lexical (BM25) и hybrid (RRF): больше — лучше
+
+
+class BatchSearchQuery(BaseModel):
+    query: str
+    k: Optional[int] = 5
+
+
+class BatchSearchRequest(BaseModel):
+    queries: List[BatchSearchQuery]
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    fields: Literal["full", "summary"] = "full"
+    filters: Optional[SearchFilters] = None  # Общий для всех запросов
+    mode: SearchMode = "vector"
+
+
+class BatchSearchResponse(BaseModel):
+    query: str
+    results: List[SearchResponse]
 
 
 with open("config/config_sim.yaml", "r") as f:
     config = yaml.safe_load(f)
 
+# Один пул соединений PostgreSQL на сервис: его используют поиск и Kafka Consumer
 postgres_operator = PostgresOperator(config_path="config/config_sim.yaml")
-vector_store = VectorStore(model_name="distiluse-base-multilingual-cased-v1")
+# Модель и индекс загружаются в фоне после старта uvicorn (см. start_service)
+vector_store = VectorStore(
+    model_name="distiluse-base-multilingual-cased-v1", config_path="config/config_sim.yaml",
+    db=postgres_operator, lazy=True)
 kafka_consumer = KafkaConsumer(
-    config_path="config/config_sim.yaml", vector_store=vector_store)
+    config_path="config/config_sim.yaml", vector_store=vector_store, db=postgres_operator)
+
+# Кодирование и FAISS выполняются в пуле инференса, запросы к PostgreSQL — в пуле БД,
+# чтобы не блокировать event loop
+executors_config = config.get("executors", {})
+inference_executor = BoundedExecutor(
+    "inference",
+    executors_config.get("inference", {}).get("workers", 2),
+    executors_config.get("inference", {}).get("max_queue", 64))
+db_executor = BoundedExecutor(
+    "db",
+    executors_config.get("db", {}).get("workers", 8),
+    executors_config.get("db", {}).get("max_queue", 128))
+
+# Одновременные запросы поиска кодируются и ищутся в FAISS одним батчем
+batching_config = config.get("search_batching", {})
+query_batcher = QueryBatcher(
+    vector_store.find_neighbors, inference_executor,
+    batching_config.get("max_wait_ms", 2) if batching_config.get("enabled", True) else 0,
+    batching_config.get("max_batch_size", 64))
+
+
+# Этапы запуска: индекс отображается в память и доступен для поиска, затем
+# читается в память с воспроизведением журнала; модель параллельно
+# загружается и прогревается. Поиск обслуживается после index и model,
+# изменения и Kafka Consumer — после wal; атрибуты и BM25 статей из журнала
+# дозаполняются последним этапом, когда сервис уже работает
+startup_phases = StartupPhases(("index", "wal", "model", "consumer", "reconcile"),
+                               ready_phases=("index", "model"))
+consumer_task = None
+
+# Состояние индекса, кэшей, Kafka и этапов запуска собирается при опросе /metrics
+REGISTRY.register(ServiceCollector(
+    vector_store, kafka_consumer, startup_phases,
+    {"inference": inference_executor, "db": db_executor}))
+
+
+async def start_service():
+    global consumer_task
+    model_loaded = asyncio.create_task(
+        startup_phases.run("model", vector_store.load_model))
+    # Поиск доступен сразу после открытия индекса и загрузки модели,
+    # восстановление из журнала идёт параллельно и открывает изменения
+    if await startup_phases.run("index", vector_store.open_index):
+        await startup_phases.run("wal", vector_store.recover, False)
+    await model_loaded
+    if not startup_phases.ready() or not vector_store.writable.is_set():
+        logger.error("Index is not recovered, Kafka Consumer is not started")
+        return
+    logger.info("Starting Kafka Consumer...")
+    consumer_task = asyncio.create_task(kafka_consumer.consume())
+    startup_phases.finish("consumer")
+    await startup_phases.run("reconcile", vector_store.reconcile)
+
+
+def require_ready():
+    """Отказ с 503, пока не открыт индекс и не загружена модель (нужны для поиска)."""
+    if not startup_phases.ready():
+        raise HTTPException(status_code=503, detail="Service is starting",
+                            headers={"Retry-After": "5"})
+
+
+def require_writable():
+    """Отказ с 503, пока журнал не воспроизведён (изменения индекса ещё запрещены)."""
+    require_ready()
+    if not vector_store.writable.is_set():
+        raise HTTPException(status_code=503, detail="Index is recovering",
+                            headers={"Retry-After": "5"})
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    logger.info("Starting Kafka Consumer...")
-    task = asyncio.create_task(kafka_consumer.consume())
+    startup_task = asyncio.create_task(start_service())
     yield
-    logger.info("Stopping Kafka Consumer...")
-    kafka_consumer.consumer.close()
-    postgres_operator.close()
-    task.cancel()
     try:
-        await task
-    except asyncio.CancelledError:
-        logger.info("Kafka consumer task cancelled")
+        # Этапы запуска выполняются в потоках и не прерываются: дожидаемся их
+        await asyncio.wait_for(asyncio.shield(startup_task), timeout=60)
+    except asyncio.TimeoutError:
+        logger.warning("Startup did not finish before shutdown")
+    if consumer_task is not None:
+        logger.info("Stopping Kafka Consumer...")
+        kafka_consumer.stop()
+        try:
+            # Даём дообработать текущий батч и зафиксировать его смещения
+            await asyncio.wait_for(consumer_task, timeout=30)
+        except asyncio.TimeoutError:
+            logger.warning("Kafka consumer did not stop in time, task cancelled")
+    inference_executor.shutdown()
+    db_executor.shutdown()
+    postgres_operator.close()
+    vector_store.close()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -66,28 +190,206 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Partial-Results"],
 )
 
 
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: QueueFullError):
+    """Сброс нагрузки: при переполненной очереди сразу отвечаем 503."""
+    logger.warning(f"Rejected {request.url.path}: {exc}")
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+
+async def run_search(queries: List[Tuple[str, int]], nprobe: Optional[int], ef_search: Optional[int],
+                     fields: str = "full", filters: Optional[SearchFilters] = None, mode: str = "vector"):
+    """
+    Поиск: кэш результатов в event loop, кодирование и FAISS в пуле инференса
+    (микробатчами вместе с одновременными запросами), статьи из кэша
+    метаданных либо в пуле БД.
+
+    Returns:
+        Результаты в порядке запросов и признак неполного ответа (не ответили шарды).
+    """
+    require_ready()
+    if mode != "vector" and vector_store.lexical is None:
+        raise HTTPException(status_code=400, detail=f"Search mode '{mode}' requires the lexical index")
+    filters = filters.model_dump() if filters is not None else None
+    version = vector_store.search_version()
+    results = vector_store.cached_results(
+        queries, nprobe, ef_search, version, fields, filters, mode)
+    pending = [i for i, found in enumerate(results) if found is None]
+    if not pending:
+        return results, False
+    pending_queries = [queries[i] for i in pending]
+    partial = False
+    try:
+        hits, partial = await query_batcher.search(pending_queries, nprobe, ef_search, filters, mode)
+        found = vector_store.cached_articles(hits, fields)
+        if found is None:
+            found = await db_executor.run(vector_store.load_articles, hits, fields)
+    except QueueFullError:
+        raise
+    except Exception as e:
+        logger.error(
+            f"Error searching for queries {[query for query, _ in pending_queries]}: {e}")
+        found = [[] for _ in pending_queries]
+    else:
+        if not partial:
+            vector_store.cache_results(
+                pending_queries, nprobe, ef_search, version, found, fields, filters, mode)
+    for i, articles in zip(pending, found):
+        results[i] = articles
+    return results, partial
+
+
+def search_item(article: Union[Article, ArticleSummary], value: float, mode: str) -> dict:
+    """Элемент выдачи: расстояние для векторных режимов, оценка для lexical и hybrid."""
+    if mode in ("lexical", "hybrid"):
+        return {"article": article, "score": value}
+    return {"article": article, "distance": value}
+
+
 @app.get("/")
 async def root():
     return {"message": "Python service is running", "config": config}
 
 
+@app.get("/live")
+async def live():
+    """Проверка живости: процесс отвечает и ни один этап запуска не завершился ошибкой."""
+    if startup_phases.failed():
+        return JSONResponse(status_code=503, content={"status": "failed", **startup_phases.stats()})
+    return {"status": "alive", **startup_phases.stats()}
+
+
+@app.get("/ready")
+async def ready():
+    """Проверка готовности к поиску: индекс открыт, модель загружена (состояние этапов запуска)."""
+    if not startup_phases.ready():
+        return JSONResponse(status_code=503, content={"status": "starting", **startup_phases.stats()})
+    return {"status": "ready", **startup_phases.stats()}
+
+
+@app.get("/metrics")
+async def metrics():
+    """Метрики Prometheus: гистограммы горячих путей и состояние сервиса."""
+    return Response(await asyncio.to_thread(generate_latest, REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.get("/all")
 async def get_article():
     logger.info("Getting all articles...")
-    logger.info(vector_store.id_to_index)
-    return vector_store.id_to_index
+    return vector_store.article_ids()
+
+
+@app.get("/stats")
+async def get_stats():
+    """Статистика индекса и кэшей сервиса."""
+    return {
+        "startup": startup_phases.stats(),
+        "index_size": vector_store.index_size(),
+        "shards": await asyncio.to_thread(vector_store.shards.stats) if vector_store.shards else None,
+        "memory": await asyncio.to_thread(vector_store.memory_stats),
+        "embedding_cache": vector_store.embedding_generator.cache_stats(),
+        "search_cache": vector_store.cache_stats(),
+        "filters": vector_store.attributes.stats(),
+        "lexical": await asyncio.to_thread(vector_store.lexical.stats) if vector_store.lexical else None,
+        "kafka": kafka_consumer.stats(),
+        "executors": {
+            "inference": inference_executor.stats(),
+            "db": db_executor.stats(),
+        },
+        "query_batching": query_batcher.stats(),
+    }
+
+
+@app.delete("/articles/{article_id}")
+async def delete_article(article_id: int):
+    """Удаление статьи из векторного индекса."""
+    require_writable()
+    deleted = await asyncio.to_thread(vector_store.delete_articles, [article_id])
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Article not indexed")
+    return {"deleted": article_id}
 
 
 @app.post("/search", response_model=List[SearchResponse])
-async def search_articles(request: SearchRequest):
-    """Поиск релевантных статей по текстовому запросу."""
+async def search_articles(request: SearchRequest, response: Response):
+    """
+    Поиск релевантных статей по текстовому запросу.
+
+    Фильтр filters (теги, сложность, максимальное время чтения) проверяется
+    при обходе индекса: возвращаются k ближайших среди подходящих статей.
+    Режим mode=hybrid объединяет векторную и лексическую (BM25) выдачу,
+    что помогает запросам из точных терминов («grep, awk, sed», «gRPC»).
+    Если часть шардов не ответила, выдача неполная: заголовок X-Partial-Results: true.
+    """
     logger.info(
         f"Received search request: query='{request.query}', k={request.k}")
-    results = vector_store.search(request.query, k=request.k)
-    return [{"article": article, "distance": distance} for article, distance in results]
+    results, partial = await run_search([(request.query, request.k)], request.nprobe, request.ef_search,
+                                        request.fields, request.filters, request.mode)
+    results = results[0]
+    response.headers["X-Partial-Results"] = "true" if partial else "false"
+    return [search_item(article, value, request.mode) for article, value in results]
+
+
+@app.post("/search/batch", response_model=List[BatchSearchResponse])
+async def search_articles_batch(request: BatchSearchRequest, response: Response):
+    """Поиск статей сразу по нескольким запросам (например, по всем подшагам roadmap)."""
+    logger.info(f"Received batch search request: {len(request.queries)} queries")
+    results, partial = await run_search(
+        [(item.query, item.k) for item in request.queries], request.nprobe, request.ef_search,
+        request.fields, request.filters, request.mode)
+    response.headers["X-Partial-Results"] = "true" if partial else "false"
+    return [
+        {"query": item.query,
+         "results": [search_item(article, value, request.mode) for article, value in found]}
+        for item, found in zip(request.queries, results)
+    ]
+
+
+@app.post("/admin/rebuild")
+async def rebuild_index():
+    """Запуск фоновой перестройки индекса с параметрами из конфигурации."""
+    require_writable()
+    # rebuild_index ждёт _lock, который держат снапшот и воспроизведение журнала
+    started = await asyncio.to_thread(vector_store.rebuild_index)
+    return {"started": started}
+
+
+@app.post("/admin/reindex")
+async def begin_reindex():
+    """
+    Отметка начала выгрузки reindex.py: журнал хранится с этого места до
+    /admin/reload, чтобы изменения за время выгрузки не потерялись.
+    """
+    require_writable()
+    lsn = await asyncio.to_thread(vector_store.begin_reindex)
+    return {"wal_lsn": lsn}
+
+
+@app.delete("/admin/reindex")
+async def cancel_reindex():
+    """Отмена незавершённой выгрузки: журнал снова очищается снапшотами."""
+    await asyncio.to_thread(vector_store.cancel_reindex)
+    return {"cancelled": True}
+
+
+@app.post("/admin/reload")
+async def reload_index():
+    """
+    Подмена индекса подготовленным командой reindex.py (директория reindex
+    рядом с индексом); журнал сервиса воспроизводится поверх нового индекса.
+    """
+    require_writable()
+    staging_dir = os.path.join(vector_store.data_dir, REINDEX_DIR)
+    if not os.path.isdir(staging_dir):
+        raise HTTPException(status_code=404, detail="No prepared reindex")
+    try:
+        return await asyncio.to_thread(vector_store.adopt_reindex, staging_dir)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
 
 if __name__ == "__main__":
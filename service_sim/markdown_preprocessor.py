@@ -0,0 +1,73 @@
+"""
+Однопроходная предобработка Markdown перед кодированием.
+
+Вместо рендеринга в HTML вся разметка снимается одним проходом заранее
+скомпилированного регулярного выражения: блоки кода (``` и ~~~) и инлайн-код
+выбрасываются целиком, у ссылок остаётся текст, изображения, HTML-теги и
+комментарии удаляются, HTML-сущности декодируются. Затем, как и раньше,
+удаляются все символы кроме букв, цифр и пробелов.
+"""
+import html
+import re
+
+# Опережающая проверка первого символа отсекает позиции, с которых не может
+# начаться разметка, до перебора альтернатив
+_MARKUP_RE = re.compile(r"""
+    (?=[`~<!\[&_]|^[ \t0-9])
+    (?:
+    (?P<fence>^[ \t]{0,3}(?P<fence_mark>`{3,}|~{3,})[^\n]*\n
+        (?s:.*?)
+        (?:^[ \t]{0,3}(?P=fence_mark)[`~]*[ \t]*$|\Z))
+  | (?P<code>(?P<ticks>`+)[^`\n](?:.*?[^`\n])??(?P=ticks)(?!`))
+  | (?P<comment><!--(?s:.*?)-->)
+  | (?P<image>!\[[^\]\n]*\]\([^)\n]*\))
+  | (?P<link>\[(?P<link_text>[^\]\n]*)\](?:\([^)\n]*\)|\[[^\]\n]*\]))
+  | (?P<refdef>^[ \t]{0,3}\[[^\]\n]+\]:[^\n]*$)
+  | (?P<autolink><(?P<url>(?:https?|ftp)://[^>\s]+|[^>\s@]+@[^>\s@]+)>)
+  | (?P<tag></?[A-Za-z][^>\n]*>)
+  | (?P<entity>&(?:[A-Za-z][A-Za-z0-9]*|\#[0-9]+|\#[xX][0-9A-Fa-f]+);)
+  | (?P<olist>^[ \t]*[0-9]+[.)](?=[ \t]))
+  | (?P<emphasis>(?<!\w)_+|_+(?!\w))
+    )
+""", re.MULTILINE | re.VERBOSE)
+
+_NON_WORD_RE = re.compile(r"[^\w\s]+")
+
+# Замены для каждого вида разметки: код заменяется пробелом, чтобы не склеить
+# соседние слова; теги и изображения удаляются, как при рендеринге в HTML
+_REPLACEMENTS = {
+    "fence": " ",
+    "code": " ",
+    "comment": "",
+    "image": "",
+    "refdef": " ",
+    "tag": "",
+    "olist": " ",
+    "emphasis": "",
+}
+
+
+def _replace(match: re.Match) -> str:
+    kind = match.lastgroup
+    if kind == "link":
+        return match.group("link_text")
+    if kind == "autolink":
+        return match.group("url")
+    if kind == "entity":
+        return html.unescape(match.group(0))
+    return _REPLACEMENTS[kind]
+
+
+def preprocess_markdown(text: str) -> str:
+    """
+    Очистка текста Markdown для генерации эмбеддинга.
+
+    Args:
+        text (str): Входной текст в формате Markdown.
+
+    Returns:
+        str: Слова текста через одиночный пробел (пробел, если текст пустой).
+    """
+    clean_text = _MARKUP_RE.sub(_replace, text)
+    clean_text = " ".join(_NON_WORD_RE.sub("", clean_text).split())
+    return clean_text if clean_text else " "
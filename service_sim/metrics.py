@@ -0,0 +1,124 @@
+"""
+Метрики Prometheus сервиса (эндпоинт /metrics).
+
+Длительности горячих путей пишутся в гистограммы прямо в месте вызова:
+замер через time.perf_counter и Histogram.observe стоит порядка
+микросекунды. Состояние, которое уже хранится в статистике компонентов
+(размер индекса, отставание Kafka, попадания в кэши, этапы запуска),
+не обновляется на каждом запросе, а собирается ServiceCollector в момент
+опроса Prometheus.
+"""
+from typing import Optional
+
+from prometheus_client import Histogram
+from prometheus_client.core import GaugeMetricFamily
+
+# Границы корзин в секундах: от десятков микросекунд (предобработка,
+# поиск flat по небольшому индексу) до секунд (кодирование батча, снапшот)
+FAST_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+SLOW_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                2.5, 5.0, 10.0, 30.0, 60.0)
+
+PREPROCESS_SECONDS = Histogram(
+    "sim_preprocess_markdown_seconds", "Предобработка Markdown одного текста",
+    buckets=FAST_BUCKETS)
+ENCODE_SECONDS = Histogram(
+    "sim_encode_seconds", "Кодирование батча текстов моделью",
+    ["batch_size", "target"], buckets=SLOW_BUCKETS)
+INDEX_SEARCH_SECONDS = Histogram(
+    "sim_index_search_seconds", "Поиск FAISS по батчу запросов (включая шарды)",
+    buckets=FAST_BUCKETS)
+INDEX_ADD_SECONDS = Histogram(
+    "sim_index_add_seconds", "Замена и добавление векторов в индексе FAISS",
+    buckets=FAST_BUCKETS)
+LEXICAL_SEARCH_SECONDS = Histogram(
+    "sim_lexical_search_seconds", "Поиск BM25 по лексическому индексу для одного запроса",
+    buckets=FAST_BUCKETS)
+QUERY_BATCH_SIZE = Histogram(
+    "sim_query_batch_size", "Количество запросов в микробатче поиска",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+QUERY_BATCH_WAIT_SECONDS = Histogram(
+    "sim_query_batch_wait_seconds", "Ожидание запроса в микробатче до отправки в пул инференса",
+    buckets=FAST_BUCKETS)
+RERANK_SECONDS = Histogram(
+    "sim_rerank_seconds", "Переранжирование кандидатов по точным векторам",
+    buckets=FAST_BUCKETS)
+PERSISTENCE_SECONDS = Histogram(
+    "sim_persistence_seconds", "Запись журнала и снапшотов индекса",
+    ["operation"], buckets=SLOW_BUCKETS)
+DB_FETCH_SECONDS = Histogram(
+    "sim_db_fetch_seconds", "Запросы к PostgreSQL (с учётом ожидания соединения пула)",
+    ["query"], buckets=SLOW_BUCKETS)
+
+
+def batch_size_label(size: int) -> str:
+    """Метка размера батча: ближайшая сверху степень двойки (ограниченное число серий)."""
+    if size > 256:
+        return "512+"
+    return str(1 << max(0, size - 1).bit_length())
+
+
+class ServiceCollector:
+    def __init__(self, vector_store, kafka_consumer=None, startup_phases=None, executors: Optional[dict] = None):
+        """
+        Сборщик метрик состояния сервиса, вычисляемых при опросе /metrics.
+
+        Args:
+            vector_store (VectorStore): Индекс и кэши поиска.
+            kafka_consumer (Optional[KafkaConsumer]): Отставание и очередь потребителя.
+            startup_phases (Optional[StartupPhases]): Длительности этапов запуска.
+            executors (Optional[dict]): Пулы BoundedExecutor по имени.
+        """
+        self.vector_store = vector_store
+        self.kafka_consumer = kafka_consumer
+        self.startup_phases = startup_phases
+        self.executors = executors or {}
+
+    def collect(self):
+        vector_store = self.vector_store
+        yield GaugeMetricFamily("sim_index_vectors", "Количество векторов в индексе",
+                                value=vector_store.index_size())
+        yield GaugeMetricFamily("sim_index_version", "Версия индекса (растёт при каждом изменении)",
+                                value=vector_store.version)
+        if vector_store.exact_vectors is not None:
+            yield GaugeMetricFamily("sim_exact_vectors_dead_ratio",
+                                    "Доля устаревших строк в файле точных векторов",
+                                    value=vector_store.exact_vectors.dead_ratio())
+
+        hit_ratio = GaugeMetricFamily("sim_cache_hit_ratio", "Доля попаданий в кэш", labels=["cache"])
+        entries = GaugeMetricFamily("sim_cache_entries", "Количество записей в кэше", labels=["cache"])
+        caches = dict(vector_store.cache_stats())
+        embedding_cache = vector_store.embedding_generator.cache_stats()
+        if embedding_cache["enabled"]:
+            caches["embeddings"] = embedding_cache
+        for name, stats in caches.items():
+            hit_ratio.add_metric([name], stats["hit_rate"])
+            entries.add_metric([name], stats["entries"])
+        yield hit_ratio
+        yield entries
+
+        if self.kafka_consumer is not None:
+            stats = self.kafka_consumer.stats()
+            lag = GaugeMetricFamily("sim_kafka_consumer_lag",
+                                    "Сообщения партиции, ещё не сохранённые в индексе", labels=["partition"])
+            for partition, info in stats["partitions"].items():
+                lag.add_metric([partition], info["lag"])
+            yield lag
+            yield GaugeMetricFamily("sim_kafka_queue_depth", "Батчи в очереди обработки потребителя",
+                                    value=stats["queue_depth"])
+
+        if self.executors:
+            queue_depth = GaugeMetricFamily("sim_executor_queue_depth", "Задачи в очереди пула",
+                                            labels=["executor"])
+            for name, executor in self.executors.items():
+                queue_depth.add_metric([name], executor.stats()["queue_depth"])
+            yield queue_depth
+
+        if self.startup_phases is not None:
+            phases = GaugeMetricFamily("sim_startup_phase_seconds", "Длительность этапа запуска",
+                                       labels=["phase"])
+            for name, phase in self.startup_phases.phases.items():
+                if phase["seconds"] is not None:
+                    phases.add_metric([name], phase["seconds"])
+            yield phases
@@ -15,3 +15,17 @@ class Article(BaseModel):
 
     class Config:
         from_attributes = True  # Поддержка преобразования из словарей/объектов
+
+
+class ArticleSummary(BaseModel):
+    """Проекция статьи без текста для выдачи поиска (fields=summary)."""
+    id: int = Field(..., description="Уникальный идентификатор статьи")
+    name: str = Field(..., description="Заголовок статьи")
+    complexity: Optional[str] = Field(
+        None, description="Уровень сложности статьи (может быть null)")
+    reading_time: int = Field(..., description="Время чтения статьи в минутах")
+    tags: List[str] = Field(default_factory=list,
+                            description="Список тегов статьи")
+
+    class Config:
+        from_attributes = True
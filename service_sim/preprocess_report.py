@@ -0,0 +1,214 @@
+"""
+Проверка и бенчмарк однопроходной предобработки Markdown (markdown_preprocessor.py).
+
+Результат сравнивается с эталоном — прежним конвейером (markdown.markdown +
+регулярные выражения), в котором блоки кода распознаются расширением
+fenced_code и удаляются вместе с инлайн-кодом, а HTML-сущности декодируются.
+Для каждого документа считается совпадение множеств слов; скрипт завершается
+с кодом 1, если средняя доля совпадения ниже --min-parity. Отдельно выводится,
+чем новый результат отличается от прежнего конвейера без исправлений, и
+скорость обоих вариантов (статей в секунду).
+
+По умолчанию используется синтетический корпус в стиле статей Хабра
+(заголовки, списки, ссылки, изображения, таблицы, блоки и инлайн-код,
+HTML-теги и сущности). Реальные статьи можно передать через --input:
+файлы .md, директории с ними или JSONL с полем text.
+
+Пример:
+    python preprocess_report.py --articles 500
+    python preprocess_report.py --input dump.jsonl --min-parity 0.97 --output preprocess.json
+"""
+import argparse
+import html
+import json
+import os
+import re
+import sys
+import time
+from typing import List
+
+import markdown
+import numpy as np
+
+from markdown_preprocessor import preprocess_markdown
+
+WORDS = ("python", "алгоритм", "данные", "модель", "сервис", "индекс", "запрос",
+         "обучение", "сеть", "функция", "класс", "поток", "память", "кэш", "база",
+         "kafka", "postgres", "сборка", "тест", "релиз")
+CODE_WORDS = ("def", "return", "import", "lambda", "yield", "self", "kwargs",
+              "np_array", "fetchall", "SELECT", "printf", "nullptr")
+
+
+def _sentence(rng, words: int = 12) -> str:
+    return " ".join(rng.choice(WORDS, words)).capitalize() + "."
+
+
+def _code_line(rng) -> str:
+    return " ".join(rng.choice(CODE_WORDS, 4)) + "(x, y)  # " + rng.choice(CODE_WORDS)
+
+
+def _paragraph(rng) -> str:
+    parts = [_sentence(rng) for _ in range(rng.integers(2, 5))]
+    i = rng.integers(len(parts))
+    kind = rng.integers(6)
+    if kind == 0:
+        parts[i] += f" Подробнее в [документации {rng.choice(WORDS)}](https://habr.com/ru/articles/{rng.integers(10**6)}/)."
+    elif kind == 1:
+        parts[i] += f" Вызов `{rng.choice(CODE_WORDS)}()` возвращает **{rng.choice(WORDS)}**."
+    elif kind == 2:
+        parts[i] += f" Версия {rng.integers(1, 9)}.{rng.integers(20)} &mdash; *{rng.choice(WORDS)}* &amp; {rng.choice(WORDS)}."
+    elif kind == 3:
+        parts[i] += f" См. <https://github.com/{rng.choice(WORDS)}> и H<sub>2</sub>O."
+    elif kind == 4:
+        parts[i] += f" Переменная __{rng.choice(WORDS)}__ и snake_case_{rng.choice(WORDS)}."
+    return " ".join(parts)
+
+
+def synthetic_article(rng) -> str:
+    """Статья Markdown в стиле html-to-markdown для страниц Хабра."""
+    blocks = [f"# {_sentence(rng, 5)}", _paragraph(rng)]
+    for _ in range(rng.integers(3, 7)):
+        blocks.append(f"{'#' * rng.integers(2, 4)} {_sentence(rng, 4)}")
+        for _ in range(rng.integers(1, 4)):
+            kind = rng.integers(8)
+            if kind == 0:
+                fence = "```" if rng.integers(2) else "~~~"
+                lang = rng.choice(("python", "go", "sql", ""))
+                code = "\n".join(_code_line(rng) for _ in range(rng.integers(3, 12)))
+                blocks.append(f"{fence}{lang}\n{code}\n{fence}")
+            elif kind == 1:
+                blocks.append("\n".join(f"- {_sentence(rng, 6)}" for _ in range(rng.integers(2, 6))))
+            elif kind == 2:
+                blocks.append("\n".join(f"{n}. {_sentence(rng, 6)}" for n in range(1, rng.integers(3, 6))))
+            elif kind == 3:
+                blocks.append(f"![{rng.choice(WORDS)}](https://habrastorage.org/{rng.integers(10**6)}.png)")
+            elif kind == 4:
+                rows = [f"| {rng.choice(WORDS)} | {rng.integers(1000)} |" for _ in range(3)]
+                blocks.append("\n".join(["| Параметр | Значение |", "| --- | --- |"] + rows))
+            elif kind == 5:
+                blocks.append(f"> {_sentence(rng)}")
+            else:
+                blocks.append(_paragraph(rng))
+    return "\n\n".join(blocks) + "\n"
+
+
+def legacy_preprocess_markdown(text: str) -> str:
+    """Прежний конвейер EmbeddingGenerator.preprocess_markdown."""
+    clean_text = re.sub(r'<[^>]+>', '', markdown.markdown(text))
+    clean_text = re.sub(r'\[([^\]]*)\]\([^\)]*\)', r'\1', clean_text)
+    clean_text = re.sub(r'```.*?```', '', clean_text, flags=re.DOTALL)
+    clean_text = re.sub(r'`.*?`', '', clean_text)
+    clean_text = re.sub(r'#+ ', '', clean_text)
+    clean_text = re.sub(r'[-*+]\s', '', clean_text)
+    clean_text = re.sub(r'[^\w\s]', '', clean_text)
+    clean_text = re.sub(r'\s+', ' ', clean_text).strip()
+    return clean_text if clean_text else " "
+
+
+def reference_preprocess_markdown(text: str) -> str:
+    """Эталон: прежний конвейер с удалением блоков кода и декодированием сущностей."""
+    rendered = markdown.markdown(text, extensions=["fenced_code"])
+    rendered = re.sub(r'<pre>.*?</pre>|<code>.*?</code>', ' ', rendered, flags=re.DOTALL)
+    clean_text = html.unescape(re.sub(r'<[^>]+>', '', rendered))
+    clean_text = re.sub(r'\[([^\]]*)\]\([^\)]*\)', r'\1', clean_text)
+    clean_text = re.sub(r'#+ ', '', clean_text)
+    clean_text = re.sub(r'[-*+]\s', '', clean_text)
+    clean_text = re.sub(r'[^\w\s]', '', clean_text)
+    clean_text = re.sub(r'\s+', ' ', clean_text).strip()
+    return clean_text if clean_text else " "
+
+
+def load_articles(paths: List[str]) -> List[str]:
+    """Тексты статей из файлов .md, директорий с ними и JSONL с полем text."""
+    texts = []
+    for path in paths:
+        if os.path.isdir(path):
+            texts.extend(load_articles(sorted(
+                os.path.join(path, name) for name in os.listdir(path) if name.endswith(".md"))))
+        elif path.endswith(".jsonl"):
+            with open(path, encoding="utf-8") as f:
+                texts.extend(json.loads(line)["text"] for line in f if line.strip())
+        else:
+            with open(path, encoding="utf-8") as f:
+                texts.append(f.read())
+    return texts
+
+
+def token_parity(expected: str, actual: str) -> float:
+    """Доля совпадения множеств слов (коэффициент Жаккара)."""
+    a, b = set(expected.split()), set(actual.split())
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+
+def articles_per_second(func, texts: List[str], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            func(text)
+        best = min(best, time.perf_counter() - start)
+    return len(texts) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", nargs="+", help="файлы .md, директории или JSONL с полем text")
+    parser.add_argument("--articles", type=int, default=300, help="размер синтетического корпуса")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="повторы замера скорости (берётся лучший)")
+    parser.add_argument("--min-parity", type=float, default=0.98)
+    parser.add_argument("--show", type=int, default=3, help="сколько худших документов вывести")
+    parser.add_argument("--output", help="путь для JSON-отчёта")
+    args = parser.parse_args()
+
+    if args.input:
+        texts = load_articles(args.input)
+    else:
+        rng = np.random.default_rng(args.seed)
+        texts = [synthetic_article(rng) for _ in range(args.articles)]
+    print(f"Articles: {len(texts)}, avg length: {sum(map(len, texts)) / max(1, len(texts)):.0f} chars")
+
+    parity, exact, changed, removed_code = [], 0, 0, 0
+    for text in texts:
+        actual = preprocess_markdown(text)
+        expected = reference_preprocess_markdown(text)
+        legacy = legacy_preprocess_markdown(text)
+        parity.append(token_parity(expected, actual))
+        exact += actual == expected
+        changed += actual != legacy
+        removed_code += len(legacy.split()) - len(actual.split())
+    parity = np.array(parity)
+    mean_parity = float(parity.mean()) if len(parity) else 1.0
+    print(f"Parity with reference: mean {mean_parity:.4f}, min {parity.min(initial=1.0):.4f}, "
+          f"exact {exact}/{len(texts)}")
+    print(f"Changed vs legacy pipeline: {changed}/{len(texts)} documents, "
+          f"{removed_code / max(1, len(texts)):.1f} fewer tokens per document")
+    for i in np.argsort(parity)[:args.show]:
+        if parity[i] >= 1.0:
+            break
+        expected = set(reference_preprocess_markdown(texts[i]).split())
+        actual = set(preprocess_markdown(texts[i]).split())
+        print(f"  doc {i}: parity {parity[i]:.4f}, missing {sorted(expected - actual)[:10]}, "
+              f"extra {sorted(actual - expected)[:10]}")
+
+    legacy_rate = articles_per_second(legacy_preprocess_markdown, texts, args.repeat)
+    new_rate = articles_per_second(preprocess_markdown, texts, args.repeat)
+    print(f"Legacy: {legacy_rate:.1f} articles/s, single-pass: {new_rate:.1f} articles/s "
+          f"({new_rate / legacy_rate:.1f}x)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"articles": len(texts), "mean_parity": mean_parity,
+                       "min_parity": float(parity.min(initial=1.0)), "exact": exact,
+                       "changed_vs_legacy": changed, "legacy_articles_per_s": legacy_rate,
+                       "articles_per_s": new_rate}, f, indent=2)
+        print(f"Report saved to {args.output}")
+
+    if mean_parity < args.min_parity:
+        print(f"Parity {mean_parity:.4f} is below {args.min_parity}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from attribute_filter import filter_key
+from executors import BoundedExecutor
+from metrics import QUERY_BATCH_SIZE, QUERY_BATCH_WAIT_SECONDS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+Hits = List[List[Tuple[int, float]]]
+
+
+class _Batch:
+    def __init__(self, params: tuple):
+        self.params = params
+        self.entries: List[Tuple[List[Tuple[str, int]], asyncio.Future, float]] = []
+        self.size = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class QueryBatcher:
+    def __init__(self, search: Callable[..., Tuple[Hits, bool]], executor: BoundedExecutor,
+                 max_wait_ms: float = 2.0, max_batch_size: int = 64):
+        """
+        Микробатчинг поисковых запросов в event loop.
+
+        Одновременные запросы /search с одинаковыми параметрами поиска (nprobe,
+        ef_search, фильтр, режим) собираются не дольше max_wait_ms или до
+        max_batch_size запросов и выполняются одним вызовом search в пуле: один
+        model.encode для всех текстов и один матричный index.search. Каждый
+        вызывающий получает свои строки результата. Очередь живёт в event
+        loop, поэтому блокировки не нужны; пул инференса получает одну задачу
+        на батч вместо задачи на запрос.
+
+        Args:
+            search (Callable): (queries, nprobe, ef_search, filters, mode) -> (hits, partial),
+                то есть VectorStore.find_neighbors.
+            executor (BoundedExecutor): Пул инференса.
+            max_wait_ms (float): Максимальное ожидание заполнения батча (0 — без батчинга).
+            max_batch_size (int): Количество запросов, при котором батч отправляется сразу.
+        """
+        self.search_fn = search
+        self.executor = executor
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._pending: Dict[tuple, _Batch] = {}
+        # Ссылки на выполняющиеся батчи (иначе задачу может собрать GC)
+        self._tasks = set()
+        self.batches = 0
+        self.queries = 0
+
+    async def search(self, queries: List[Tuple[str, int]], nprobe: Optional[int], ef_search: Optional[int],
+                     filters: Optional[dict] = None, mode: str = "vector") -> Tuple[Hits, bool]:
+        """
+        Поиск ближайших для запросов одного вызывающего в составе общего батча.
+
+        Returns:
+            Tuple[Hits, bool]: Пары (ID статьи, расстояние) в порядке queries и
+                признак неполного ответа батча.
+        """
+        if self.max_wait <= 0:
+            return await self._run(nprobe, ef_search, filters, mode, [(queries, None, time.perf_counter())])
+        params = (nprobe, ef_search, filter_key(filters), mode)
+        batch = self._pending.get(params)
+        if batch is None:
+            batch = self._pending[params] = _Batch(params)
+            batch.timer = asyncio.get_running_loop().call_later(
+                self.max_wait, self._flush, batch, filters)
+        future = asyncio.get_running_loop().create_future()
+        batch.entries.append((queries, future, time.perf_counter()))
+        batch.size += len(queries)
+        if batch.size >= self.max_batch_size:
+            batch.timer.cancel()
+            self._flush(batch, filters)
+        return await future
+
+    def _flush(self, batch: _Batch, filters: Optional[dict]):
+        """Отправка батча: следующие запросы с теми же параметрами начинают новый."""
+        if self._pending.get(batch.params) is batch:
+            del self._pending[batch.params]
+        nprobe, ef_search, _, mode = batch.params
+        task = asyncio.ensure_future(self._dispatch(batch.entries, nprobe, ef_search, filters, mode))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, entries, nprobe: Optional[int], ef_search: Optional[int],
+                        filters: Optional[dict], mode: str):
+        try:
+            hits, partial = await self._run(nprobe, ef_search, filters, mode, entries)
+        except Exception as e:
+            for _, future, _ in entries:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        start = 0
+        for queries, future, _ in entries:
+            if not future.done():
+                future.set_result((hits[start:start + len(queries)], partial))
+            start += len(queries)
+
+    async def _run(self, nprobe: Optional[int], ef_search: Optional[int], filters: Optional[dict], mode: str,
+                   entries) -> Tuple[Hits, bool]:
+        dispatched = time.perf_counter()
+        all_queries = [query for queries, _, _ in entries for query in queries]
+        for _, _, enqueued in entries:
+            QUERY_BATCH_WAIT_SECONDS.observe(dispatched - enqueued)
+        QUERY_BATCH_SIZE.observe(len(all_queries))
+        self.batches += 1
+        self.queries += len(all_queries)
+        if len(entries) > 1:
+            logger.info(f"Micro-batch: {len(all_queries)} queries from {len(entries)} requests")
+        return await self.executor.run(self.search_fn, all_queries, nprobe, ef_search, filters, mode)
+
+    def stats(self) -> dict:
+        return {
+            "max_wait_ms": self.max_wait * 1000,
+            "max_batch_size": self.max_batch_size,
+            "batches": self.batches,
+            "queries": self.queries,
+            "mean_batch_size": self.queries / self.batches if self.batches else 0.0,
+            "pending": sum(batch.size for batch in self._pending.values()),
+            "in_flight": len(self._tasks),
+        }
@@ -0,0 +1,285 @@
+"""
+Полная переиндексация (backfill) векторного индекса из таблицы scrapping.articles.
+
+Таблица читается в порядке ID именованным (серверным) курсором порциями по
+--chunk-size строк, поэтому память не зависит от размера таблицы. Каждая
+порция предобрабатывается и кодируется батчами, векторы дописываются в
+memory-mapped файл точных векторов в директории подготовки
+<data-dir>/reindex рядом с рабочим индексом. После каждой порции на диск
+пишется контрольная точка (последний обработанный ID), и прерванная
+переиндексация продолжается с неё запуском с флагом --resume.
+
+Когда таблица прочитана, по точным векторам строится новый индекс с
+параметрами из vector_store.index (обучение на выборке, заполнение
+порциями). Затем индекс подменяется атомарно:
+
+* с --service-url — запросом POST /admin/reload: работающий сервис
+  забирает подготовленный индекс, воспроизводит поверх него свой журнал с
+  начала выгрузки и публикует новый снапшот. Начало выгрузки отмечается в
+  сервисе запросом POST /admin/reindex: до подмены снапшоты не очищают
+  журнал, поэтому изменения из Kafka за время выгрузки не теряются.
+  Брошенную выгрузку нужно отменить запросом DELETE /admin/reindex;
+* без него (сервис остановлен) — индекс записывается в новую директорию
+  снапшота, указатель CURRENT заменяется через os.replace, а журнал
+  воспроизводится при следующем запуске сервиса.
+
+Дисковый кэш эмбеддингов сервиса не рассчитан на запись из нескольких
+процессов, поэтому --use-cache стоит включать только при остановленном сервисе.
+
+Пример:
+    python reindex.py --service-url http://localhost:8000
+    python reindex.py --chunk-size 2000 --resume
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+import faiss
+import numpy as np
+import requests
+import yaml
+
+from db_operator import PostgresOperator
+from embedding_pool import create_worker_pool
+from embeddings import EmbeddingGenerator
+from exact_vectors import ExactVectors
+from index_factory import build_index, config_codec, effective_config, requires_training, train_index
+from vector_store import REINDEX_DIR, content_hash, fsync_path
+
+CHECKPOINT_FILE = "checkpoint.json"
+# Пары (ID статьи, хеш текста) int64, дописываются вместе с векторами
+HASHES_FILE = "hashes.bin"
+
+
+def load_checkpoint(staging_dir: str) -> dict:
+    path = os.path.join(staging_dir, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_checkpoint(staging_dir: str, checkpoint: dict):
+    """Атомарная запись контрольной точки (после fsync векторов и хешей)."""
+    path = os.path.join(staging_dir, CHECKPOINT_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def stream_embeddings(args, config: dict, staging_dir: str, checkpoint: dict, exact: ExactVectors):
+    """Чтение статей порциями, кодирование и запись векторов с контрольной точкой после каждой порции."""
+    ingest_config = config.get("ingest", {})
+    backend_config = config.get("embedding_backend", {})
+    worker_pool = create_worker_pool(args.model, ingest_config, backend_config)
+    cache_dir = None
+    if args.use_cache:
+        cache_config = config.get("embedding_cache", {})
+        cache_dir = cache_config.get("path") or os.path.join(args.data_dir, "embedding_cache")
+    generator = EmbeddingGenerator(args.model, cache_dir=cache_dir, worker_pool=worker_pool,
+                                   backend_config=backend_config)
+    if generator.model.get_sentence_embedding_dimension() != exact.dimension:
+        raise RuntimeError(f"Model dimension {generator.model.get_sentence_embedding_dimension()} "
+                           f"does not match vector_store.dimension {exact.dimension}")
+    db = PostgresOperator(config_path=args.config)
+
+    hashes_path = os.path.join(staging_dir, HASHES_FILE)
+    hashes_file = open(hashes_path, "r+b" if os.path.exists(hashes_path) else "w+b")
+    # Хвост, дописанный после последней контрольной точки, отбрасывается
+    hashes_file.truncate(checkpoint["articles"] * 16)
+    hashes_file.seek(0, os.SEEK_END)
+
+    last_id = checkpoint["last_id"]
+    total = checkpoint["articles"] + db.count_articles(last_id)
+    print(f"Articles to index: {total - checkpoint['articles']} after ID {last_id} "
+          f"({checkpoint['articles']} already done)")
+    started = time.perf_counter()
+    done_now = 0
+    try:
+        for articles in db.iter_articles(last_id, args.chunk_size):
+            chunk_started = time.perf_counter()
+            article_ids = np.array([article.id for article in articles], dtype=np.int64)
+            embeddings = generator.generate_embeddings(
+                [article.text for article in articles], batch_size=args.batch_size,
+                use_cache=args.use_cache, use_workers=True)
+            pairs = np.column_stack(
+                [article_ids, [content_hash(article.text) for article in articles]]).astype(np.int64)
+
+            exact.upsert(article_ids, embeddings)
+            hashes_file.write(pairs.tobytes())
+            hashes_file.flush()
+            os.fsync(hashes_file.fileno())
+            exact.save(staging_dir)
+            checkpoint.update(last_id=int(article_ids[-1]),
+                              articles=checkpoint["articles"] + len(articles))
+            save_checkpoint(staging_dir, checkpoint)
+
+            done_now += len(articles)
+            elapsed = time.perf_counter() - started
+            rate = done_now / elapsed
+            eta = (total - checkpoint["articles"]) / rate if rate else 0
+            print(f"{checkpoint['articles']}/{total} articles, last ID {checkpoint['last_id']}, "
+                  f"chunk {len(articles) / (time.perf_counter() - chunk_started):.1f}/s, "
+                  f"avg {rate:.1f}/s, ETA {eta:.0f}s", flush=True)
+    finally:
+        hashes_file.close()
+        db.close()
+        if worker_pool is not None:
+            worker_pool.shutdown()
+
+
+def build_staged_index(config: dict, staging_dir: str, exact: ExactVectors) -> int:
+    """Построение индекса по точным векторам подготовки: index.bin, hashes.npy и metadata.json."""
+    index_config = config.get("vector_store", {}).get("index", {"type": "flat"})
+    ntotal = len(exact)
+    hashes = np.fromfile(os.path.join(staging_dir, HASHES_FILE), dtype=np.int64).reshape(-1, 2)
+    np.save(os.path.join(staging_dir, "hashes.npy"), hashes)
+
+    exact.save(staging_dir)
+
+    started = time.perf_counter()
+    index_config = effective_config(index_config, exact.dimension, ntotal)
+    if requires_training(index_config) and ntotal < index_config.get("min_train_size", 10000):
+        index_config = {"type": "flat"}
+    # Шарды строят свои индексы сами: векторы распределяются по ним из flat
+    if config.get("vector_store", {}).get("shards", {}).get("count", 0) > 0:
+        index_config = {"type": "flat"}
+    index = build_index(index_config, exact.dimension, ntotal)
+    sample_size = index_config.get("train_sample_size", 50000)
+    train_index(index, exact.sample(sample_size), sample_size)
+    for article_ids, vectors in exact.chunks():
+        index.add_with_ids(vectors, article_ids)
+    faiss.write_index(index, os.path.join(staging_dir, "index.bin"))
+    print(f"Built {index_config.get('type', 'flat')}/{config_codec(index_config)} index "
+          f"with {index.ntotal} vectors in {time.perf_counter() - started:.1f}s")
+
+    # LSN 0: при запуске сервиса поверх снапшота воспроизводится весь журнал
+    with open(os.path.join(staging_dir, "metadata.json"), "w") as f:
+        json.dump({"lsn": 0}, f)
+    for file_name in os.listdir(staging_dir):
+        if os.path.isfile(os.path.join(staging_dir, file_name)):
+            fsync_path(os.path.join(staging_dir, file_name))
+    return ntotal
+
+
+def publish_offline(config: dict, data_dir: str, staging_dir: str, dimension: int):
+    """Публикация подготовленного индекса новым снапшотом при остановленном сервисе."""
+    snapshots_dir = os.path.join(data_dir, "snapshots")
+    name = f"reindex-{int(time.time())}"
+    snapshot_dir = os.path.join(snapshots_dir, name)
+    os.makedirs(snapshot_dir + ".tmp")
+    for file_name in ("index.bin", "hashes.npy", "metadata.json"):
+        if os.path.exists(os.path.join(staging_dir, file_name)):
+            shutil.copyfile(os.path.join(staging_dir, file_name),
+                            os.path.join(snapshot_dir + ".tmp", file_name))
+
+    # Точные векторы переносятся в файл нового поколения в директории сервиса
+    vector_store_config = config.get("vector_store", {})
+    exact = None
+    if vector_store_config.get("rerank", {}).get("enabled", True) and \
+            config_codec(vector_store_config.get("index", {})) != "none":
+        staged = ExactVectors(os.path.join(staging_dir, "exact_vectors"), dimension)
+        staged.load(staging_dir)
+        exact = ExactVectors(os.path.join(data_dir, "exact_vectors"), dimension)
+        exact.replace(staged.chunks())
+        exact.save(snapshot_dir + ".tmp")
+        staged.close()
+
+    for file_name in os.listdir(snapshot_dir + ".tmp"):
+        fsync_path(os.path.join(snapshot_dir + ".tmp", file_name))
+    os.rename(snapshot_dir + ".tmp", snapshot_dir)
+    fsync_path(snapshots_dir)
+    current_path = os.path.join(data_dir, "CURRENT")
+    with open(current_path + ".tmp", "w") as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(current_path + ".tmp", current_path)
+    fsync_path(data_dir)
+
+    # Прежние снапшоты и файлы точных векторов больше не нужны
+    for old_name in os.listdir(snapshots_dir):
+        if old_name != name:
+            shutil.rmtree(os.path.join(snapshots_dir, old_name), ignore_errors=True)
+    if exact is not None:
+        exact.release_old()
+        exact.close()
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    print(f"Published snapshot {name}; the WAL will be replayed on the next service start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default="config/config_sim.yaml")
+    parser.add_argument("--data-dir", default="/app/faiss_data")
+    parser.add_argument("--model", default="distiluse-base-multilingual-cased-v1")
+    parser.add_argument("--chunk-size", type=int, default=1000,
+                        help="строк за одно чтение серверного курсора (и между контрольными точками)")
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help="размер батча encode (по умолчанию ingest.encode_batch_size)")
+    parser.add_argument("--resume", action="store_true",
+                        help="продолжить с контрольной точки прерванной переиндексации")
+    parser.add_argument("--use-cache", action="store_true",
+                        help="использовать дисковый кэш эмбеддингов (только при остановленном сервисе)")
+    parser.add_argument("--service-url",
+                        help="адрес работающего сервиса для подмены через POST /admin/reload")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        config = yaml.safe_load(f) or {}
+    if args.batch_size is None:
+        args.batch_size = config.get("ingest", {}).get("encode_batch_size", 32)
+    dimension = config.get("vector_store", {}).get("dimension", 512)
+
+    staging_dir = os.path.join(args.data_dir, REINDEX_DIR)
+    checkpoint = load_checkpoint(staging_dir) if args.resume else {}
+    if checkpoint and (checkpoint.get("model") != args.model or checkpoint.get("dimension") != dimension):
+        print(f"Checkpoint in {staging_dir} was made with another model or dimension, start without --resume")
+        sys.exit(1)
+    if not checkpoint:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        os.makedirs(staging_dir)
+        checkpoint = {"model": args.model, "dimension": dimension,
+                      "last_id": 0, "articles": 0, "built": False}
+        if args.service_url:
+            # До чтения таблицы: журнал сервиса с этого места воспроизводится при подмене
+            response = requests.post(f"{args.service_url.rstrip('/')}/admin/reindex", timeout=60)
+            if response.status_code != 200:
+                print(f"Cannot register reindex start ({response.status_code}): {response.text}")
+                sys.exit(1)
+            checkpoint["wal_lsn"] = response.json()["wal_lsn"]
+            print(f"Service keeps its WAL from LSN {checkpoint['wal_lsn']} until reload")
+        save_checkpoint(staging_dir, checkpoint)
+    else:
+        print(f"Resuming from article ID {checkpoint['last_id']} ({checkpoint['articles']} articles done)")
+
+    exact = ExactVectors(os.path.join(staging_dir, "exact_vectors"), dimension)
+    exact.load(staging_dir)
+    if not checkpoint["built"]:
+        started = time.perf_counter()
+        stream_embeddings(args, config, staging_dir, checkpoint, exact)
+        build_staged_index(config, staging_dir, exact)
+        checkpoint["built"] = True
+        save_checkpoint(staging_dir, checkpoint)
+        print(f"Indexed {checkpoint['articles']} articles in {time.perf_counter() - started:.1f}s")
+    exact.close()
+
+    if args.service_url:
+        response = requests.post(f"{args.service_url.rstrip('/')}/admin/reload", timeout=3600)
+        if response.status_code != 200:
+            print(f"Reload failed ({response.status_code}): {response.text}; "
+                  f"the prepared index is kept in {staging_dir}, retry with --resume")
+            sys.exit(1)
+        print(f"Service reloaded: {response.json()}")
+    else:
+        publish_offline(config, args.data_dir, staging_dir, dimension)
+
+
+if __name__ == "__main__":
+    main()
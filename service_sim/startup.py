@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, Iterable
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class StartupPhases:
+    def __init__(self, phases: Iterable[str], ready_phases: Iterable[str]):
+        """
+        Этапы запуска сервиса: состояние и длительность каждого этапа.
+
+        Длительность завершённого этапа пишется в лог строкой метрики
+        startup_phase_seconds{phase="..."}, чтобы регрессии времени запуска
+        были видны при сравнении логов.
+
+        Args:
+            phases (Iterable[str]): Все этапы в порядке запуска.
+            ready_phases (Iterable[str]): Этапы, после которых сервис готов
+                принимать поисковые запросы (/ready).
+        """
+        self.started = time.monotonic()
+        self.ready_phases = tuple(ready_phases)
+        self.phases: Dict[str, dict] = {
+            name: {"status": PENDING, "seconds": None, "error": None} for name in phases}
+
+    async def run(self, name: str, fn: Callable, *args) -> bool:
+        """
+        Выполнение этапа в отдельном потоке.
+
+        Returns:
+            bool: True, если этап завершился без ошибки.
+        """
+        phase = self.phases[name]
+        phase["status"] = RUNNING
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(fn, *args)
+        except Exception as e:
+            phase.update(status=FAILED, error=str(e),
+                         seconds=round(time.perf_counter() - started, 3))
+            logger.error(f"Startup phase {name} failed after {phase['seconds']:.2f}s: {e}")
+            return False
+        self.finish(name, time.perf_counter() - started)
+        return True
+
+    def finish(self, name: str, seconds: float = 0.0):
+        """Отметка этапа завершённым (для этапов, выполняемых вне run)."""
+        self.phases[name].update(status=DONE, seconds=round(seconds, 3))
+        logger.info(f'startup_phase_seconds{{phase="{name}"}} {seconds:.3f}')
+        if all(phase["status"] == DONE for phase in self.phases.values()):
+            logger.info(f"startup_seconds {time.monotonic() - self.started:.3f}")
+
+    def ready(self) -> bool:
+        return all(self.phases[name]["status"] == DONE for name in self.ready_phases)
+
+    def failed(self) -> bool:
+        return any(phase["status"] == FAILED for phase in self.phases.values())
+
+    def stats(self) -> dict:
+        return {"ready": self.ready(), "uptime_s": round(time.monotonic() - self.started, 3),
+                "phases": self.phases}
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Модули сервиса импортируются друг другом без пакета, как при запуске из service_sim
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
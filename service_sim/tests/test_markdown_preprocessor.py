@@ -0,0 +1,42 @@
+"""
+Совпадение preprocess_markdown с прежним конвейером (markdown.markdown +
+регулярные выражения, эталон из preprocess_report.py) на граничных случаях.
+"""
+import pytest
+
+pytest.importorskip("markdown")
+
+from markdown_preprocessor import preprocess_markdown
+from preprocess_report import reference_preprocess_markdown
+
+CASES = {
+    "empty": "",
+    "whitespace": "  \n\t\n",
+    "fenced_code": "Текст до\n\n```python\ndef f(x):\n    return x * 2\n```\n\nТекст после",
+    "tilde_fence": "До\n\n~~~\nsecret code\n~~~\n\nПосле",
+    "inline_code": "Вызовите `print(x)` и ``a ` b`` затем",
+    "links": ("Читайте [документацию FAISS](https://github.com/facebookresearch/faiss) и [ссылку][ref]\n\n"
+              "[ref]: https://example.com"),
+    "autolinks": "Почта <user@example.com> и <https://habr.com/ru/>",
+    "images": "До ![схема индекса](img/ivf.png) после",
+    "html_entities": "Tom &amp; Jerry &lt;3 &quot;кавычки&quot; &#169; &#x41;",
+    "html_tags": "<div class=\"note\">Внутри <b>тега</b></div>\n\n<!-- комментарий -->\n\nТекст",
+    "nested_lists": "- первый\n  - вложенный\n    - глубже\n- второй\n\n1. один\n2. два\n   1. два-один",
+    "headers_emphasis": "# Заголовок\n\n## Подзаголовок\n\n**жирный** и *курсив* и __подчёркнутый__ snake_case_name",
+}
+
+
+@pytest.mark.parametrize("text", CASES.values(), ids=CASES.keys())
+def test_matches_reference(text):
+    assert preprocess_markdown(text) == reference_preprocess_markdown(text)
+
+
+def test_empty_input_is_single_space():
+    assert preprocess_markdown("") == " "
+    assert preprocess_markdown("```\ncode only\n```") == " "
+
+
+def test_unclosed_fence_runs_to_end():
+    # Расхождение с эталоном: по CommonMark незакрытый блок кода тянется до конца
+    # документа, а расширение fenced_code оставляет его текстом
+    assert preprocess_markdown("До\n\n```\ncode to the end") == "До"
@@ -0,0 +1,93 @@
+"""
+Снапшоты и журнал VectorStore: неудачная запись снапшота не должна терять
+изменения, повреждённый снапшот не должен открываться как пустой индекс.
+"""
+import os
+
+import numpy as np
+import pytest
+import yaml
+
+pytest.importorskip("faiss")
+
+import vector_store
+from vector_store import VectorStore
+
+DIMENSION = 16
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    path = tmp_path / "config_sim.yaml"
+    path.write_text(yaml.safe_dump({
+        "embedding_cache": {"enabled": False},
+        "ingest": {"embedding_workers": 0},
+        "vector_store": {"dimension": DIMENSION, "index": {"type": "flat"}},
+        "persistence": {"snapshot_every_n": 1000000, "snapshot_interval_s": 3600, "wal_fsync": False},
+    }))
+    return str(path)
+
+
+def open_store(tmp_path, config_path) -> VectorStore:
+    """Хранилище без модели: векторы добавляются готовыми через add_embeddings."""
+    data_dir = tmp_path / "faiss_data"
+    store = VectorStore(index_path=str(data_dir / "faiss_index.bin"),
+                        metadata_path=str(data_dir / "metadata.json"),
+                        config_path=config_path, lazy=True)
+    store.open_index(mmap=False)
+    store.recover(reconcile=False)
+    return store
+
+
+def add(store: VectorStore, article_ids):
+    vectors = np.random.default_rng(0).random((len(article_ids), DIMENSION), dtype=np.float32)
+    store.add_embeddings(list(article_ids), [article_id * 7 for article_id in article_ids], vectors)
+
+
+def crash(store: VectorStore):
+    """Остановка без финального снапшота, как при падении процесса."""
+    store.wal.close()
+
+
+def test_failed_snapshot_keeps_wal_and_current(tmp_path, config_path, monkeypatch):
+    store = open_store(tmp_path, config_path)
+    add(store, range(1, 31))
+    store.snapshot()
+    with open(store.current_path) as f:
+        current = f.read()
+    add(store, range(31, 51))
+    wal_size = os.path.getsize(store.wal.path)
+
+    def write_index(index, path):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(vector_store.faiss, "write_index", write_index)
+    with pytest.raises(OSError):
+        store.snapshot()
+    # Снапшот по порогу при записи тоже падает, но не прерывает добавление
+    store.snapshot_every_n = 1
+    add(store, range(51, 56))
+    monkeypatch.undo()
+
+    assert os.path.getsize(store.wal.path) > wal_size
+    with open(store.current_path) as f:
+        assert f.read() == current
+    assert os.listdir(store.snapshots_dir) == [current]
+    crash(store)
+
+    store = open_store(tmp_path, config_path)
+    assert store.index.ntotal == len(store.content_hashes) == 55
+    store.close()
+
+
+def test_corrupt_snapshot_index_fails_to_open(tmp_path, config_path):
+    store = open_store(tmp_path, config_path)
+    add(store, range(1, 51))
+    store.close()
+    with open(store.current_path) as f:
+        index_file = os.path.join(store.snapshots_dir, f.read(), "index.bin")
+    with open(index_file, "r+b") as f:
+        f.truncate(os.path.getsize(index_file) // 2)
+
+    with pytest.raises(RuntimeError):
+        open_store(tmp_path, config_path)
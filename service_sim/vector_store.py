@@ -1,146 +1,1364 @@
 import faiss
+import hashlib
 import logging
 import os
 import json
-from typing import List, Tuple
-from models.article import Article
+import shutil
+import threading
+import time
+import yaml
+import numpy as np
+from typing import Dict, List, Optional, Tuple, Union
+from models.article import Article, ArticleSummary
+from attribute_filter import AttributeIndex, filter_key
+from db_operator import PostgresOperator
 from embeddings import EmbeddingGenerator
+from embedding_pool import create_worker_pool
+from exact_vectors import ExactVectors, process_rss_bytes
+from lexical_index import LexicalIndex, fuse_rankings
+from lru_cache import TTLCache
+from rwlock import ReadWriteLock
+from wal import WriteAheadLog, OP_ADD, OP_DELETE
+from index_factory import (TOMBSTONE_ID, build_index, config_codec, effective_config,
+                           estimate_index_bytes, index_codec, index_ids, index_type,
+                           read_index_mmap, reconstruct_all, remove_ids, requires_training,
+                           search_index, snapshot_vectors, train_index)
+from index_shard import ShardedIndex
+from metrics import (INDEX_ADD_SECONDS, INDEX_SEARCH_SECONDS, LEXICAL_SEARCH_SECONDS,
+                     PERSISTENCE_SECONDS, RERANK_SECONDS)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Директория (рядом с индексом), в которой reindex.py готовит новый индекс
+REINDEX_DIR = "reindex"
+
+
+def normalize_query(query: str) -> str:
+    """Нормализация текста запроса для ключей кэша: регистр и пробелы."""
+    return " ".join(query.lower().split())
+
+
+def content_hash(text: str) -> int:
+    """64-битный хеш текста статьи для пропуска повторной индексации без изменений."""
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+
+def summarize(article: Article) -> ArticleSummary:
+    """Метаданные статьи без текста."""
+    return ArticleSummary(id=article.id, name=article.name, complexity=article.complexity,
+                          reading_time=article.reading_time, tags=article.tags)
+
+
+# Статья в выдаче поиска: целиком либо проекция без текста (fields=summary)
+SearchArticle = Union[Article, ArticleSummary]
+
+# Режимы поиска: ближайшие векторы, BM25, объединение обоих (RRF) и векторный
+# поиск среди кандидатов BM25
+SEARCH_MODES = ("vector", "lexical", "hybrid", "prefilter")
+
 
 class VectorStore:
-    def __init__(self, model_name: str = "distiluse-base-multilingual-cased-v1", index_path: str = "/app/faiss_data/faiss_index.bin", metadata_path: str = "/app/faiss_data/metadata.json"):
-        """Инициализация векторного хранилища FAISS и генератора эмбеддингов."""
-        self.embedding_generator = EmbeddingGenerator(model_name)
-        self.dimension = self.embedding_generator.model.get_sentence_embedding_dimension()
-        logger.info(
-            f"Initialized EmbeddingGenerator with model: {model_name}, dimension: {self.dimension}")
+    def __init__(self, model_name: str = "distiluse-base-multilingual-cased-v1", index_path: str = "/app/faiss_data/faiss_index.bin", metadata_path: str = "/app/faiss_data/metadata.json", config_path: Optional[str] = None, db: Optional[PostgresOperator] = None,
+                 lazy: bool = False):
+        """
+        Инициализация векторного хранилища FAISS и генератора эмбеддингов.
+
+        db — общий для сервиса PostgresOperator (пул соединений), через который
+        загружаются найденные статьи; если не передан, создаётся по config_path.
+
+        При lazy=True конструктор только готовит структуры, а тяжёлые этапы
+        запуска вызываются отдельно (например, из фоновых задач сервиса):
+        load_model — загрузка и прогрев модели, open_index — открытие
+        снапшота с отображением индекса в память (поиск уже возможен),
+        recover — чтение индекса в память и воспроизведение журнала (после
+        этого разрешены изменения). Размерность до загрузки модели берётся из
+        vector_store.dimension и проверяется в load_model.
+        """
+        config = {}
+        if config_path:
+            with open(config_path, "r") as f:
+                config = yaml.safe_load(f) or {}
+        self.config_path = config_path
+        self.db = db
 
-        self.index = faiss.IndexFlatL2(self.dimension)
-        logger.info("Initialized FAISS IndexFlatL2")
+        # Пул процессов для кодирования при индексации создаётся до загрузки
+        # модели в основном процессе (воркеры запускаются через fork)
+        backend_config = config.get("embedding_backend", {})
+        self.worker_pool = create_worker_pool(
+            model_name, config.get("ingest", {}), backend_config)
 
-        self.id_to_index = {}
-        self.index_to_id = {}
+        # Дисковый кэш эмбеддингов хранится рядом с индексом
+        cache_config = config.get("embedding_cache", {})
+        cache_dir = None
+        if cache_config.get("enabled", True):
+            cache_dir = cache_config.get("path") or os.path.join(
+                os.path.dirname(index_path), "embedding_cache")
+        self.embedding_generator = EmbeddingGenerator(
+            model_name, cache_dir=cache_dir, cache_max_entries=cache_config.get("max_entries", 200000),
+            worker_pool=self.worker_pool, lazy=True, backend_config=backend_config)
+        self.mmap_index = config.get("startup", {}).get("mmap_index", True)
+        # Модель загружена; индекс открыт для поиска; журнал воспроизведён и разрешены изменения
+        self.model_ready = threading.Event()
+        self.index_ready = threading.Event()
+        self.writable = threading.Event()
+        self.dimension = None
+        if lazy:
+            self.dimension = config.get("vector_store", {}).get("dimension", 512)
+        else:
+            self.load_model(warmup=False)
+
+        # Кэши поиска: эмбеддинги запросов и результаты, привязанные к версии индекса
+        search_cache_config = config.get("search_cache", {})
+        embeddings_cache_config = search_cache_config.get(
+            "query_embeddings", {})
+        results_cache_config = search_cache_config.get("results", {})
+        self.query_embedding_cache = TTLCache(embeddings_cache_config.get("capacity", 10000),
+                                              embeddings_cache_config.get("ttl_s", 3600))
+        self.search_result_cache = TTLCache(results_cache_config.get("capacity", 5000),
+                                            results_cache_config.get("ttl_s", 300))
+        # Метаданные статей (без текста), заполняются при индексации из Kafka:
+        # поиск с fields=summary обслуживается без обращения к PostgreSQL
+        article_cache_config = search_cache_config.get("article_metadata", {})
+        self.article_cache = TTLCache(article_cache_config.get("capacity", 100000),
+                                      article_cache_config.get("ttl_s", 86400))
+        # Списки ID статей по тегам, сложности и времени чтения для фильтров поиска
+        self.attributes = AttributeIndex(
+            search_cache_config.get("filter_selectors", {}).get("capacity", 256))
+        # Лексический индекс BM25 по тексту статей после preprocess_markdown
+        lexical_config = config.get("vector_store", {}).get("lexical", {})
+        self.lexical = None
+        if lexical_config.get("enabled", True):
+            self.lexical = LexicalIndex(lexical_config.get("k1", 1.2), lexical_config.get("b", 0.75))
+        self.hybrid_candidates = lexical_config.get("hybrid_candidates", 100)
+        self.rrf_k = lexical_config.get("rrf_k", 60)
+        self.prefilter_candidates = lexical_config.get("prefilter_candidates", 1000)
+        # Версия индекса увеличивается при каждом добавлении, удалении и перестройке
+        self.version = 0
+
+        # Хеши текстов проиндексированных статей: article_id -> content_hash
+        self.content_hashes: Dict[int, int] = {}
         self.index_path = index_path
         self.metadata_path = metadata_path
 
+        # Настройки индекса: тип, параметры обучения и перестройки
+        self.index_config = config.get("vector_store", {}).get(
+            "index", {"type": "flat"})
+        self.train_sample_size = self.index_config.get(
+            "train_sample_size", 50000)
+        self.min_train_size = self.index_config.get("min_train_size", 10000)
+        self.rebuild_growth_factor = self.index_config.get(
+            "rebuild_growth_factor", 2.0)
+
+        self.max_tombstone_ratio = self.index_config.get(
+            "max_tombstone_ratio", 0.2)
+        # Фильтры, которым подходит не больше статей, проверяются перебором их векторов
+        self.filter_exact_max_ids = self.index_config.get(
+            "filter_exact_max_ids", 2000)
+
+        # IVF-индексы и кодеки sq8/pq требуют обучения, до набора min_train_size векторов используется flat
+        initial_config = effective_config(self.index_config, self.dimension, 0)
+        if requires_training(initial_config):
+            self.index = build_index({"type": "flat"}, self.dimension)
+        else:
+            self.index = build_index(initial_config, self.dimension)
+        logger.info(f"Initialized FAISS index: {index_type(self.index)}")
+        # Шардированный режим: векторы живут в процессах-шардах (по хешу ID статьи),
+        # локальный self.index остаётся пустым и нужен только для миграции данных
+        shards_config = config.get("vector_store", {}).get("shards", {})
+        self.shards = None
+        if shards_config.get("count", 0) > 0:
+            # Бюджет памяти codec: auto делится между шардами
+            shard_index_config = dict(
+                self.index_config,
+                memory_budget_mb=self.index_config.get("memory_budget_mb", 0) / shards_config["count"])
+            self.shards = ShardedIndex(shards_config, shard_index_config, self.dimension,
+                                       os.path.dirname(index_path))
+
+        # Точные векторы float32 на диске (memory-mapped) для переранжирования
+        # кандидатов сжатого индекса и перестройки без потери точности
+        rerank_config = config.get("vector_store", {}).get("rerank", {})
+        self.rerank_factor = rerank_config.get("candidates_factor", 4)
+        self.rerank_max_candidates = rerank_config.get("max_candidates", 1000)
+        self.compact_dead_ratio = rerank_config.get("compact_dead_ratio", 0.3)
+        self.exact_vectors = None
+        if rerank_config.get("enabled", True) and config_codec(self.index_config) != "none":
+            self.exact_vectors = ExactVectors(os.path.join(
+                os.path.dirname(index_path), "exact_vectors"), self.dimension)
+        # Количество удалённых, но ещё не вычищенных из HNSW векторов
+        self.tombstones = 0
+
+        # _lock упорядочивает изменения хранилища (журнал, индекс, снапшоты);
+        # _index_lock не даёт менять индекс FAISS во время параллельного поиска
+        self._lock = threading.RLock()
+        self._index_lock = ReadWriteLock()
+        self._rebuild_thread = None
+        self._rebuild_log = None
+
+        # Настройки персистентности
+        persistence_config = config.get("persistence", {})
+        self.snapshot_every_n = persistence_config.get("snapshot_every_n", 1000)
+        self.snapshot_interval = persistence_config.get(
+            "snapshot_interval_s", 300)
+        self.wal_fsync = persistence_config.get("wal_fsync", True)
+        self.wal = None
+        self.snapshot_lsn = 0
+        self.trained_ntotal = 0
+        self.last_snapshot_time = time.monotonic()
+        # Время последнего неудачного снапшота: повтор не раньше snapshot_interval_s
+        self.snapshot_failed_at = None
+        # Файл индекса, открытого только для поиска (отображён в память)
+        self._mapped_index_file = None
+
+        # Снапшоты хранятся в отдельных директориях, актуальный указан в файле CURRENT
+        self.data_dir = os.path.dirname(self.index_path)
+        self.snapshots_dir = os.path.join(self.data_dir, "snapshots")
+        self.current_path = os.path.join(self.data_dir, "CURRENT")
+
         # Создать директорию, если не существует
-        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+
+        # LSN журнала на начало выгрузки reindex.py: пока он задан, снапшоты не
+        # очищают журнал, чтобы при подмене воспроизвести всё, что изменилось за
+        # время выгрузки (в том числе после перезапуска сервиса)
+        self.reindex_lsn_path = os.path.join(self.data_dir, "REINDEX_LSN")
+        self.reindex_lsn = None
+        if os.path.exists(self.reindex_lsn_path):
+            with open(self.reindex_lsn_path, "r") as f:
+                self.reindex_lsn = int(f.read().strip())
+
+        if not lazy:
+            self.open_index(mmap=False)
+            self.recover()
+
+    def load_model(self, warmup: bool = True):
+        """Загрузка модели SentenceTransformer (с прогревом) и проверка размерности индекса."""
+        self.embedding_generator.load(warmup=warmup)
+        dimension = self.embedding_generator.model.get_sentence_embedding_dimension()
+        if self.dimension is not None and dimension != self.dimension:
+            raise RuntimeError(
+                f"Model dimension {dimension} does not match index dimension {self.dimension}")
+        self.dimension = dimension
+        self.model_ready.set()
+        logger.info(
+            f"Initialized EmbeddingGenerator with model: {self.embedding_generator.model_name}, dimension: {self.dimension}")
 
-        # Загрузка индекса и метаданных, если они существуют
-        if os.path.exists(self.index_path):
+    def open_index(self, mmap: Optional[bool] = None):
+        """
+        Открытие последнего снапшота либо индекса в старом формате.
+
+        Args:
+            mmap (Optional[bool]): Отобразить индекс снапшота в память вместо
+                чтения целиком (по умолчанию startup.mmap_index). Такой индекс
+                доступен только для поиска до вызова recover.
+        """
+        mmap = self.mmap_index if mmap is None else mmap
+        snapshot_lsn = 0
+        if os.path.exists(self.current_path):
+            snapshot_lsn = self.load_snapshot(mmap=mmap)
+        elif os.path.exists(self.index_path) and os.path.exists(self.metadata_path):
             self.load(self.index_path)
-            logger.info(f"Loaded existing FAISS index from {self.index_path}")
-        if os.path.exists(self.metadata_path):
+            logger.info(
+                f"Loaded existing FAISS index from {self.index_path}")
             self.load_metadata(self.metadata_path)
             logger.info(f"Loaded metadata from {self.metadata_path}")
+            if self.exact_vectors is not None:
+                self.exact_vectors.upsert(*reconstruct_all(self.index))
+            self._distribute_local_index()
+        if self.shards is None and self.index.d != self.dimension:
+            raise RuntimeError(
+                f"Index dimension {self.index.d} does not match configured dimension {self.dimension}")
+        self.snapshot_lsn = snapshot_lsn
+        self.index_ready.set()
+
+    def recover(self, reconcile: bool = True):
+        """
+        Перевод индекса в рабочее состояние: чтение отображённого индекса в
+        память, воспроизведение журнала поверх снапшота, после чего разрешаются
+        изменения. Поиск во время восстановления продолжает работать по
+        отображённому в память индексу.
+
+        Args:
+            reconcile (bool): Сразу выполнить reconcile. Сервис вызывает его
+                отдельным этапом запуска, уже принимая изменения.
+        """
+        if self._mapped_index_file is not None:
+            index = faiss.read_index(self._mapped_index_file)
+            with self._index_lock.write():
+                self.index = index
+            self._mapped_index_file = None
+            logger.info(f"Loaded mapped FAISS index into memory: {index.ntotal} vectors")
+
+        # Воспроизведение журнала поверх снапшота
+        with self._lock:
+            self.wal = WriteAheadLog(os.path.join(
+                self.data_dir, "wal.log"), self.dimension, fsync=self.wal_fsync)
+            self.wal.last_lsn = max(self.wal.last_lsn, self.snapshot_lsn)
+            self.replay_wal(self.snapshot_lsn)
+            self.last_snapshot_time = time.monotonic()
+            self.writable.set()
+            # Данные в старом формате сразу переводим в снапшот
+            if not os.path.exists(self.current_path) and self.index_size():
+                self.snapshot()
+
+            self.trained_ntotal = self.index.ntotal
+        if reconcile:
+            self.reconcile()
+
+    def reconcile(self):
+        """Дозаполнение атрибутов и BM25 для статей из журнала и перестройка индекса при необходимости."""
+        self.sync_article_indexes()
+        self.maybe_rebuild()
+
+    def replay_wal(self, after_lsn: int) -> int:
+        """Применение к индексу записей журнала, не попавших в снапшот."""
+        records = 0
+        batch = {}
+
+        def flush():
+            if batch:
+                self._upsert(list(batch), [content for content, _ in batch.values()],
+                             np.vstack([vector for _, vector in batch.values()]))
+                batch.clear()
+
+        for _, op, article_id, content, vector in self.wal.replay(after_lsn):
+            records += 1
+            if op == OP_ADD:
+                batch.pop(article_id, None)
+                batch[article_id] = (content, vector)
+            elif op == OP_DELETE:
+                flush()
+                self._delete([article_id])
+        flush()
+        logger.info(f"Replayed {records} WAL records after LSN {after_lsn}")
+        return records
+
+    def _apply(self, index: faiss.Index, removed_ids: np.ndarray, added_ids: np.ndarray, embeddings: Optional[np.ndarray]) -> int:
+        """
+        Удаление и добавление векторов в конкретном индексе.
+
+        Returns:
+            int: Количество удалённых векторов.
+        """
+        removed = remove_ids(index, removed_ids)
+        if len(added_ids):
+            index.add_with_ids(embeddings, added_ids)
+        return removed
+
+    def _log_change(self, removed_ids: np.ndarray, added_ids: np.ndarray, embeddings: Optional[np.ndarray]):
+        """Запоминание изменения для переноса в индекс, который строится в фоне."""
+        if self._rebuild_log is not None:
+            self._rebuild_log.append((removed_ids, added_ids, embeddings))
+
+    def _upsert(self, article_ids: List[int], hashes: List[int], embeddings: np.ndarray):
+        """Замена векторов существующих статей и добавление новых."""
+        added_ids = np.asarray(article_ids, dtype=np.int64)
+        removed_ids = np.asarray(
+            [article_id for article_id in article_ids if article_id in self.content_hashes], dtype=np.int64)
+        if self.exact_vectors is not None:
+            self.exact_vectors.upsert(added_ids, embeddings)
+        started = time.perf_counter()
+        if self.shards is not None:
+            self.shards.upsert(added_ids, embeddings)
+        else:
+            with self._index_lock.write():
+                removed = self._apply(
+                    self.index, removed_ids, added_ids, embeddings)
+            self._log_change(removed_ids, added_ids, embeddings)
+            if index_type(self.index) == "hnsw":
+                self.tombstones += removed
+        INDEX_ADD_SECONDS.observe(time.perf_counter() - started)
+        for article_id, content in zip(article_ids, hashes):
+            self.content_hashes[article_id] = content
+        self.version += 1
+        logger.info(
+            f"Upserted {len(article_ids)} embeddings ({len(removed_ids)} replaced), index size: {self.index_size()}")
+
+    def _delete(self, article_ids: List[int]) -> int:
+        """Удаление векторов статей из индекса."""
+        removed_ids = np.asarray(
+            [article_id for article_id in article_ids if article_id in self.content_hashes], dtype=np.int64)
+        if not len(removed_ids):
+            return 0
+        if self.exact_vectors is not None:
+            self.exact_vectors.delete(removed_ids)
+        if self.shards is not None:
+            removed = self.shards.delete(removed_ids)
+        else:
+            with self._index_lock.write():
+                removed = self._apply(self.index, removed_ids,
+                                      np.zeros(0, dtype=np.int64), None)
+            self._log_change(removed_ids, np.zeros(0, dtype=np.int64), None)
+            if index_type(self.index) == "hnsw":
+                self.tombstones += removed
+        for article_id in removed_ids.tolist():
+            self.content_hashes.pop(article_id, None)
+        self.attributes.delete(removed_ids)
+        if self.lexical is not None:
+            self.lexical.delete(removed_ids)
+        self.version += 1
+        logger.info(f"Deleted {len(removed_ids)} articles from FAISS")
+        return len(removed_ids)
+
+    def index_size(self) -> int:
+        """Количество живых векторов в индексе (без удалённых, но ещё не вычищенных из HNSW)."""
+        if self.shards is not None:
+            return len(self.content_hashes)
+        return self.index.ntotal - self.tombstones
+
+    def article_ids(self) -> List[int]:
+        """ID всех проиндексированных статей."""
+        return list(self.content_hashes)
 
     def add_article(self, article: Article):
         """Создание эмбеддинга статьи и добавление в FAISS."""
+        self.add_articles([article])
+
+    def add_articles(self, articles: List[Article], batch_size: int = 32, raise_on_error: bool = False) -> int:
+        """
+        Пакетная индексация статей: один вызов encode, один index.add и одна запись в журнал.
+
+        Статья с уже проиндексированным ID заменяет свой прежний вектор; статьи,
+        текст которых не изменился (совпадает хеш), повторно не кодируются.
+
+        Args:
+            articles (List[Article]): Статьи для индексации.
+            batch_size (int): Размер батча для SentenceTransformer.encode.
+            raise_on_error (bool): Пробрасывать ошибку вместо возврата 0 (для
+                потребителя Kafka, который не должен фиксировать смещения).
+
+        Returns:
+            int: Количество добавленных или обновлённых статей.
+        """
+        if not articles:
+            return 0
         try:
-            embedding = self.embedding_generator.generate_embedding(
-                article.text)
-            embedding = embedding.reshape(1, -1)
-            logger.info(
-                f"Generated embedding for article {article.id}, shape: {embedding.shape}")
+            if not self.writable.is_set():
+                raise RuntimeError("Index is not recovered yet")
+            # Метаданные обновляются и для статей с неизменным текстом
+            for article in articles:
+                self.article_cache.put(article.id, summarize(article))
 
-            index = self.index.ntotal
-            self.index.add(embedding)
-            logger.info(f"Added embedding to FAISS at index {index}")
+            # При повторе ID в батче побеждает последняя версия статьи
+            changed = {}
+            for article in articles:
+                content = content_hash(article.text)
+                if self.content_hashes.get(article.id) != content:
+                    changed[article.id] = (article, content)
+                else:
+                    changed.pop(article.id, None)
+            skipped = len(articles) - len(changed)
+            if skipped:
+                logger.info(f"Skipped {skipped} unchanged articles")
+            if not changed:
+                self.attributes.update(articles)
+                return 0
 
-            self.id_to_index[article.id] = index
-            self.index_to_id[index] = article.id
+            article_ids = list(changed)
+            hashes = [content for _, content in changed.values()]
+            # Предобработанный текст нужен и модели, и лексическому индексу
+            processed_texts = [self.embedding_generator.preprocess_markdown(article.text)
+                               for article, _ in changed.values()]
+            embeddings = self.embedding_generator.generate_embeddings(
+                processed_texts, batch_size=batch_size, use_workers=True, preprocessed=True)
             logger.info(
-                f"Stored metadata for article {article.id} at FAISS index {index}")
-            logger.info(f"id_to_index: {self.id_to_index}")
+                f"Generated embeddings for {len(article_ids)} articles, shape: {embeddings.shape}")
+            added = self.add_embeddings(article_ids, hashes, embeddings)
+            # Атрибуты фильтров и BM25 — после векторов: поиск не выбирает статьи, которых ещё нет в индексе
+            self.attributes.update(articles)
+            if self.lexical is not None:
+                self.lexical.update(zip(article_ids, processed_texts))
+            return added
+
+        except Exception as e:
+            logger.error(
+                f"Error adding articles {[article.id for article in articles]} to FAISS: {e}")
+            if raise_on_error:
+                raise
+            return 0
+
+    def add_embeddings(self, article_ids: List[int], hashes: List[int], embeddings: np.ndarray) -> int:
+        """
+        Сохранение готовых эмбеддингов статей: журнал, индекс, снапшот по порогу.
+
+        Returns:
+            int: Количество добавленных или обновлённых статей.
+        """
+        if not self.writable.is_set():
+            raise RuntimeError("Index is not recovered yet")
+        with self._lock:
+            # Сначала фиксируем векторы в журнале, затем применяем к индексу
+            started = time.perf_counter()
+            self.wal.append([(OP_ADD, article_id, content, embedding)
+                            for article_id, content, embedding in zip(article_ids, hashes, embeddings)])
+            PERSISTENCE_SECONDS.labels("wal_append").observe(time.perf_counter() - started)
+            self._upsert(article_ids, hashes, embeddings)
 
-            # Сохраняем индекс и метаданные
-            self.save(self.index_path)
-            self.save_metadata(self.metadata_path)
+            self.maybe_snapshot()
+        self.maybe_rebuild()
+        return len(article_ids)
 
+    def delete_articles(self, article_ids: List[int], raise_on_error: bool = False) -> int:
+        """
+        Удаление статей из индекса.
+
+        Returns:
+            int: Количество удалённых статей.
+        """
+        try:
+            if not self.writable.is_set():
+                raise RuntimeError("Index is not recovered yet")
+            for article_id in article_ids:
+                self.article_cache.pop(article_id)
+            with self._lock:
+                present = [
+                    article_id for article_id in article_ids if article_id in self.content_hashes]
+                if not present:
+                    return 0
+                started = time.perf_counter()
+                self.wal.append([(OP_DELETE, article_id, 0, None)
+                                for article_id in present])
+                PERSISTENCE_SECONDS.labels("wal_append").observe(time.perf_counter() - started)
+                deleted = self._delete(present)
+                self.maybe_snapshot()
+            self.maybe_rebuild()
+            return deleted
         except Exception as e:
-            logger.error(f"Error adding article {article.id} to FAISS: {e}")
+            logger.error(f"Error deleting articles {article_ids} from FAISS: {e}")
+            if raise_on_error:
+                raise
+            return 0
+
+    def search(self, query: str, k: int = 5, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+               fields: str = "full", filters: Optional[dict] = None,
+               mode: str = "vector") -> List[Tuple[SearchArticle, float]]:
+        """
+        Поиск статей, ближайших к запросу.
+
+        Args:
+            query (str): Текст запроса.
+            k (int): Количество возвращаемых статей.
+            nprobe (Optional[int]): Количество просматриваемых кластеров IVF для этого запроса.
+            ef_search (Optional[int]): Размер очереди поиска HNSW для этого запроса.
+            fields (str): "full" — статьи целиком, "summary" — без текста.
+            filters (Optional[dict]): Фильтр по атрибутам (tags, complexity, max_reading_time).
+            mode (str): Режим поиска из SEARCH_MODES (см. find_neighbors).
+        """
+        return self.search_batch([(query, k)], nprobe=nprobe, ef_search=ef_search, fields=fields,
+                                 filters=filters, mode=mode)[0]
+
+    def search_batch(self, queries: List[Tuple[str, int]], nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                     fields: str = "full", filters: Optional[dict] = None,
+                     mode: str = "vector") -> List[List[Tuple[SearchArticle, float]]]:
+        """
+        Поиск по нескольким запросам: один model.encode, один матричный index.search
+        и одна выборка статей из PostgreSQL для всех найденных ID.
+
+        Args:
+            queries (List[Tuple[str, int]]): Пары (текст запроса, k).
+            nprobe (Optional[int]): Количество просматриваемых кластеров IVF.
+            ef_search (Optional[int]): Размер очереди поиска HNSW.
+            fields (str): "full" — статьи целиком, "summary" — без текста.
+            filters (Optional[dict]): Фильтр по атрибутам, общий для всех запросов.
+            mode (str): Режим поиска из SEARCH_MODES (см. find_neighbors).
 
-    def search(self, query: str, k: int = 5) -> List[Tuple[Article, float]]:
+        Returns:
+            List[List[Tuple[SearchArticle, float]]]: Результаты в порядке запросов.
+        """
         try:
-            query_embedding = self.embedding_generator.generate_embedding(
-                query)
-            query_embedding = query_embedding.reshape(1, -1)
-            logger.info(
-                f"Generated query embedding, shape: {query_embedding.shape}")
-
-            distances, indices = self.index.search(query_embedding, k)
-            logger.info(f"Found {len(indices[0])} nearest neighbors for query")
-
-            from db_operator import PostgresOperator
-            db = PostgresOperator("config/config_sim.yaml")
-            results = []
-            for idx, distance in zip(indices[0], distances[0]):
-                article_id = self.index_to_id.get(idx)
-                if article_id is not None:
-                    article = db.get_article_by_id(article_id)
-                    if article:
-                        results.append((article, distance))
-                        logger.info(
-                            f"Found relevant article {article_id} with distance {distance}")
-                else:
-                    logger.warning(
-                        f"No article ID found for FAISS index {idx}")
-            db.close()
-            return results  # Исправлено: возвращать results, а не indices
+            version = self.search_version()
+            results = self.cached_results(
+                queries, nprobe, ef_search, version, fields, filters, mode)
+            pending = [i for i, found in enumerate(results) if found is None]
+            if not pending:
+                return results
+            pending_queries = [queries[i] for i in pending]
+            hits, partial = self.find_neighbors(
+                pending_queries, nprobe, ef_search, filters, mode)
+            found = self.cached_articles(hits, fields)
+            if found is None:
+                found = self.load_articles(hits, fields)
+            # Неполные ответы шардов не кэшируются
+            if not partial:
+                self.cache_results(pending_queries, nprobe,
+                                   ef_search, version, found, fields, filters, mode)
+            for i, articles in zip(pending, found):
+                results[i] = articles
+            return results
 
         except Exception as e:
-            logger.error(f"Error searching for query '{query}': {e}")
-            return []
+            logger.error(
+                f"Error searching for queries {[query for query, _ in queries]}: {e}")
+            return [[] for _ in queries]
+
+    def search_version(self) -> Tuple[int, int]:
+        """Версия данных поиска для кэша результатов: версии индекса и атрибутов фильтров."""
+        return self.version, self.attributes.version
+
+    def cached_results(self, queries: List[Tuple[str, int]], nprobe: Optional[int], ef_search: Optional[int],
+                       version: Tuple[int, int], fields: str = "full", filters: Optional[dict] = None,
+                       mode: str = "vector") -> List[Optional[List[Tuple[SearchArticle, float]]]]:
+        """Результаты из кэша для текущей версии (search_version), None для промахов."""
+        results = []
+        key = filter_key(filters)
+        for query, k in queries:
+            cached = self.search_result_cache.get(
+                (normalize_query(query), k, nprobe, ef_search, fields, key, mode))
+            results.append(cached[1] if cached is not None and cached[0] == version else None)
+        logger.info(
+            f"Search batch: {len(queries)} queries, {sum(found is not None for found in results)} from result cache")
+        return results
+
+    def cache_results(self, queries: List[Tuple[str, int]], nprobe: Optional[int], ef_search: Optional[int],
+                      version: Tuple[int, int], results: List[List[Tuple[SearchArticle, float]]],
+                      fields: str = "full", filters: Optional[dict] = None, mode: str = "vector"):
+        """Сохранение результатов поиска, полученных для версии version."""
+        key = filter_key(filters)
+        for (query, k), found in zip(queries, results):
+            self.search_result_cache.put(
+                (normalize_query(query), k, nprobe, ef_search, fields, key, mode), (version, found))
+
+    def find_neighbors(self, queries: List[Tuple[str, int]], nprobe: Optional[int] = None,
+                       ef_search: Optional[int] = None, filters: Optional[dict] = None,
+                       mode: str = "vector") -> Tuple[List[List[Tuple[int, float]]], bool]:
+        """
+        Кодирование запросов и поиск ближайших векторов (CPU-часть поиска).
+
+        Фильтр по атрибутам проверяется внутри обхода индекса (селектор ID
+        FAISS), поэтому каждый запрос получает k подходящих статей без
+        повторных поисков с увеличенным k.
+
+        Режимы: vector — ближайшие векторы; lexical — BM25 без кодирования
+        запроса; hybrid — объединение методом RRF векторного и лексического
+        top-N (hybrid_candidates); prefilter — векторный поиск только среди
+        top-N статей BM25 (prefilter_candidates) вместо обхода всего индекса,
+        запросы без известных индексу терминов ищутся обычным образом.
+
+        Returns:
+            Tuple[List[List[Tuple[int, float]]], bool]: Пары (ID статьи, расстояние)
+                для каждого запроса (в режимах lexical и hybrid вместо расстояния —
+                оценка, больше — лучше) и признак неполного ответа (не ответили шарды).
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode '{mode}', expected one of {SEARCH_MODES}")
+        if mode != "vector" and self.lexical is None:
+            raise ValueError(f"Search mode '{mode}' requires vector_store.lexical.enabled")
+        if not queries:
+            return [], False
+        allowed_ids, sel = self.attributes.selector(filters)
+        if allowed_ids is not None and not len(allowed_ids):
+            logger.info(f"No articles match filter {filter_key(filters)}")
+            return [[] for _ in queries], False
+        if mode == "lexical":
+            return [self._lexical_hits(query, k, allowed_ids) for query, k in queries], False
+
+        query_embeddings = self._query_embeddings(
+            [query for query, _ in queries], [normalize_query(query) for query, _ in queries])
+        max_k = max(k for _, k in queries)
+        if mode == "prefilter":
+            hits, partial = [], False
+            for i, (query, k) in enumerate(queries):
+                candidates = self._lexical_hits(query, self.prefilter_candidates, allowed_ids)
+                if candidates:
+                    candidate_ids = np.sort(np.asarray([article_id for article_id, _ in candidates], dtype=np.int64))
+                    distances, indices, missed = self._vector_search(
+                        query_embeddings[i:i + 1], k, nprobe, ef_search, candidate_ids, None)
+                else:
+                    distances, indices, missed = self._vector_search(
+                        query_embeddings[i:i + 1], k, nprobe, ef_search, allowed_ids, sel)
+                hits.append(self._rows(indices, distances, [k])[0])
+                partial = partial or missed
+        elif mode == "hybrid":
+            depth = max(max_k, self.hybrid_candidates)
+            distances, indices, partial = self._vector_search(
+                query_embeddings, depth, nprobe, ef_search, allowed_ids, sel)
+            vector_hits = self._rows(indices, distances, [depth] * len(queries))
+            hits = [fuse_rankings([[article_id for article_id, _ in row],
+                                   [article_id for article_id, _ in self._lexical_hits(query, depth, allowed_ids)]],
+                                  k, self.rrf_k)
+                    for (query, k), row in zip(queries, vector_hits)]
+        else:
+            distances, indices, partial = self._vector_search(
+                query_embeddings, max_k, nprobe, ef_search, allowed_ids, sel)
+            hits = self._rows(indices, distances, [k for _, k in queries])
+        logger.info(
+            f"Found nearest neighbors for {len(queries)} queries, k={max_k}, mode={mode}"
+            + (f", filtered to {len(allowed_ids)} articles" if allowed_ids is not None else "")
+            + (" (partial)" if partial else ""))
+        return hits, partial
+
+    def _vector_search(self, query_embeddings: np.ndarray, k: int, nprobe: Optional[int], ef_search: Optional[int],
+                       allowed_ids: Optional[np.ndarray],
+                       sel: Optional[faiss.IDSelector]) -> Tuple[np.ndarray, np.ndarray, bool]:
+        """Поиск k ближайших в индексе или шардах с переранжированием по точным векторам."""
+        # Из сжатого индекса берётся больше кандидатов, порядок уточняется по точным векторам
+        rerank = self.exact_vectors is not None and (
+            self.shards is not None or index_codec(self.index) != "none")
+        search_k = max(k, min(k * self.rerank_factor,
+                              self.rerank_max_candidates)) if rerank else k
+
+        partial = False
+        started = time.perf_counter()
+        if self.shards is not None:
+            distances, indices, partial = self.shards.search(
+                query_embeddings, search_k, nprobe, ef_search, allowed_ids)
+        else:
+            with self._index_lock.read():
+                distances, indices = search_index(self.index, query_embeddings, search_k,
+                                                  nprobe or self.index_config.get("nprobe"),
+                                                  ef_search or self.index_config.get("ef_search"),
+                                                  self.tombstones > 0, allowed_ids, sel,
+                                                  self.filter_exact_max_ids)
+        INDEX_SEARCH_SECONDS.observe(time.perf_counter() - started)
+        if rerank:
+            started = time.perf_counter()
+            distances, indices = self.exact_vectors.rerank(
+                query_embeddings, distances, indices, k)
+            RERANK_SECONDS.observe(time.perf_counter() - started)
+        return distances, indices, partial
+
+    @staticmethod
+    def _rows(indices: np.ndarray, distances: np.ndarray, ks: List[int]) -> List[List[Tuple[int, float]]]:
+        return [[(int(article_id), float(distance))
+                 for article_id, distance in zip(row_ids[:k], row_distances[:k]) if article_id >= 0]
+                for k, row_ids, row_distances in zip(ks, indices, distances)]
+
+    def _lexical_hits(self, query: str, k: int, allowed_ids: Optional[np.ndarray]) -> List[Tuple[int, float]]:
+        """Top-k статей по BM25: пары (ID статьи, оценка)."""
+        started = time.perf_counter()
+        article_ids, scores = self.lexical.search(
+            self.embedding_generator.preprocess_markdown(query), k, allowed_ids)
+        LEXICAL_SEARCH_SECONDS.observe(time.perf_counter() - started)
+        return list(zip(article_ids.tolist(), scores.tolist()))
+
+    def cached_articles(self, hits: List[List[Tuple[int, float]]], fields: str = "full") -> Optional[List[List[Tuple[SearchArticle, float]]]]:
+        """
+        Результаты поиска из кэша метаданных статей без обращения к PostgreSQL.
+
+        Returns:
+            Optional[...]: None, если нужен полный текст или хотя бы одной статьи нет в кэше.
+        """
+        if fields != "summary":
+            return None
+        articles = {}
+        for row in hits:
+            for article_id, _ in row:
+                if article_id in articles:
+                    continue
+                summary = self.article_cache.get(article_id)
+                if summary is None:
+                    return None
+                articles[article_id] = summary
+        return [[(articles[article_id], distance) for article_id, distance in row] for row in hits]
+
+    def load_articles(self, hits: List[List[Tuple[int, float]]], fields: str = "full") -> List[List[Tuple[SearchArticle, float]]]:
+        """
+        Загрузка статей для найденных ID (I/O-часть поиска), каждая статья запрашивается один раз.
+
+        Для fields=summary из PostgreSQL читаются только отсутствующие в кэше
+        метаданные, колонка text не выбирается.
+        """
+        hit_ids = list(dict.fromkeys(
+            article_id for row in hits for article_id, _ in row))
+        if self.db is None:
+            self.db = PostgresOperator(self.config_path or "config/config_sim.yaml")
+        if fields == "summary":
+            articles = {}
+            for article_id in hit_ids:
+                summary = self.article_cache.get(article_id)
+                if summary is not None:
+                    articles[article_id] = summary
+            missing = [
+                article_id for article_id in hit_ids if article_id not in articles]
+            for summary in self.db.get_article_summaries_by_ids(missing):
+                self.article_cache.put(summary.id, summary)
+                articles[summary.id] = summary
+        else:
+            articles = {}
+            for article in self.db.get_articles_by_ids(hit_ids):
+                self.article_cache.put(article.id, summarize(article))
+                articles[article.id] = article
+        return [[(articles[article_id], distance) for article_id, distance in row if article_id in articles]
+                for row in hits]
+
+    def _query_embeddings(self, queries: List[str], normalized: List[str]) -> np.ndarray:
+        """Эмбеддинги запросов: из кэша либо одним батчем model.encode для промахов."""
+        embeddings = np.zeros((len(queries), self.dimension), dtype=np.float32)
+        missing = {}
+        for i, norm in enumerate(normalized):
+            cached = self.query_embedding_cache.get(norm)
+            if cached is not None:
+                embeddings[i] = cached
+            else:
+                missing.setdefault(norm, []).append(i)
+        if missing:
+            texts = [queries[positions[0]] for positions in missing.values()]
+            encoded = self.embedding_generator.generate_embeddings(
+                texts, use_cache=False)
+            for norm, positions, embedding in zip(missing, missing.values(), encoded):
+                embeddings[positions] = embedding
+                self.query_embedding_cache.put(norm, embedding)
+        logger.info(
+            f"Generated {len(missing)} query embeddings, {len(queries) - sum(map(len, missing.values()))} from cache")
+        return embeddings
+
+    def cache_stats(self) -> dict:
+        """Статистика кэшей поиска."""
+        return {
+            "query_embeddings": self.query_embedding_cache.stats(),
+            "search_results": {**self.search_result_cache.stats(), "index_version": self.version},
+            "article_metadata": self.article_cache.stats(),
+            "filter_selectors": self.attributes.selector_cache.stats(),
+        }
+
+    def memory_stats(self) -> dict:
+        """Оценка памяти индекса, бюджет codec: auto и резидентная память точных векторов и процесса."""
+        # Удалённые из HNSW векторы занимают память до перестройки
+        ntotal = self.index.ntotal if self.shards is None else self.index_size()
+        if self.shards is None:
+            config = dict(self.index_config, type=index_type(self.index),
+                          codec=index_codec(self.index))
+        else:
+            config = effective_config(self.index_config, self.dimension, ntotal)
+        stats = {
+            "index_codec": config_codec(config),
+            "index_estimated_bytes": estimate_index_bytes(config, self.dimension, ntotal),
+            "memory_budget_bytes": int(self.index_config.get("memory_budget_mb", 0) * 1024 * 1024),
+            "process_rss_bytes": process_rss_bytes(),
+        }
+        if self.exact_vectors is not None:
+            stats["exact_vectors"] = self.exact_vectors.stats()
+        return stats
 
     def save(self, path: str = None):
-        """Сохранение FAISS индекса на диск."""
-        try:
-            if path is None:
-                path = self.index_path
-            faiss.write_index(self.index, path)
-            logger.info(f"Saved FAISS index to {path}")
-        except Exception as e:
-            logger.error(f"Error saving FAISS index: {e}")
+        """
+        Сохранение FAISS индекса на диск.
+
+        Ошибка записи пробрасывается: снапшот без индекса не должен заменить
+        предыдущий и очистить журнал.
+        """
+        if path is None:
+            path = self.index_path
+        faiss.write_index(self.index, path)
+        logger.info(f"Saved FAISS index to {path}")
 
     def load(self, path: str = None):
-        """Загрузка FAISS индекса с диска."""
+        """
+        Загрузка FAISS индекса с диска.
+
+        Ошибка чтения пробрасывается: сервис не должен работать с пустым
+        индексом при заполненных хешах статей, которые пропускают повторную
+        индексацию.
+        """
+        if path is None:
+            path = self.index_path
+        self.index = faiss.read_index(path)
+        logger.info(f"Loaded FAISS index from {path}")
+
+    def save_metadata(self, path: str = None, lsn: int = 0):
+        """Сохранение метаданных: LSN снапшота в JSON и хешей статей в компактных массивах."""
+        if path is None:
+            path = self.metadata_path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({'lsn': lsn}, f)
+        np.save(os.path.join(os.path.dirname(path), "hashes.npy"),
+                np.array(list(self.content_hashes.items()), dtype=np.int64).reshape(-1, 2))
+        logger.info(f"Saved metadata to {path}")
+
+    def load_metadata(self, path: str = None) -> int:
+        """Загрузка метаданных (ошибка чтения пробрасывается). Возвращает LSN снапшота."""
+        if path is None:
+            path = self.metadata_path
+        with open(path, 'r') as f:
+            data = json.load(f)
+        if 'index_to_id' in data:
+            # Старый формат: позиции FAISS сопоставлены с ID статей в JSON
+            self._migrate_positional(
+                {int(k): int(v) for k, v in data['index_to_id'].items()})
+        else:
+            hashes = np.load(os.path.join(
+                os.path.dirname(path), "hashes.npy"))
+            self.content_hashes = dict(zip(hashes[:, 0].tolist(), hashes[:, 1].tolist()))
+            self.tombstones = int(np.count_nonzero(
+                index_ids(self.index) == TOMBSTONE_ID))
+        logger.info(f"Loaded metadata from {path}")
+        return data.get('lsn', 0)
+
+    def _migrate_positional(self, index_to_id: Dict[int, int]):
+        """
+        Перевод индекса старого формата (позиции + JSON-словари) в индекс с ID статей.
+
+        Дубликаты одной статьи схлопываются до последнего добавленного вектора.
+        Хеши содержимого неизвестны, поэтому такие статьи будут переиндексированы
+        при следующем поступлении.
+        """
+        positions, vectors = reconstruct_all(self.index)
+        latest = {}
+        for position in positions.tolist():
+            if position in index_to_id:
+                latest[index_to_id[position]] = position
+        self.index = build_index({"type": "flat"}, self.dimension)
+        if latest:
+            self.index.add_with_ids(vectors[list(latest.values())],
+                                    np.asarray(list(latest), dtype=np.int64))
+        self.content_hashes = {article_id: 0 for article_id in latest}
+        logger.info(
+            f"Migrated positional index: {len(positions)} vectors -> {len(latest)} articles")
+
+    def maybe_rebuild(self):
+        """Запуск фоновой перестройки, если тип индекса отличается от настроенного или IVF устарел."""
+        if self.shards is not None:
+            # Шарды перестраивают свои индексы сами
+            return
+        ntotal = self.index.ntotal
+        if ntotal == 0:
+            return
+        config = effective_config(self.index_config, self.dimension, ntotal)
+        if requires_training(config):
+            if ntotal < self.min_train_size:
+                return
+            grown = ntotal >= self.trained_ntotal * self.rebuild_growth_factor
+        else:
+            grown = False
+        # Удалённые из HNSW векторы вычищаются только перестройкой
+        compact = self.tombstones > ntotal * self.max_tombstone_ratio
+        # Смена типа индекса или кодека (в том числе выбранного по бюджету памяти)
+        index = self.index
+        changed = index_type(index) != config.get("type", "flat") or \
+            index_codec(index) != config_codec(config)
+        if changed or grown or compact:
+            self.rebuild_index()
+
+    def rebuild_index(self) -> bool:
+        """
+        Запуск фоновой перестройки индекса.
+
+        Returns:
+            bool: False, если перестройка уже выполняется.
+        """
+        if not self.writable.is_set():
+            return False
+        if self.shards is not None:
+            return self.shards.rebuild()
+        with self._lock:
+            if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+                return False
+            self._rebuild_thread = threading.Thread(
+                target=self._rebuild, name="faiss-rebuild", daemon=True)
+            self._rebuild_thread.start()
+            return True
+
+    def wait_rebuild(self):
+        """Ожидание завершения фоновой перестройки индекса, если она выполняется."""
+        thread = self._rebuild_thread
+        if thread is not None:
+            thread.join()
+
+    def _rebuild(self):
+        """
+        Перестройка индекса: обучение на выборке сохранённых векторов, заполнение
+        нового индекса и атомарная замена ссылки self.index.
+
+        Обучение и заполнение идут без блокировки, поэтому поиск и добавление
+        продолжают работать со старым индексом; векторы, добавленные за это время,
+        накапливаются в _rebuild_log и переносятся в новый индекс перед заменой.
+        """
         try:
-            if path is None:
-                path = self.index_path
-            self.index = faiss.read_index(path)
-            logger.info(f"Loaded FAISS index from {path}")
+            started = time.perf_counter()
+            with self._lock:
+                # Точные векторы с диска, если индекс хранит их в сжатом виде
+                if self.exact_vectors is not None:
+                    article_ids, vectors = self.exact_vectors.all()
+                else:
+                    article_ids, vectors = reconstruct_all(self.index)
+                self._rebuild_log = []
+
+            # Пока корпус мал для обучения IVF и кодеков sq8/pq, перестраиваем в flat
+            config = effective_config(self.index_config, self.dimension, len(vectors))
+            if requires_training(config) and len(vectors) < self.min_train_size:
+                config = {"type": "flat"}
+            new_index = build_index(config, self.dimension, len(vectors))
+            train_index(new_index, vectors, self.train_sample_size)
+            new_index.add_with_ids(vectors, article_ids)
+
+            with self._lock:
+                for removed_ids, added_ids, embeddings in self._rebuild_log:
+                    self._apply(new_index, removed_ids, added_ids, embeddings)
+                with self._index_lock.write():
+                    self.index = new_index
+                self.tombstones = int(np.count_nonzero(
+                    index_ids(new_index) == TOMBSTONE_ID))
+                self.trained_ntotal = new_index.ntotal
+                self.version += 1
+                self._rebuild_log = None
+                self.snapshot()
+            logger.info(
+                f"Rebuilt {index_type(new_index)} index with {new_index.ntotal} vectors "
+                f"in {time.perf_counter() - started:.1f}s")
         except Exception as e:
-            logger.error(f"Error loading FAISS index: {e}")
+            self._rebuild_log = None
+            logger.error(f"Error rebuilding FAISS index: {e}")
+
+    def maybe_snapshot(self):
+        """
+        Сохранение снапшота по количеству новых записей или по интервалу времени.
+
+        Неудачный снапшот не прерывает запись: изменения остаются в журнале,
+        следующая попытка — не раньше чем через snapshot_interval_s.
+        """
+        pending = self.wal.last_lsn - self.snapshot_lsn
+        if pending == 0:
+            return
+        now = time.monotonic()
+        if self.snapshot_failed_at is not None and now - self.snapshot_failed_at < self.snapshot_interval:
+            return
+        interval_passed = now - self.last_snapshot_time >= self.snapshot_interval
+        if pending >= self.snapshot_every_n or interval_passed:
+            try:
+                self.snapshot()
+            except Exception:
+                self.snapshot_failed_at = now
+
+    def snapshot(self):
+        """
+        Сохранение компактного снапшота индекса и метаданных.
 
-    def save_metadata(self, path: str = None):
-        """Сохранение метаданных (id_to_index и index_to_id) в JSON."""
+        Снапшот записывается во временную директорию, которая затем атомарно
+        переименовывается; указатель CURRENT обновляется через временный файл
+        и os.replace. После этого журнал очищается, старые снапшоты удаляются.
+
+        Директория переименовывается, CURRENT обновляется и журнал очищается
+        только после того, как все файлы записаны и проверены; при любой ошибке
+        временная директория удаляется, а исключение пробрасывается — прежний
+        снапшот и журнал остаются нетронутыми.
+        """
+        with self._lock:
+            self._snapshot()
+
+    def _snapshot(self):
+        started = time.perf_counter()
+        lsn = self.wal.last_lsn
+        name = f"{lsn:020d}"
+        final_dir = os.path.join(self.snapshots_dir, name)
+        tmp_dir = final_dir + ".tmp"
         try:
-            if path is None:
-                path = self.metadata_path
-            os.makedirs(os.path.dirname(path), exist_ok=True)
-            with open(path, 'w') as f:
-                json.dump({
-                    'id_to_index': {str(k): v for k, v in self.id_to_index.items()},
-                    'index_to_id': {str(k): str(v) for k, v in self.index_to_id.items()}
-                }, f)
-            logger.info(f"Saved metadata to {path}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+
+            if self.shards is not None:
+                self.shards.save(tmp_dir)
+            else:
+                self.save(os.path.join(tmp_dir, "index.bin"))
+            if self.exact_vectors is not None:
+                if self.exact_vectors.dead_ratio() > self.compact_dead_ratio:
+                    self.exact_vectors.compact()
+                self.exact_vectors.save(tmp_dir)
+            self.attributes.save(tmp_dir)
+            if self.lexical is not None:
+                self.lexical.save(tmp_dir)
+            self.save_metadata(os.path.join(tmp_dir, "metadata.json"), lsn=lsn)
+            for file_name in os.listdir(tmp_dir):
+                fsync_path(os.path.join(tmp_dir, file_name))
+            fsync_path(tmp_dir)
+            self._verify_snapshot(tmp_dir, lsn)
+
+            shutil.rmtree(final_dir, ignore_errors=True)
+            os.rename(tmp_dir, final_dir)
+            fsync_path(self.snapshots_dir)
+
+            current_tmp = self.current_path + ".tmp"
+            with open(current_tmp, "w") as f:
+                f.write(name)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(current_tmp, self.current_path)
+            fsync_path(self.data_dir)
+
+            if self.reindex_lsn is None:
+                self.wal.reset()
+            self.snapshot_lsn = lsn
+            self.last_snapshot_time = time.monotonic()
+            self.snapshot_failed_at = None
+            if self.exact_vectors is not None:
+                self.exact_vectors.release_old()
+
+            for old_name in os.listdir(self.snapshots_dir):
+                if old_name != name:
+                    shutil.rmtree(os.path.join(
+                        self.snapshots_dir, old_name), ignore_errors=True)
+            PERSISTENCE_SECONDS.labels("snapshot").observe(time.perf_counter() - started)
+            logger.info(
+                f"Saved snapshot {name} with {self.index_size()} vectors")
         except Exception as e:
-            logger.error(f"Error saving metadata: {e}")
+            if os.path.exists(tmp_dir):
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            logger.error(f"Error saving snapshot {name}, keeping WAL since LSN {self.snapshot_lsn}: {e}")
+            raise
+
+    def _verify_snapshot(self, snapshot_dir: str, lsn: int):
+        """Проверка записанного снапшота перед тем, как он заменит текущий."""
+        with open(os.path.join(snapshot_dir, "metadata.json"), "r") as f:
+            if json.load(f).get("lsn") != lsn:
+                raise RuntimeError(f"Snapshot metadata in {snapshot_dir} has wrong LSN")
+        hashes = np.load(os.path.join(snapshot_dir, "hashes.npy"), mmap_mode="r")
+        if len(hashes) != len(self.content_hashes):
+            raise RuntimeError(
+                f"Snapshot {snapshot_dir} has {len(hashes)} article hashes, expected {len(self.content_hashes)}")
+        if self.shards is not None:
+            for i in range(self.shards.count):
+                if not os.path.getsize(os.path.join(snapshot_dir, f"shard_{i}.bin")):
+                    raise RuntimeError(f"Snapshot shard file {i} in {snapshot_dir} is empty")
+            return
+        # Заголовок и векторы индекса читаются отображением в память, без копии
+        ntotal = read_index_mmap(os.path.join(snapshot_dir, "index.bin")).ntotal
+        if ntotal != self.index.ntotal:
+            raise RuntimeError(
+                f"Snapshot index in {snapshot_dir} has {ntotal} vectors, expected {self.index.ntotal}")
+
+    def load_snapshot(self, mmap: bool = False) -> int:
+        """
+        Загрузка снапшота, на который указывает CURRENT.
+
+        При mmap=True индекс без шардов отображается в память и до recover
+        используется только для поиска.
+
+        Returns:
+            int: LSN, по который включительно снапшот содержит данные.
+        """
+        with open(self.current_path, "r") as f:
+            name = f.read().strip()
+        snapshot_dir = os.path.join(self.snapshots_dir, name)
+        index_file = os.path.join(snapshot_dir, "index.bin")
+        if self.exact_vectors is not None and not self.exact_vectors.load(snapshot_dir):
+            # Снапшот записан без точных векторов: берём их из индекса (точные для flat без сжатия)
+            self.exact_vectors.upsert(*snapshot_vectors(snapshot_dir))
+        if self.shards is not None and all(
+                os.path.exists(os.path.join(snapshot_dir, f"shard_{i}.bin")) for i in range(self.shards.count)) \
+                and not os.path.exists(os.path.join(snapshot_dir, f"shard_{self.shards.count}.bin")):
+            self.shards.load(snapshot_dir)
+        elif self.shards is None and os.path.exists(index_file) and mmap:
+            self.index = read_index_mmap(index_file)
+            self._mapped_index_file = index_file
+            logger.info(f"Mapped FAISS index from {index_file}")
+        elif self.shards is None and os.path.exists(index_file):
+            self.load(index_file)
+        else:
+            # Снапшот записан с другим количеством шардов: перераспределяем векторы
+            if self.exact_vectors is not None:
+                article_ids, vectors = self.exact_vectors.all()
+            else:
+                article_ids, vectors = snapshot_vectors(snapshot_dir)
+            logger.info(
+                f"Redistributing {len(article_ids)} vectors from snapshot {name}")
+            if self.shards is not None:
+                self.shards.clear()
+            self.index = build_index({"type": "flat"}, self.dimension)
+            if len(article_ids):
+                self.index.add_with_ids(vectors, article_ids)
+        lsn = self.load_metadata(os.path.join(snapshot_dir, "metadata.json"))
+        # Атрибуты и тексты статей, которых нет в снапшоте, загружаются из PostgreSQL в recover
+        self.attributes.load(snapshot_dir)
+        if self.lexical is not None:
+            self.lexical.load(snapshot_dir)
+        self._distribute_local_index()
+        logger.info(
+            f"Loaded snapshot {name} with {self.index_size()} vectors")
+        return lsn
+
+    def begin_reindex(self) -> int:
+        """
+        Отметка начала выгрузки reindex.py: журнал с этого места хранится до
+        подмены индекса (adopt_reindex) или отмены (cancel_reindex).
+
+        Returns:
+            int: LSN журнала на начало выгрузки.
+        """
+        if not self.writable.is_set():
+            raise RuntimeError("Index is not recovered yet")
+        with self._lock:
+            lsn = self.wal.last_lsn
+            tmp_path = self.reindex_lsn_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                f.write(str(lsn))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.reindex_lsn_path)
+            fsync_path(self.data_dir)
+            self.reindex_lsn = lsn
+        logger.info(f"Reindex started at WAL LSN {lsn}, WAL is kept until the index is adopted")
+        return lsn
+
+    def cancel_reindex(self):
+        """Отмена выгрузки: журнал снова очищается снапшотами."""
+        with self._lock:
+            if os.path.exists(self.reindex_lsn_path):
+                os.remove(self.reindex_lsn_path)
+            self.reindex_lsn = None
+        logger.info("Reindex cancelled")
 
-    def load_metadata(self, path: str = None):
-        """Загрузка метаданных из JSON."""
+    def adopt_reindex(self, staging_dir: str) -> dict:
+        """
+        Замена индекса построенным заново из PostgreSQL (reindex.py).
+
+        Индекс, хеши статей и точные векторы читаются из staging_dir без
+        блокировки; подмена, воспроизведение поверх них журнала с LSN начала
+        выгрузки (begin_reindex: изменения, которые выгрузка могла пропустить
+        или прочитать в прежней версии) и запись нового снапшота выполняются
+        под _lock, поэтому изменения из Kafka на это время ждут. Без отметки
+        начала выгрузки подмена отклоняется: журнал мог быть очищен снапшотом
+        и изменения за время выгрузки потерялись бы. В шардированном режиме
+        шарды очищаются и заполняются заново, выдача в это время может быть
+        неполной.
+
+        Returns:
+            dict: Количество статей в новом индексе и воспроизведённых записей журнала.
+        """
+        if not self.writable.is_set():
+            raise RuntimeError("Index is not recovered yet")
+        if self.reindex_lsn is None:
+            raise RuntimeError(
+                "Reindex start was not registered (POST /admin/reindex), changes made during the scan "
+                "could be lost; rerun reindex.py with --service-url")
+        # metadata.json записывается последним, когда индекс подготовки построен
+        if not os.path.exists(os.path.join(staging_dir, "metadata.json")):
+            raise RuntimeError(f"No completed reindex in {staging_dir}")
+        staged = ExactVectors(os.path.join(staging_dir, "exact_vectors"), self.dimension)
+        staged.load(staging_dir)
+        hashes = np.load(os.path.join(staging_dir, "hashes.npy"))
+        index = None
+        if self.shards is None:
+            index = faiss.read_index(os.path.join(staging_dir, "index.bin"))
+            if index.d != self.dimension:
+                raise RuntimeError(
+                    f"Reindexed dimension {index.d} does not match index dimension {self.dimension}")
         try:
-            if path is None:
-                path = self.metadata_path
-            with open(path, 'r') as f:
-                data = json.load(f)
-                self.id_to_index = {k: v for k,
-                                    v in data['id_to_index'].items()}
-                self.index_to_id = {
-                    int(k): v for k, v in data['index_to_id'].items()}
-            logger.info(f"Loaded metadata from {path}")
+            with self._lock:
+                if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+                    raise RuntimeError("Index rebuild is in progress")
+                if self.exact_vectors is not None:
+                    self.exact_vectors.replace(staged.chunks())
+                if self.shards is not None:
+                    self.shards.clear()
+                    for article_ids, vectors in staged.chunks(10000):
+                        self.shards.upsert(article_ids, vectors)
+                else:
+                    with self._index_lock.write():
+                        self.index = index
+                    self.tombstones = 0
+                    self.trained_ntotal = index.ntotal
+                content_hashes = dict(zip(hashes[:, 0].tolist(), hashes[:, 1].tolist()))
+                if self.lexical is not None:
+                    # Статьи с изменившимся текстом переиндексируются в BM25 в sync_article_indexes
+                    self.lexical.delete([article_id for article_id, content in content_hashes.items()
+                                         if self.content_hashes.get(article_id) != content])
+                self.content_hashes = content_hashes
+                self.version += 1
+                reindex_lsn = self.reindex_lsn
+                replayed = self.replay_wal(reindex_lsn)
+                # Снапшот с новым индексом очищает журнал; при ошибке журнал и отметка сохраняются
+                self.reindex_lsn = None
+                try:
+                    self.snapshot()
+                except Exception:
+                    self.reindex_lsn = reindex_lsn
+                    raise
+                os.remove(self.reindex_lsn_path)
+        finally:
+            staged.close()
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        logger.info(
+            f"Adopted reindexed index with {self.index_size()} vectors, replayed {replayed} WAL records")
+        self.sync_article_indexes()
+        self.maybe_rebuild()
+        return {"articles": self.index_size(), "replayed_wal_records": replayed}
+
+    def sync_article_indexes(self, chunk_size: int = 1000):
+        """
+        Согласование атрибутов фильтров и лексического индекса с векторным:
+        удалённые статьи отбрасываются, недостающие (статьи из журнала после
+        снапшота, снапшоты без этих данных, переиндексация) читаются из
+        PostgreSQL — для BM25 вместе с текстом.
+        """
+        with self._lock:
+            indexed = np.fromiter(self.content_hashes, dtype=np.int64, count=len(self.content_hashes))
+        self.attributes.delete(np.setdiff1d(self.attributes.article_ids(), indexed))
+        missing_attributes = set(self.attributes.missing(indexed))
+        missing_lexical = set()
+        if self.lexical is not None:
+            self.lexical.delete(np.setdiff1d(np.asarray(self.lexical.article_ids(), dtype=np.int64), indexed))
+            missing_lexical = set(self.lexical.missing(indexed.tolist()))
+        missing = sorted(missing_attributes | missing_lexical)
+        if not missing:
+            return
+        loaded = 0
+        try:
+            if self.db is None:
+                self.db = PostgresOperator(self.config_path or "config/config_sim.yaml")
+            for start in range(0, len(missing), chunk_size):
+                chunk = missing[start:start + chunk_size]
+                if missing_lexical.intersection(chunk):
+                    articles = self.db.get_articles_by_ids(chunk)
+                    # Статьи, обновлённые из Kafka за время чтения, не перезаписываются
+                    still_missing = set(self.lexical.missing(
+                        [article.id for article in articles if article.id in missing_lexical]))
+                    self.lexical.update((article.id, self.embedding_generator.preprocess_markdown(article.text))
+                                        for article in articles if article.id in still_missing)
+                    summaries = [summarize(article) for article in articles]
+                else:
+                    summaries = self.db.get_article_summaries_by_ids(chunk)
+                still_missing = set(self.attributes.missing([summary.id for summary in summaries]))
+                summaries = [summary for summary in summaries if summary.id in still_missing]
+                self.attributes.update(summaries)
+                for summary in summaries:
+                    self.article_cache.put(summary.id, summary)
+                loaded += len(chunk)
         except Exception as e:
-            logger.error(f"Error loading metadata: {e}")
+            logger.error(f"Error loading attributes and texts of {len(missing)} articles: {e}")
+        logger.info(
+            f"Loaded {loaded}/{len(missing)} articles from PostgreSQL for filters ({len(missing_attributes)}) "
+            f"and lexical index ({len(missing_lexical)})")
+
+    def _distribute_local_index(self):
+        """Перенос векторов из локального индекса в шарды (переход в шардированный режим)."""
+        if self.shards is None or self.index.ntotal == 0:
+            return
+        article_ids, vectors = reconstruct_all(self.index)
+        self.shards.clear()
+        for start in range(0, len(article_ids), 10000):
+            self.shards.upsert(
+                article_ids[start:start + 10000], vectors[start:start + 10000])
+        self.index = build_index({"type": "flat"}, self.dimension)
+        self.tombstones = 0
+        logger.info(f"Distributed {len(article_ids)} vectors to {self.shards.count} shards")
+
+    def close(self):
+        """Сохранение финального снапшота и закрытие журнала."""
+        if self._rebuild_thread is not None:
+            self._rebuild_thread.join()
+        # Если запуск не дошёл до воспроизведения журнала, сохранять нечего
+        if self.wal is not None:
+            if self.wal.last_lsn != self.snapshot_lsn:
+                try:
+                    self.snapshot()
+                except Exception:
+                    # Изменения остаются в журнале и будут воспроизведены при запуске
+                    pass
+            self.wal.close()
+        if self.exact_vectors is not None:
+            self.exact_vectors.close()
+        if self.shards is not None:
+            self.shards.close()
+        if self.worker_pool is not None:
+            self.worker_pool.shutdown()
+        if self.embedding_generator.cache is not None:
+            self.embedding_generator.cache.flush()
+
+
+def fsync_path(path: str):
+    """fsync файла или директории, чтобы переименования пережили сбой питания."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,115 @@
+import logging
+import os
+import struct
+import zlib
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Типы операций в журнале: добавление/замена вектора статьи и удаление статьи
+OP_ADD = 1
+OP_DELETE = 2
+
+# Заголовок записи: crc32, lsn, тип операции, ID статьи, хеш содержимого
+RECORD_HEADER = struct.Struct("<IQBqq")
+
+
+class WriteAheadLog:
+    def __init__(self, path: str, dimension: int, fsync: bool = True):
+        """
+        Журнал упреждающей записи для VectorStore.
+
+        Каждая запись содержит номер (LSN), тип операции, ID статьи, хеш текста
+        статьи и (для OP_ADD) вектор float32.
+        Записи защищены CRC32, поэтому оборванный при сбое хвост журнала
+        обнаруживается и отбрасывается при чтении.
+
+        Args:
+            path (str): Путь к файлу журнала.
+            dimension (int): Размерность векторов.
+            fsync (bool): Выполнять ли fsync после каждой пачки записей.
+        """
+        self.path = path
+        self.dimension = dimension
+        self.fsync = fsync
+        self.last_lsn = 0
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Находим последний корректный LSN и обрезаем повреждённый хвост
+        valid_size = 0
+        for lsn, _, _, _, _, end in self._scan():
+            self.last_lsn = lsn
+            valid_size = end
+        if os.path.exists(self.path) and os.path.getsize(self.path) != valid_size:
+            logger.warning(
+                f"Truncating corrupted WAL tail in {self.path} at offset {valid_size}")
+            with open(self.path, "r+b") as f:
+                f.truncate(valid_size)
+        self.file = open(self.path, "ab")
+        logger.info(f"Opened WAL {self.path}, last LSN: {self.last_lsn}")
+
+    def _payload_size(self, op: int) -> int:
+        return self.dimension * 4 if op == OP_ADD else 0
+
+    def _scan(self) -> Iterator[Tuple[int, int, int, int, np.ndarray, int]]:
+        """Последовательное чтение корректных записей журнала."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            offset = 0
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                crc, lsn, op, article_id, content_hash = RECORD_HEADER.unpack(
+                    header)
+                payload = f.read(self._payload_size(op))
+                if len(payload) < self._payload_size(op):
+                    return
+                if zlib.crc32(header[4:] + payload) != crc:
+                    logger.warning(f"WAL checksum mismatch at LSN {lsn}")
+                    return
+                offset += RECORD_HEADER.size + len(payload)
+                vector = np.frombuffer(payload, dtype=np.float32)
+                yield lsn, op, article_id, content_hash, vector, offset
+
+    def append(self, records: List[Tuple[int, int, int, Optional[np.ndarray]]]) -> int:
+        """
+        Добавление пачки записей (op, article_id, content_hash, vector) в журнал.
+
+        Returns:
+            int: LSN последней записанной записи.
+        """
+        buffer = bytearray()
+        for op, article_id, content_hash, vector in records:
+            self.last_lsn += 1
+            payload = np.ascontiguousarray(
+                vector, dtype=np.float32).tobytes() if op == OP_ADD else b""
+            body = RECORD_HEADER.pack(
+                0, self.last_lsn, op, article_id, content_hash)[4:] + payload
+            buffer += struct.pack("<I", zlib.crc32(body)) + body
+        self.file.write(buffer)
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        return self.last_lsn
+
+    def replay(self, after_lsn: int = 0) -> Iterator[Tuple[int, int, int, int, np.ndarray]]:
+        """Чтение записей (lsn, op, article_id, content_hash, vector) с LSN больше after_lsn."""
+        for lsn, op, article_id, content_hash, vector, _ in self._scan():
+            if lsn > after_lsn:
+                yield lsn, op, article_id, content_hash, vector
+
+    def reset(self):
+        """Очистка журнала после сохранения снапшота (нумерация LSN продолжается)."""
+        self.file.truncate(0)
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()